@@ -0,0 +1,142 @@
+"""Notes page and note insert latency as the tables grow, with partitions.
+
+Runs once on plain tables and once on tables hash partitioned by user
+(``notes/partition.py``). Each run grows the data in steps with
+``notes.datagen`` and after each step times, for randomly chosen
+notebooks, the queries behind the notes page (the first keyset page and
+the count) and the insert of one note, committed on its own.
+
+    python benchmarks/partitions.py --database postgresql://localhost/bench
+    python benchmarks/partitions.py --database ... --steps 1000 10000 100000
+
+The database is dropped and recreated, so never point it at real data.
+Differences show once the tables no longer fit in memory, so the largest
+step should be well beyond ``shared_buffers``.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from notes import create_app, db  # noqa: E402
+from notes.datagen import generate  # noqa: E402
+from notes.models import Note, Notebook  # noqa: E402
+from notes.pagination import keyset_paginate  # noqa: E402
+from notes.partition import (  # noqa: E402
+    drop_unpartitioned, partition_tables)
+from benchmarks.routes import percentile  # noqa: E402
+
+LAYOUTS = ('plain', 'partitioned')
+
+
+def page(notebook, user):
+    keyset_paginate(
+        Note.list_query().filter(Note.notebook == notebook, Note.user == user),
+        (Note.date_created, Note.id), 8)
+    Note.query.filter_by(notebook=notebook, user=user).count()
+    db.session.commit()
+
+
+def insert(notebook, user):
+    db.session.add(Note(
+        title='benchmark', content='benchmark note', notebook=notebook,
+        user=user))
+    db.session.commit()
+
+
+def timed(action, targets):
+    samples = []
+    for notebook, user in targets:
+        started = time.perf_counter()
+        action(notebook, user)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {'p50_ms': percentile(samples, 50) * 1000,
+            'p95_ms': percentile(samples, 95) * 1000}
+
+
+def measure(samples, rng):
+    targets = db.session.query(Notebook.id, Notebook.user) \
+        .order_by(db.func.random()).limit(samples).all()
+    rng.shuffle(targets)
+    # One untimed pass, so every run starts with the same warm catalog.
+    page(*targets[0])
+    return {
+        'notes': Note.query.count(),
+        'page': timed(page, targets),
+        'insert': timed(insert, targets)}
+
+
+def run(layout, args):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': args.database,
+        'SEARCH_BACKEND': 'database',
+        'SEARCH_INDEXER_INLINE': False,
+        'DATABASE_STATEMENT_TIMEOUT': 0})
+    rng = random.Random(args.seed)
+    steps = []
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        if layout == 'partitioned':
+            partition_tables(args.partitions)
+            drop_unpartitioned()
+        users = 0
+        for target in args.steps:
+            generate(target - users, seed=args.seed, start=users,
+                     workers=args.workers,
+                     config={'SQLALCHEMY_DATABASE_URI': args.database,
+                             'SEARCH_BACKEND': 'database',
+                             'SEARCH_INDEXER_INLINE': False})
+            users = target
+            result = dict(measure(args.samples, rng), users=users)
+            steps.append(result)
+            report(layout, result)
+        db.session.remove()
+        db.engine.dispose()
+    return steps
+
+
+def report(layout, result):
+    print('{:<12} {:>8} {:>10} {:9.2f} {:9.2f} {:9.2f} {:9.2f}'.format(
+        layout, result['users'], result['notes'],
+        result['page']['p50_ms'], result['page']['p95_ms'],
+        result['insert']['p50_ms'], result['insert']['p95_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', required=True,
+                        help='PostgreSQL URL; its tables are recreated')
+    parser.add_argument('--steps', type=int, nargs='+',
+                        default=[1000, 4000, 16000],
+                        help='total users after each step')
+    parser.add_argument('--partitions', type=int, default=16)
+    parser.add_argument('--samples', type=int, default=200,
+                        help='notebooks timed after each step')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='processes generating data')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--layouts', nargs='+', choices=LAYOUTS,
+                        default=list(LAYOUTS))
+    parser.add_argument('--output', metavar='FILE')
+    args = parser.parse_args()
+
+    print('{:<12} {:>8} {:>10} {:>9} {:>9} {:>9} {:>9}'.format(
+        'layout', 'users', 'notes', 'page p50', 'page p95', 'ins p50',
+        'ins p95'))
+    results = {'settings': vars(args), 'layouts': {}}
+    for layout in args.layouts:
+        results['layouts'][layout] = run(layout, args)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
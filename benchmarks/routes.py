@@ -0,0 +1,317 @@
+"""Latency and throughput of the main routes under a scripted workload.
+
+Seeds a fixed dataset, then drives the app through its test client:
+logging in, listing notebooks, paging through notes, creating, editing
+and deleting notes, and searching. Search runs on the in-process
+``memory`` backend, fed through the outbox like Elasticsearch. Every
+route gets its request rate and p50/p95/p99 latency; ``--output`` saves
+them as JSON and ``--compare`` prints the change against an earlier run.
+
+    python benchmarks/routes.py --output before.json
+    python benchmarks/routes.py --compare before.json
+    python benchmarks/routes.py --database postgresql://localhost/bench
+
+The database is dropped and recreated, so never point it at real data.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from notes import bcrypt, create_app, db  # noqa: E402
+from notes.bulk import insert_returning_ids  # noqa: E402
+from notes.indexer import SearchIndexer  # noqa: E402
+from notes.models import (  # noqa: E402
+    Note, Notebook, SearchableMixin, Users)
+
+PASSWORD = 'bench-password'
+WORDS = (
+    'milk eggs bread butter cheese apple banana coffee tea sugar flour rice '
+    'meeting agenda project deadline report review budget invoice travel '
+    'flight hotel train ticket passport visa museum beach mountain hiking '
+    'recipe soup salad pasta pizza garden plant water seed flower tree '
+    'book chapter author library poem novel story draft idea sketch').split()
+PERCENTILES = (50, 95, 99)
+
+
+def sentence(rng, low, high, limit):
+    return ' '.join(rng.choice(WORDS)
+                    for _ in range(rng.randint(low, high)))[:limit]
+
+
+def seed(rng, users, notebooks, notes):
+    """Load the dataset and index it; returns ``{email: [notebook ids]}``."""
+    password = bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    user_ids = insert_returning_ids(Users.__table__, [
+        {'username': 'bench{}'.format(n), 'password': password,
+         'email': 'bench{}@example.com'.format(n), 'confirmed': True}
+        for n in range(users)])
+    dataset = {}
+    changes = []
+    for n, user in enumerate(user_ids):
+        notebook_ids = insert_returning_ids(Notebook.__table__, [
+            {'name': sentence(rng, 1, 2, 20), 'user': user}
+            for _ in range(notebooks)])
+        changes += [('notebook', id, 'index', user) for id in notebook_ids]
+        for notebook in notebook_ids:
+            note_ids = insert_returning_ids(Note.__table__, [
+                {'notebook': notebook, 'user': user,
+                 'title': sentence(rng, 1, 4, 30),
+                 'content': sentence(rng, 5, 60, 500)}
+                for _ in range(notes)])
+            changes += [('note', id, 'index', user) for id in note_ids]
+        dataset['bench{}@example.com'.format(n)] = notebook_ids
+    SearchableMixin.record_changes(db.session, changes)
+    db.session.commit()
+    drain()
+    return dataset
+
+
+def drain():
+    indexer = SearchIndexer()
+    while indexer.drain():
+        pass
+
+
+class Session(object):
+    """One logged-in user with their own test client.
+
+    Requests made through ``get`` and ``post`` are timed into ``recorded``;
+    anything else an action does, such as looking up ids, is not.
+    """
+
+    def __init__(self, app, email, notebooks):
+        self.app = app
+        self.client = app.test_client()
+        self.email = email
+        self.notebooks = notebooks
+        self.created = []
+        self.recorded = []
+
+    def get(self, url):
+        return self._timed(self.client.get, url)
+
+    def post(self, url, data):
+        return self._timed(self.client.post, url, data=data)
+
+    def _timed(self, method, *args, **kwargs):
+        started = time.perf_counter()
+        response = method(*args, **kwargs)
+        self.recorded.append(
+            (time.perf_counter() - started, response.status_code))
+        return response
+
+
+def login(session, rng):
+    session.client.get('/logout')
+    session.post('/login', {'email': session.email, 'password': PASSWORD})
+
+
+def list_notebooks(session, rng):
+    session.get('/home')
+
+
+def page_notes(session, rng):
+    """The first notes page of a notebook, then up to three more."""
+    notebook = rng.choice(session.notebooks)
+    response = session.get('/notes/{}'.format(notebook))
+    for _ in range(3):
+        cursor = re.search(r'after=([\w=-]+)', response.data.decode())
+        if cursor is None:
+            break
+        response = session.get(
+            '/notes/{}?after={}'.format(notebook, cursor.group(1)))
+
+
+def create_note(session, rng):
+    notebook = rng.choice(session.notebooks)
+    session.post('/notes/{}'.format(notebook), {
+        'title': sentence(rng, 1, 4, 30),
+        'content': sentence(rng, 5, 60, 500)})
+    with session.app.app_context():
+        note = Note.query.filter_by(notebook=notebook) \
+            .order_by(Note.id.desc()).first()
+        session.created.append((note.id, notebook))
+
+
+def update_note(session, rng):
+    if session.created:
+        note, notebook = rng.choice(session.created)
+        session.post('/update/{}/{}'.format(note, notebook), {
+            'title': sentence(rng, 1, 4, 30),
+            'content': sentence(rng, 5, 60, 500)})
+
+
+def delete_note(session, rng):
+    if session.created:
+        note, notebook = session.created.pop()
+        session.get('/delete/{}/{}'.format(note, notebook))
+
+
+def search_notebooks(session, rng):
+    session.get('/search?search=' + rng.choice(WORDS)[:3])
+
+
+def search_notes(session, rng):
+    session.get('/{}/search-note?search={}'.format(
+        rng.choice(session.notebooks), rng.choice(WORDS)))
+
+
+# (route, action, drain the outbox afterwards)
+WORKLOAD = (
+    ('login', login, False),
+    ('list_notebooks', list_notebooks, False),
+    ('page_notes', page_notes, False),
+    ('create_note', create_note, True),
+    ('update_note', update_note, True),
+    ('delete_note', delete_note, True),
+    ('search_notebooks', search_notebooks, False),
+    ('search_notes', search_notes, False),
+)
+
+
+def run(app, sessions, rng, iterations, warmup):
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    for iteration in range(warmup + iterations):
+        for route, action, writes in WORKLOAD:
+            for session in sessions:
+                session.recorded = []
+                action(session, rng)
+                if iteration < warmup:
+                    continue
+                for elapsed, status in session.recorded:
+                    timings[route].append(elapsed)
+                    errors[route] += status >= 400
+            if writes:
+                with app.app_context():
+                    drain()
+    return timings, errors
+
+
+def percentile(ordered, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[rank - 1]
+
+
+def summarize(timings, errors):
+    routes = {}
+    for route, samples in timings.items():
+        ordered = sorted(samples)
+        summary = {
+            'requests': len(ordered),
+            'errors': errors[route],
+            'per_second': len(ordered) / sum(ordered),
+            'mean_ms': sum(ordered) / len(ordered) * 1000}
+        for percent in PERCENTILES:
+            summary['p{}_ms'.format(percent)] = \
+                percentile(ordered, percent) * 1000
+        routes[route] = summary
+    return routes
+
+
+def revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results, baseline=None):
+    print('{} on {}, {} passes by {} users'.format(
+        results['revision'] or 'working tree', results['database'],
+        results['settings']['iterations'], results['settings']['users']))
+    print('{:<18} {:>8} {:>9} {:>9} {:>9} {:>7}'.format(
+        'route', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+    for route, summary in results['routes'].items():
+        print('{:<18} {:8.1f} {:9.2f} {:9.2f} {:9.2f} {:7d}'.format(
+            route, summary['per_second'], summary['p50_ms'],
+            summary['p95_ms'], summary['p99_ms'], summary['errors']))
+    if baseline is None:
+        return
+    print('\nchange against {}'.format(
+        baseline.get('revision') or 'baseline'))
+    print('{:<18} {:>9} {:>9} {:>9}'.format('route', 'p50', 'p95', 'p99'))
+    for route, summary in results['routes'].items():
+        before = baseline['routes'].get(route)
+        if before is None:
+            continue
+        print('{:<18} {:>9} {:>9} {:>9}'.format(route, *(
+            '{:+.1%}'.format(summary[key] / before[key] - 1)
+            for key in ('p50_ms', 'p95_ms', 'p99_ms'))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--database', help='SQLAlchemy URL (a temporary SQLite file by '
+        'default); its tables are dropped and recreated')
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--notebooks', type=int, default=10,
+                        help='notebooks per user')
+    parser.add_argument('--notes', type=int, default=50,
+                        help='notes per notebook')
+    parser.add_argument('--iterations', type=int, default=50,
+                        help='passes over the workload, per user')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', metavar='FILE')
+    parser.add_argument('--compare', metavar='FILE')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = args.database or 'sqlite:///' + os.path.join(
+            directory, 'bench.db')
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': database,
+            'SEARCH_BACKEND': 'memory',
+            'SEARCH_INDEXER_INLINE': False,
+            'WTF_CSRF_ENABLED': False,
+            'MAIL_SUPPRESS_SEND': True,
+            'DEBUG': False})
+        rng = random.Random(args.seed)
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            dataset = seed(rng, args.users, args.notebooks, args.notes)
+            dialect = db.engine.dialect.name
+        sessions = [Session(app, email, notebooks)
+                    for email, notebooks in dataset.items()]
+        for session in sessions:
+            login(session, rng)
+        timings, errors = run(
+            app, sessions, rng, args.iterations, args.warmup)
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+
+    results = {
+        'revision': revision(),
+        'database': dialect,
+        'settings': vars(args),
+        'routes': summarize(timings, errors)}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as previous:
+            baseline = json.load(previous)
+    report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
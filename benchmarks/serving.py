@@ -0,0 +1,254 @@
+"""Requests per second per GB of memory, sync workers against gevent.
+
+Generates users with ``notes.datagen`` and then starts gunicorn twice on the
+same database. The first run uses sync workers (``run:app``) and the second
+gevent workers (``serve_async:app``). Each server is driven for
+``--duration`` seconds by ``--concurrency`` clients, each logged in as its
+own user, sending a mix of searches, notes pages and notebook lists.
+Memory is the resident set of the gunicorn master and its workers, read
+from /proc, so this runs on Linux only.
+
+    python benchmarks/serving.py --database postgresql://localhost/bench
+    python benchmarks/serving.py --database ... --workers 4 --concurrency 64
+
+The database is dropped and recreated, so never point it at real data.
+Set ``SEARCH_BACKEND``/``ELASTICSEARCH_URL`` in the environment to include
+Elasticsearch; by default searches use PostgreSQL.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from notes import create_app, db  # noqa: E402
+from notes.datagen import Generator, generate  # noqa: E402
+from notes.models import Notebook, Users  # noqa: E402
+
+PASSWORD = 'password'
+PREFIX = 'serve'
+MODES = {
+    'sync': ['run:app'],
+    'gevent': ['-k', 'gevent', 'serve_async:app'],
+}
+
+
+def seed(database, users, seed):
+    """Load the users; returns ``[(email, [notebook ids])]``."""
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database, 'SEARCH_INDEXER_INLINE': False})
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        generate(users, seed=seed, prefix=PREFIX, password=PASSWORD)
+        accounts = []
+        for user in Users.query.order_by(Users.id):
+            accounts.append((user.email, [
+                id for id, in db.session.query(Notebook.id)
+                .filter_by(user=user.id).order_by(Notebook.id)]))
+        db.session.remove()
+        db.engine.dispose()
+    return accounts
+
+
+class Client(object):
+    """A logged-in browser session over plain HTTP."""
+
+    def __init__(self, base, email, notebooks, words, rng):
+        self.base = base
+        self.notebooks = notebooks
+        self.words = words
+        self.rng = rng
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        page = self.fetch('/login')
+        token = re.search(
+            r'name="csrf_token" type="hidden" value="([^"]+)"', page)
+        self.fetch('/login', {
+            'csrf_token': token.group(1) if token else '',
+            'email': email, 'password': PASSWORD})
+
+    def fetch(self, path, form=None):
+        data = urllib.parse.urlencode(form).encode() if form else None
+        with self.opener.open(self.base + path, data, timeout=60) as reply:
+            return reply.read().decode()
+
+    def next_path(self):
+        roll = self.rng.random()
+        if roll < 0.4:
+            return '/search?search=' + self.rng.choice(self.words)
+        if roll < 0.8:
+            return '/notes/{}'.format(self.rng.choice(self.notebooks))
+        return '/home'
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def wait_for(base, server, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('gunicorn exited with {}'.format(
+                server.returncode))
+        try:
+            urllib.request.urlopen(base + '/login', timeout=2).close()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start')
+
+
+def resident_bytes(pid):
+    """Resident memory of ``pid`` and all of its children."""
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open('/proc/{}/stat'.format(entry)) as stat:
+                    parents[int(entry)] = int(
+                        stat.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                pass
+    family = {pid}
+    grown = True
+    while grown:
+        children = {child for child, parent in parents.items()
+                    if parent in family} - family
+        family |= children
+        grown = bool(children)
+    total = 0
+    for member in family:
+        try:
+            with open('/proc/{}/status'.format(member)) as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+def drive(clients, duration):
+    latencies = []
+    failures = []
+    stop = time.monotonic() + duration
+
+    def work(client):
+        while time.monotonic() < stop:
+            started = time.perf_counter()
+            try:
+                client.fetch(client.next_path())
+            except (urllib.error.URLError, OSError) as error:
+                failures.append(error)
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=work, args=(client,))
+               for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, failures
+
+
+def run(mode, args, accounts, words):
+    port = free_port()
+    base = 'http://127.0.0.1:{}'.format(port)
+    env = dict(os.environ, DATABASE_URL=args.database,
+               SEARCH_INDEXER_INLINE='0')
+    command = [sys.executable, '-m', 'gunicorn', '-b', '127.0.0.1:{}'.format(
+        port), '-w', str(args.workers), '--worker-connections',
+        str(args.concurrency), '--log-level', 'warning'] + MODES[mode]
+    server = subprocess.Popen(command, cwd=ROOT, env=env)
+    try:
+        wait_for(base, server)
+        rng = random.Random(args.seed)
+        clients = [
+            Client(base, *accounts[number % len(accounts)], words,
+                   random.Random(rng.random()))
+            for number in range(args.concurrency)]
+        drive(clients, args.warmup)
+        peak = [resident_bytes(server.pid)]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(0.5):
+                peak.append(resident_bytes(server.pid))
+
+        sampler = threading.Thread(target=sample)
+        sampler.start()
+        latencies, failures = drive(clients, args.duration)
+        done.set()
+        sampler.join()
+    finally:
+        server.terminate()
+        server.wait()
+    latencies.sort()
+    rate = len(latencies) / args.duration
+    memory = max(peak)
+    return {
+        'requests': len(latencies),
+        'failures': len(failures),
+        'per_second': rate,
+        'p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else None,
+        'p95_ms': latencies[int(len(latencies) * .95)] * 1000
+        if latencies else None,
+        'memory_mb': memory / 2 ** 20,
+        'per_second_per_gb': rate / (memory / 2 ** 30)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', required=True,
+                        help='PostgreSQL URL; its tables are recreated')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=2,
+                        help='gunicorn worker processes in both modes')
+    parser.add_argument('--concurrency', type=int, default=32,
+                        help='clients sending requests at the same time')
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--modes', nargs='+', choices=list(MODES),
+                        default=list(MODES))
+    parser.add_argument('--output', metavar='FILE')
+    args = parser.parse_args()
+
+    accounts = seed(args.database, args.users, args.seed)
+    words = [word for word in Generator(args.seed).vocabulary[:200]
+             if len(word) >= 3]
+    results = {'settings': vars(args), 'modes': {}}
+    print('{:<8} {:>8} {:>8} {:>8} {:>9} {:>10} {:>6}'.format(
+        'mode', 'req/s', 'p50 ms', 'p95 ms', 'RSS MB', 'req/s/GB',
+        'failed'))
+    for mode in args.modes:
+        result = run(mode, args, accounts, words)
+        results['modes'][mode] = result
+        print('{:<8} {:8.1f} {:8.1f} {:8.1f} {:9.1f} {:10.1f} {:6d}'.format(
+            mode, result['per_second'], result['p50_ms'] or 0,
+            result['p95_ms'] or 0, result['memory_mb'],
+            result['per_second_per_gb'], result['failures']))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Worker start-up cost: time to import the app and build it.
+
+Each run is a fresh interpreter that imports ``notes`` and creates the
+application, as a prefork server worker would, and counts the database
+connections opened along the way. ``--against REV`` measures another
+commit the same way for comparison.
+
+    python benchmarks/startup.py --runs 10 --against HEAD~1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, time
+import psycopg2
+connections = []
+connect = psycopg2.connect
+def counting_connect(*args, **kwargs):
+    connections.append(1)
+    return connect(*args, **kwargs)
+psycopg2.connect = counting_connect
+started = time.perf_counter()
+import notes
+app = notes.create_app() if hasattr(notes, 'create_app') else notes.app
+print(json.dumps({
+    'seconds': time.perf_counter() - started,
+    'connections': len(connections)}))
+'''
+
+
+def measure(path, runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE], cwd=path, check=True,
+            stdout=subprocess.PIPE, universal_newlines=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'median_ms': statistics.median(r['seconds'] for r in results) * 1000,
+        'connections': max(r['connections'] for r in results)}
+
+
+def checkout(rev, directory):
+    archive = os.path.join(directory, 'tree.tar')
+    subprocess.run(
+        ['git', 'archive', '--format=tar', '-o', archive, rev],
+        cwd=ROOT, check=True)
+    with tarfile.open(archive) as tar:
+        tar.extractall(directory)
+    return directory
+
+
+def report(label, result):
+    print('{:<12} {:8.1f} ms  {} database connections'.format(
+        label, result['median_ms'], result['connections']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--against', metavar='REV')
+    args = parser.parse_args()
+
+    report('working tree', measure(ROOT, args.runs))
+    if args.against:
+        with tempfile.TemporaryDirectory() as directory:
+            report(args.against, measure(
+                checkout(args.against, directory), args.runs))
+
+
+if __name__ == '__main__':
+    main()
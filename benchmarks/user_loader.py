@@ -0,0 +1,76 @@
+"""Database queries saved by the cached Flask-Login user loader.
+
+Logs a user in, then requests an authenticated page repeatedly with the
+user cache on and off, counting the SQL statements each request issues.
+
+    python benchmarks/user_loader.py --requests 200
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from notes import bcrypt, create_app, db  # noqa: E402
+from notes.models import Users, get_user_cache  # noqa: E402
+
+EMAIL = 'bench-user-loader@example.com'
+PASSWORD = 'bench-password'
+
+
+def ensure_user():
+    user = Users.query.filter_by(email=EMAIL).first()
+    if user is None:
+        user = Users(
+            username='bench-user-loader',
+            email=EMAIL,
+            password=bcrypt.generate_password_hash(PASSWORD).decode('utf-8'),
+            confirmed=True)
+        db.session.add(user)
+        db.session.commit()
+
+
+def run(app, path, requests, cached):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        get_user_cache().ttl = app.config['USER_CACHE_TTL'] if cached else 0
+        engine = db.engine
+    client = app.test_client()
+    client.post('/login', data={'email': EMAIL, 'password': PASSWORD})
+    db.event.listen(engine, 'before_cursor_execute', count)
+    started = time.perf_counter()
+    try:
+        for _ in range(requests):
+            client.get(path)
+    finally:
+        elapsed = time.perf_counter() - started
+        db.event.remove(engine, 'before_cursor_execute', count)
+    return len(statements) / requests, elapsed / requests * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--path', default='/home')
+    args = parser.parse_args()
+
+    app = create_app({
+        'WTF_CSRF_ENABLED': False, 'SEARCH_INDEXER_INLINE': False})
+    with app.app_context():
+        ensure_user()
+    results = {}
+    for cached in (False, True):
+        results[cached] = run(app, args.path, args.requests, cached)
+        print('{:<10} {:6.2f} queries/request  {:7.2f} ms/request'.format(
+            'cached' if cached else 'uncached', *results[cached]))
+    print('saved {:.2f} queries per request'.format(
+        results[False][0] - results[True][0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Initial schema: users, notebooks and notes
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=30), nullable=False),
+        sa.Column('email', sa.String(length=150), nullable=False),
+        sa.Column('password', sa.String(length=70), nullable=False),
+        sa.Column('confirmed', sa.Boolean(), nullable=False),
+        sa.Column('confirmed_on', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'notebook',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=20), nullable=False),
+        sa.Column('user', sa.Integer(), nullable=False),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'note',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('notebook', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=30), nullable=False),
+        sa.Column('content', sa.String(length=500), nullable=False),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['notebook'], ['notebook.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('note')
+    op.drop_table('notebook')
+    op.drop_table('users')
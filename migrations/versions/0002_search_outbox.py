@@ -0,0 +1,52 @@
+"""Search outbox and full-text indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'search_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('index', sa.String(length=30), nullable=False),
+        sa.Column('doc_id', sa.Integer(), nullable=False),
+        sa.Column('op', sa.String(length=10), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('available_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_search_outbox_available_at', 'search_outbox', ['available_at'])
+    # Built concurrently, so the tables stay writable while the GIN
+    # indexes are built.
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY ix_notebook_search ON notebook "
+            "USING gin (to_tsvector('simple', name))")
+        op.execute(
+            "CREATE INDEX CONCURRENTLY ix_note_search ON note "
+            "USING gin (to_tsvector('simple', title || ' ' || content))")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_note_search', table_name='note',
+            postgresql_concurrently=True)
+        op.drop_index(
+            'ix_notebook_search', table_name='notebook',
+            postgresql_concurrently=True)
+    op.drop_index('ix_search_outbox_available_at', table_name='search_outbox')
+    op.drop_table('search_outbox')
@@ -0,0 +1,43 @@
+"""Indexes for the hot lookup columns
+
+The indexes are built concurrently, outside the migration transaction, so
+existing tables stay writable while they are created. The unique indexes
+fail if duplicate emails or usernames already exist; clean those up first.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 09:20:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_note_notebook_date_created', 'note', ['notebook', 'date_created'],
+     False),
+    ('ix_notebook_user_date_created', 'notebook', ['user', 'date_created'],
+     False),
+    ('ux_users_email', 'users', ['email'], True),
+    ('ux_users_username', 'users', ['username'], True),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in INDEXES:
+            op.create_index(
+                name, table, columns, unique=unique,
+                postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in reversed(INDEXES):
+            op.drop_index(
+                name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,37 @@
+"""Cover the note list keyset with (notebook, date_created, id)
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_note_notebook_date_created_id', 'note',
+            ['notebook', 'date_created', 'id'],
+            postgresql_concurrently=True)
+        op.drop_index(
+            'ix_note_notebook_date_created', table_name='note',
+            postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_note_notebook_date_created', 'note',
+            ['notebook', 'date_created'],
+            postgresql_concurrently=True)
+        op.drop_index(
+            'ix_note_notebook_date_created_id', table_name='note',
+            postgresql_concurrently=True)
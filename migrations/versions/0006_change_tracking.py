@@ -0,0 +1,93 @@
+"""Track updates with updated_at and deletes with tombstones
+
+updated_at is filled from date_created in batches of ids, each committed
+on its own, and a column default fills it for rows the previous release
+inserts. NOT NULL is proven by a constraint validated in a transaction
+of its own, without blocking writes.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 12:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+# Children first, in the order inserts into note lock the tables for the
+# foreign key check, so the new columns do not deadlock with them.
+TABLES = ('note', 'notebook')
+BATCH_SIZE = 10000
+
+BACKFILL = (
+    "UPDATE {} SET updated_at = coalesce(date_created, "
+    "now() at time zone 'utc') "
+    "WHERE updated_at IS NULL AND id > :start AND id <= :stop")
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime()))
+        # Set after adding the column, so it only applies to new rows; the
+        # previous release does not know the column.
+        op.execute(
+            "ALTER TABLE {} ALTER COLUMN updated_at "
+            "SET DEFAULT (now() at time zone 'utc')".format(table))
+    op.create_table(
+        'tombstone',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=30), nullable=False),
+        sa.Column('object_id', sa.Integer(), nullable=False),
+        sa.Column('user', sa.Integer(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_tombstone_user_deleted_at', 'tombstone',
+        ['user', 'deleted_at', 'id'])
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        for table in TABLES:
+            backfill = sa.text(BACKFILL.format(table))
+            last = bind.execute(
+                'SELECT max(id) FROM {}'.format(table)).scalar() or 0
+            for start in range(0, last, BATCH_SIZE):
+                bind.execute(backfill, start=start, stop=start + BATCH_SIZE)
+            op.execute(
+                'ALTER TABLE {0} ADD CONSTRAINT {0}_updated_at_not_null '
+                'CHECK (updated_at IS NOT NULL) NOT VALID'.format(table))
+            op.execute(
+                'ALTER TABLE {0} VALIDATE CONSTRAINT '
+                '{0}_updated_at_not_null'.format(table))
+            # The validated check lets SET NOT NULL skip its table scan.
+            op.alter_column(table, 'updated_at', nullable=False)
+            op.drop_constraint('{}_updated_at_not_null'.format(table), table)
+        op.create_index(
+            'ix_notebook_user_updated_at', 'notebook',
+            ['user', 'updated_at', 'id'],
+            postgresql_concurrently=True)
+        op.create_index(
+            'ix_note_notebook_updated_at_id', 'note',
+            ['notebook', 'updated_at', 'id'],
+            postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_note_notebook_updated_at_id', table_name='note',
+            postgresql_concurrently=True)
+        op.drop_index(
+            'ix_notebook_user_updated_at', table_name='notebook',
+            postgresql_concurrently=True)
+    op.drop_index('ix_tombstone_user_deleted_at', table_name='tombstone')
+    op.drop_table('tombstone')
+    op.drop_column('note', 'updated_at')
+    op.drop_column('notebook', 'updated_at')
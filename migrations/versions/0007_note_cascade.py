@@ -0,0 +1,35 @@
+"""Delete notes with their notebook through ON DELETE CASCADE
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def replace_foreign_key(on_delete):
+    # NOT VALID skips the full table check while the lock is held; the
+    # check runs in a transaction of its own, under a lock that does not
+    # block writes.
+    op.execute(
+        'ALTER TABLE note DROP CONSTRAINT note_notebook_fkey, '
+        'ADD CONSTRAINT note_notebook_fkey FOREIGN KEY (notebook) '
+        'REFERENCES notebook (id) {} NOT VALID'.format(on_delete))
+    with op.get_context().autocommit_block():
+        op.execute('ALTER TABLE note VALIDATE CONSTRAINT note_notebook_fkey')
+
+
+def upgrade():
+    replace_foreign_key('ON DELETE CASCADE')
+
+
+def downgrade():
+    replace_foreign_key('')
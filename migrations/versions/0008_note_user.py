@@ -0,0 +1,89 @@
+"""Copy the owner of each note's notebook onto the note
+
+The column is filled in batches of ids, each committed on its own, so no
+lock is held on the whole table. A trigger fills it for notes written
+without it, so the old code keeps working during the deploy. NOT NULL is
+proven by a constraint that is validated in a transaction of its own,
+without blocking writes, and the index for syncing by user replaces the
+one by notebook.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+BACKFILL = sa.text(
+    'UPDATE note SET "user" = notebook."user" FROM notebook '
+    'WHERE notebook.id = note.notebook AND note."user" IS NULL '
+    'AND note.id > :start AND note.id <= :stop')
+
+FILL_FUNCTION = """
+CREATE FUNCTION note_fill_user() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    SELECT "user" INTO NEW."user" FROM notebook WHERE id = NEW.notebook;
+    RETURN NEW;
+END
+$$"""
+
+
+def upgrade():
+    op.add_column('note', sa.Column('user', sa.Integer(), nullable=True))
+    # Committed with the column, so every note written from here on has
+    # its owner and the batches below only have to reach the current end.
+    op.execute(FILL_FUNCTION)
+    op.execute(
+        'CREATE TRIGGER note_fill_user BEFORE INSERT OR UPDATE ON note '
+        'FOR EACH ROW WHEN (NEW."user" IS NULL) '
+        'EXECUTE FUNCTION note_fill_user()')
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        last = bind.execute('SELECT max(id) FROM note').scalar() or 0
+        for start in range(0, last, BATCH_SIZE):
+            bind.execute(BACKFILL, start=start, stop=start + BATCH_SIZE)
+        # Each statement commits on its own: adding the constraints locks
+        # the table only briefly, and validating them does not block
+        # writes.
+        op.execute(
+            'ALTER TABLE note ADD CONSTRAINT note_user_not_null '
+            'CHECK ("user" IS NOT NULL) NOT VALID, '
+            'ADD CONSTRAINT note_user_fkey FOREIGN KEY ("user") '
+            'REFERENCES users (id) NOT VALID')
+        op.execute('ALTER TABLE note VALIDATE CONSTRAINT note_user_not_null')
+        op.execute('ALTER TABLE note VALIDATE CONSTRAINT note_user_fkey')
+        # The validated check lets SET NOT NULL skip its table scan.
+        op.alter_column('note', 'user', nullable=False)
+        op.drop_constraint('note_user_not_null', 'note')
+        op.create_index(
+            'ix_note_user_updated_at_id', 'note',
+            ['user', 'updated_at', 'id'],
+            postgresql_concurrently=True)
+        op.drop_index(
+            'ix_note_notebook_updated_at_id', table_name='note',
+            postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_note_notebook_updated_at_id', 'note',
+            ['notebook', 'updated_at', 'id'],
+            postgresql_concurrently=True)
+        op.drop_index(
+            'ix_note_user_updated_at_id', table_name='note',
+            postgresql_concurrently=True)
+    op.execute('DROP TRIGGER IF EXISTS note_fill_user ON note')
+    op.execute('DROP FUNCTION IF EXISTS note_fill_user()')
+    op.drop_column('note', 'user')
@@ -0,0 +1,55 @@
+"""Make date_created NOT NULL, as it is part of the notes page key
+
+Rows without one get their updated_at, in batches of ids committed on
+their own. NOT NULL is proven by a constraint validated in a transaction
+of its own, without blocking writes, as in 0008.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+TABLES = ('notebook', 'note')
+BATCH_SIZE = 10000
+
+BACKFILL = (
+    'UPDATE {0} SET date_created = updated_at '
+    'WHERE date_created IS NULL AND id > :start AND id <= :stop')
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        for table in TABLES:
+            backfill = sa.text(BACKFILL.format(table))
+            last = bind.execute(
+                'SELECT max(id) FROM {}'.format(table)).scalar() or 0
+            # Up to the last id at all: the app always sets the column,
+            # so rows added meanwhile have it.
+            for start in range(0, last, BATCH_SIZE):
+                bind.execute(backfill, start=start, stop=start + BATCH_SIZE)
+            op.execute(
+                'ALTER TABLE {0} ADD CONSTRAINT {0}_date_created_not_null '
+                'CHECK (date_created IS NOT NULL) NOT VALID'.format(table))
+            op.execute(
+                'ALTER TABLE {0} VALIDATE CONSTRAINT '
+                '{0}_date_created_not_null'.format(table))
+            # The validated check lets SET NOT NULL skip its table scan.
+            op.alter_column(table, 'date_created', nullable=False)
+            op.drop_constraint(
+                '{}_date_created_not_null'.format(table), table)
+
+
+def downgrade():
+    for table in TABLES:
+        op.alter_column(table, 'date_created', nullable=True)
@@ -0,0 +1,27 @@
+"""Record the user of each search outbox row
+
+The indexer drops the user's cached searches once the change is visible.
+Rows queued before this revision, or by the previous release, have none.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 21:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('search_outbox', sa.Column('user', sa.Integer()))
+
+
+def downgrade():
+    op.drop_column('search_outbox', 'user')
@@ -0,0 +1,369 @@
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from flask import (
+    Blueprint, Response, abort, current_app, jsonify, request,
+    stream_with_context)
+from flask_login import current_user, login_required
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+from werkzeug.exceptions import HTTPException
+
+from notes import bcrypt, db, login_manager
+from notes.bulk import WRITE_ERRORS, fits, insert_returning_ids
+from notes.models import Note, Notebook, SearchableMixin, Users, load_user
+from notes.sync import DELETED, NOTE, changes_since, decode_sync_cursor
+from notes.pagination import decode_cursor, keyset_paginate
+from notes.transfer import FORMATS, ImportFailed, export_notes, import_notes
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+login_manager.blueprint_login_views['api'] = None
+
+
+class ItemError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def api_serializer(expires_sec=None):
+    return Serializer(
+        current_app.config['SECRET_KEY'], expires_sec, salt='api')
+
+
+@login_manager.request_loader
+def load_user_from_token(request):
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    try:
+        user_id = api_serializer().loads(header[len('Bearer '):])['user_id']
+    except Exception:
+        return None
+    return load_user(user_id)
+
+
+@bp.errorhandler(HTTPException)
+def http_error(error):
+    return jsonify(error=error.description), error.code
+
+
+def notebook_json(notebook):
+    return {
+        'id': notebook.id,
+        'name': notebook.name,
+        'date_created': notebook.date_created.isoformat(),
+        'updated_at': notebook.updated_at.isoformat()}
+
+
+def note_json(note):
+    return {
+        'id': note.id,
+        'notebook': note.notebook,
+        'title': note.title,
+        'content': note.content,
+        'date_created': note.date_created.isoformat(),
+        'updated_at': note.updated_at.isoformat()}
+
+
+def tombstone_json(tombstone):
+    return {
+        'id': tombstone.object_id,
+        'deleted_at': tombstone.deleted_at.isoformat()}
+
+
+def list_etag(query, updated_at, *extra):
+    """ETag for a list, from its size and newest change only."""
+    count, newest = query.with_entities(
+        db.func.count(), db.func.max(updated_at)).one()
+    key = json.dumps([count, newest and newest.isoformat()] + list(extra))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def read_batch():
+    batch = request.get_json(silent=True)
+    if not isinstance(batch, dict):
+        abort(400, 'Expected a JSON object')
+    for action in ('create', 'update', 'delete'):
+        batch.setdefault(action, [])
+        if not isinstance(batch[action], list):
+            abort(400, '{} must be a list'.format(action))
+    size = len(batch['create']) + len(batch['update']) + len(batch['delete'])
+    if size > current_app.config['API_BATCH_LIMIT']:
+        abort(413, 'At most {} items per batch'.format(
+            current_app.config['API_BATCH_LIMIT']))
+    return batch
+
+
+def validate(items, check, status):
+    """Run ``check`` on every item.
+
+    Returns the per-item results, and ``(result, value)`` pairs for the
+    items that passed so the result can be filled in once they are written.
+    """
+    results = []
+    valid = []
+    for item in items:
+        try:
+            value = check(item)
+        except ItemError as error:
+            results.append({'status': error.status, 'error': str(error)})
+        else:
+            result = {'status': status}
+            results.append(result)
+            valid.append((result, value))
+    return results, valid
+
+
+def is_id(value):
+    # JSON true and false arrive as bools, which are ints too.
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def item_id(item, owned):
+    id = item.get('id') if isinstance(item, dict) else item
+    if not is_id(id):
+        raise ItemError(400, 'id must be an integer')
+    if id not in owned:
+        raise ItemError(404, '{} not found'.format(id))
+    return id
+
+
+def text_field(item, model, field, required):
+    if not isinstance(item, dict):
+        raise ItemError(400, 'Expected an object')
+    value = item.get(field)
+    if value is None and not required:
+        return None
+    if not fits(model, field, value):
+        raise ItemError(400, '{} must be 1 to {} characters'.format(
+            field, model.__table__.c[field].type.length))
+    return value
+
+
+def commit_batch(model, created, updated, deleted):
+    """Write a validated batch in one transaction."""
+    try:
+        ids = insert_returning_ids(
+            model.__table__, [row for result, row in created])
+        for (result, row), id in zip(created, ids):
+            result['id'] = id
+        if updated:
+            db.session.bulk_update_mappings(
+                model, [row for result, row in updated])
+        model.bulk_delete(
+            sorted({id for result, id in deleted}), current_user.id)
+        SearchableMixin.record_changes(db.session, [
+            (model.__tablename__, result['id'], 'index', current_user.id)
+            for result, row in created + updated])
+        db.session.commit()
+    except WRITE_ERRORS:
+        db.session.rollback()
+        current_app.logger.exception('Batch write failed')
+        abort(409, 'The batch could not be written, nothing was changed')
+
+
+@bp.route('/tokens', methods=['POST'])
+def create_token():
+    credentials = request.get_json(silent=True) or {}
+    user = Users.query.filter_by(email=credentials.get('email')).first()
+    if user is None or not bcrypt.check_password_hash(
+            user.password, credentials.get('password') or ''):
+        abort(401, 'Invalid email or password')
+    expires = current_app.config['API_TOKEN_TTL']
+    token = api_serializer(expires).dumps({'user_id': user.id})
+    return jsonify(token=token.decode('utf-8'), expires_in=expires), 201
+
+
+@bp.route('/notebooks')
+@login_required
+@db.read_only
+def notebooks():
+    notebooks = Notebook.query.filter_by(user=current_user.id)
+    etag = list_etag(notebooks, Notebook.updated_at)
+    if etag in request.if_none_match:
+        return not_modified(etag)
+    response = jsonify(notebooks=[
+        notebook_json(nb) for nb in notebooks.order_by(Notebook.id)])
+    response.set_etag(etag)
+    return response
+
+
+@bp.route('/notebooks/<int:id>/notes')
+@login_required
+@db.read_only
+def notebook_notes(id):
+    Notebook.query.filter_by(id=id, user=current_user.id).first_or_404()
+    columns = (Note.date_created, Note.id)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    after = request.args.get('after')
+    query = Note.query.filter_by(notebook=id, user=current_user.id)
+    etag = list_etag(query, Note.updated_at, limit, after)
+    if etag in request.if_none_match:
+        return not_modified(etag)
+    page = keyset_paginate(
+        query, columns, limit, after=decode_cursor(after, columns))
+    response = jsonify(
+        notes=[note_json(note) for note in page.items],
+        next=page.next_cursor)
+    response.set_etag(etag)
+    return response
+
+
+@bp.route('/changes')
+@login_required
+@db.read_only
+def changes():
+    cursor = request.args.get('since')
+    if cursor:
+        try:
+            cursor = decode_sync_cursor(cursor)
+        except ValueError:
+            abort(400, 'Malformed cursor')
+        retention = timedelta(
+            days=current_app.config['SYNC_TOMBSTONE_DAYS'])
+        if cursor[0] < datetime.utcnow() - retention:
+            abort(410, 'Cursor expired, sync again from the start')
+    limit = min(max(request.args.get('limit', 500, type=int), 1), 1000)
+    found, cursor, more = changes_since(
+        current_user.id, cursor or None, limit,
+        current_app.config['SYNC_SETTLE_SECONDS'])
+    items = []
+    for source, obj in found:
+        if source == DELETED:
+            item = dict(tombstone_json(obj), type=obj.kind, op='delete')
+        elif source == NOTE:
+            item = dict(note_json(obj), type='note', op='upsert')
+        else:
+            item = dict(notebook_json(obj), type='notebook', op='upsert')
+        items.append(item)
+    return jsonify(changes=items, next=cursor, more=more)
+
+
+@bp.route('/notebooks/batch', methods=['POST'])
+@login_required
+def notebooks_batch():
+    batch = read_batch()
+    ids = [item.get('id') if isinstance(item, dict) else None
+           for item in batch['update']] + batch['delete']
+    owned = {id for id, in db.session.query(Notebook.id).filter(
+        Notebook.user == current_user.id,
+        Notebook.id.in_([id for id in ids if is_id(id)]))}
+
+    def create(item):
+        return {'name': text_field(item, Notebook, 'name', True),
+                'user': current_user.id}
+
+    def update(item):
+        return {'id': item_id(item, owned),
+                'name': text_field(item, Notebook, 'name', True)}
+
+    create_results, created = validate(batch['create'], create, 201)
+    update_results, updated = validate(batch['update'], update, 200)
+    delete_results, deleted = validate(
+        batch['delete'], lambda item: item_id(item, owned), 200)
+    for result, row in updated:
+        result['id'] = row['id']
+    for result, id in deleted:
+        result['id'] = id
+    commit_batch(Notebook, created, updated, deleted)
+    return jsonify(
+        create=create_results, update=update_results, delete=delete_results)
+
+
+@bp.route('/notes/batch', methods=['POST'])
+@login_required
+def notes_batch():
+    batch = read_batch()
+    ids = [item.get('id') if isinstance(item, dict) else None
+           for item in batch['update']] + batch['delete']
+    owned = {id for id, in db.session.query(Note.id).filter(
+        Note.user == current_user.id,
+        Note.id.in_([id for id in ids if is_id(id)]))}
+    targets = [item.get('notebook')
+               for item in batch['create'] + batch['update']
+               if isinstance(item, dict)]
+    notebooks = {id for id, in db.session.query(Notebook.id).filter(
+        Notebook.user == current_user.id,
+        Notebook.id.in_([id for id in targets if is_id(id)]))}
+
+    def notebook_field(item, required):
+        notebook = item.get('notebook')
+        if notebook is None and not required:
+            return None
+        if not is_id(notebook):
+            raise ItemError(400, 'notebook must be an integer')
+        if notebook not in notebooks:
+            raise ItemError(404, 'Notebook {} not found'.format(notebook))
+        return notebook
+
+    def create(item):
+        return {'title': text_field(item, Note, 'title', True),
+                'content': text_field(item, Note, 'content', True),
+                'notebook': notebook_field(item, True),
+                'user': current_user.id}
+
+    def update(item):
+        row = {'id': item_id(item, owned),
+               'title': text_field(item, Note, 'title', False),
+               'content': text_field(item, Note, 'content', False),
+               'notebook': notebook_field(item, False)}
+        row = {field: value for field, value in row.items()
+               if value is not None}
+        if len(row) == 1:
+            raise ItemError(400, 'Nothing to update')
+        return row
+
+    create_results, created = validate(batch['create'], create, 201)
+    update_results, updated = validate(batch['update'], update, 200)
+    delete_results, deleted = validate(
+        batch['delete'], lambda item: item_id(item, owned), 200)
+    for result, row in updated:
+        result['id'] = row['id']
+    for result, id in deleted:
+        result['id'] = id
+    commit_batch(Note, created, updated, deleted)
+    return jsonify(
+        create=create_results, update=update_results, delete=delete_results)
+
+
+def transfer_format():
+    format = request.args.get('format', 'ndjson')
+    if format not in FORMATS:
+        abort(400, 'format must be one of {}'.format(', '.join(FORMATS)))
+    return format
+
+
+@bp.route('/export')
+@login_required
+def export():
+    format = transfer_format()
+    chunks = export_notes(current_user.id, format)
+    return Response(
+        stream_with_context(chunks),
+        mimetype=FORMATS[format][2],
+        headers={'Content-Disposition':
+                 'attachment; filename=notes.{}'.format(format)})
+
+
+@bp.route('/import', methods=['POST'])
+@login_required
+def import_():
+    format = transfer_format()
+    # Forms can only post a few types, so this also stops cross-site posts.
+    if request.mimetype != FORMATS[format][2]:
+        abort(415, 'Expected a {} body'.format(FORMATS[format][2]))
+    lines = (line.decode('utf-8') for line in request.stream)
+    try:
+        counts = import_notes(current_user.id, lines, format)
+    except ImportFailed as error:
+        return jsonify(
+            error=str(error), first=error.first, last=error.last,
+            created=error.created), 422
+    return jsonify(counts), 201
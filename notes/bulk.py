@@ -0,0 +1,80 @@
+import csv
+import io
+
+import psycopg2.extensions
+import psycopg2.extras
+from sqlalchemy.exc import SQLAlchemyError
+
+from notes import db
+
+# What a failed write can raise: COPY runs on the raw connection, whose
+# errors SQLAlchemy does not wrap.
+WRITE_ERRORS = (SQLAlchemyError, psycopg2.Error)
+
+
+def insert_returning_ids(table, rows):
+    """Insert ``rows`` and return their new ids in the same order.
+
+    On PostgreSQL the ids are reserved from the table's sequence in one
+    query and the rows are loaded with a single ``COPY``, or with
+    multi-row ``INSERT``s on green connections. Other databases fall back
+    to one statement per row.
+    """
+    if not rows:
+        return []
+    session = db.session
+    if session.get_bind().dialect.name != 'postgresql':
+        return [session.execute(table.insert(), row).inserted_primary_key[0]
+                for row in rows]
+
+    # Raw COPY is invisible to the session's write tracking, and nextval()
+    # must not run on a replica.
+    session.info['pinned'] = True
+    ids = [id for id, in session.execute(
+        db.select([db.func.nextval(
+            db.func.pg_get_serial_sequence(table.name, 'id'))])
+        .select_from(db.func.generate_series(1, len(rows))))]
+    columns = [column for column in table.c if column.key != 'id'
+               and (column.key in rows[0] or column.default is not None)]
+    values = [[id] + [
+        row[column.key] if column.key in row else default(column)
+        for column in columns] for id, row in zip(ids, rows)]
+    names = ', '.join('"{}"'.format(column.name) for column in columns)
+    cursor = session.connection().connection.cursor()
+    if psycopg2.extensions.get_wait_callback() is not None:
+        # Green connections (see serve_async.py) cannot run COPY.
+        psycopg2.extras.execute_values(
+            cursor, 'INSERT INTO {} ("id", {}) VALUES %s'.format(
+                table.name, names),
+            values, page_size=1000)
+        return ids
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(values)
+    buffer.seek(0)
+    cursor.copy_expert(
+        'COPY {} ("id", {}) FROM STDIN WITH (FORMAT csv)'.format(
+            table.name, names),
+        buffer)
+    return ids
+
+
+def default(column):
+    """The Python-side default of ``column``, which COPY cannot apply."""
+    if column.default.is_callable:
+        return column.default.arg(None)
+    return column.default.arg
+
+
+def delete_ids(table, ids, user=None):
+    if ids:
+        condition = table.c.id.in_(ids)
+        if user is not None:
+            condition &= table.c.user == user
+        db.session.execute(table.delete().where(condition))
+
+
+def fits(model, field, value):
+    """Whether ``value`` is a non-blank string that fits ``field``."""
+    length = model.__table__.c[field].type.length
+    return isinstance(value, str) and bool(value.strip()) \
+        and len(value) <= length
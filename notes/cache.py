@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class LocalStore(object):
+    """Bounded in-process LRU store with a per-entry time to live."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, user, key):
+        with self._lock:
+            entry = self._entries.get((user, key))
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                self._discard((user, key))
+                return None
+            self._entries.move_to_end((user, key))
+            return value
+
+    def set(self, user, key, value):
+        with self._lock:
+            self._entries[(user, key)] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end((user, key))
+            self._by_user.setdefault(user, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, user):
+        with self._lock:
+            for key in self._by_user.pop(user, ()):
+                self._entries.pop((user, key), None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, entry):
+        user, key = entry
+        self._entries.pop(entry, None)
+        keys = self._by_user.get(user)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user]
+
+
+class SharedStore(object):
+    """Store kept in a Redis-compatible server, shared by all processes.
+
+    Each user has a generation counter that is part of every entry key, so
+    invalidating a user is a single ``INCR`` and stale entries simply age
+    out. Only ``get``, ``set(name, value, ex=...)`` and ``incr`` are used
+    on ``client``.
+    """
+
+    def __init__(self, client, ttl=60, prefix='notes:search:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, user, key):
+        value = self.client.get(self._key(user, key))
+        return None if value is None else json.loads(value)
+
+    def set(self, user, key, value):
+        self.client.set(self._key(user, key), json.dumps(value), ex=self.ttl)
+
+    def invalidate(self, user):
+        self.client.incr('{}gen:{}'.format(self.prefix, user))
+
+    def _key(self, user, key):
+        generation = self.client.get('{}gen:{}'.format(self.prefix, user))
+        return '{}{}:{}:{}'.format(
+            self.prefix, user, int(generation or 0), json.dumps(key))
+
+
+class SearchCache(object):
+    def __init__(self, store):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def fetch(self, user, key, load):
+        value = self.store.get(user, key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = load()
+        self.store.set(user, key, value)
+        return value
+
+    def invalidate(self, users):
+        for user in users:
+            self.store.invalidate(user)
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+def create_search_cache(app):
+    url = app.config['SEARCH_CACHE_URL']
+    ttl = app.config['SEARCH_CACHE_TTL']
+    if url:
+        import redis
+        return SearchCache(SharedStore(redis.Redis.from_url(url), ttl))
+    return SearchCache(LocalStore(app.config['SEARCH_CACHE_SIZE'], ttl))
+
+
+def get_search_cache():
+    extensions = current_app.extensions
+    if 'search_cache' not in extensions:
+        extensions['search_cache'] = create_search_cache(current_app)
+    return extensions['search_cache']
@@ -0,0 +1,280 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from notes.datagen import Shape, generate
+from notes.indexer import SearchIndexer
+from notes.metrics import search_chunks_compared, search_drift
+from notes.models import Users
+from notes.partition import drop_unpartitioned, is_partitioned, \
+    partition_tables
+from notes.reconcile import Reconciler
+from notes.reindex import rebuild, reindex
+from notes.search import get_backend, searchable_models
+from notes.sync import prune_tombstones
+from notes.transfer import FORMATS, ImportFailed, export_notes, import_notes
+
+
+@click.command('create-db')
+@with_appcontext
+def create_db():
+    """Create the database if it does not exist yet."""
+    # Imported here so web workers do not pay for it at start-up.
+    from sqlalchemy_utils import create_database, database_exists
+
+    url = current_app.config['SQLALCHEMY_DATABASE_URI']
+    if database_exists(url):
+        click.echo('Database already exists')
+        return
+    create_database(url)
+    click.echo('Database created, run "flask db upgrade" to add the tables')
+
+
+@click.command('search-indexer')
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--poll-interval', default=1.0, show_default=True)
+@with_appcontext
+def search_indexer(batch_size, poll_interval):
+    """Drain the search outbox until interrupted."""
+    click.echo('Search indexer started')
+    SearchIndexer(batch_size=batch_size).run(poll_interval)
+
+
+@click.command('search-init')
+@with_appcontext
+def search_init():
+    """Create any missing search indices with their mappings."""
+    get_backend().setup()
+    click.echo('Search indices are ready')
+
+
+@click.command('reindex')
+@click.argument('indices', nargs=-1)
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Rows fetched per query and documents per bulk request.')
+@click.option('--workers', default=4, show_default=True,
+              help='Bulk requests sent in parallel.')
+@click.option('--swap-alias/--in-place', default=False,
+              help='Build a new index and atomically move the alias to it.')
+@click.option('--delete-old', is_flag=True,
+              help='Delete the indices the alias pointed at before.')
+@with_appcontext
+def reindex_command(indices, batch_size, workers, swap_alias, delete_old):
+    """Rebuild the search indices (all of them by default)."""
+    if current_app.config['SEARCH_BACKEND'] != 'elasticsearch':
+        raise click.ClickException(
+            'The {} search backend does not need reindexing'.format(
+                current_app.config['SEARCH_BACKEND']))
+    models = [searchable_models[index]
+              for index in indices or searchable_models]
+
+    for model in models:
+        name = model.__tablename__
+
+        def progress(done, total, elapsed):
+            rate = done / elapsed if elapsed else 0
+            click.echo('{}: {}/{} documents ({:.0f} docs/s)'.format(
+                name, done, total, rate))
+
+        if swap_alias:
+            index, done, failed = rebuild(
+                model, batch_size, workers, progress, delete_old=delete_old)
+            click.echo('{}: alias now points at {}'.format(name, index))
+        else:
+            done, failed = reindex(
+                model, batch_size=batch_size, workers=workers,
+                progress=progress)
+        if failed:
+            click.echo('{}: {} documents failed'.format(name, failed),
+                       err=True)
+
+
+@click.command('reconcile')
+@click.argument('indices', nargs=-1)
+@click.option('--chunk-size', default=1000, show_default=True,
+              help='Ids per checksum; differing chunks are compared '
+              'document by document.')
+@click.option('--window', default=100, show_default=True,
+              help='Chunks compared per request.')
+@click.option('--rate', type=float,
+              help='Most ids compared per second.')
+@click.option('--state', type=click.Path(dir_okay=False),
+              help='Save progress here and resume from it.')
+@click.option('--metrics', type=click.Path(dir_okay=False),
+              help='Write drift metrics here in the Prometheus text format.')
+@with_appcontext
+def reconcile_command(indices, chunk_size, window, rate, state, metrics):
+    """Queue repairs for documents the search indices have wrong."""
+    if current_app.config['SEARCH_BACKEND'] != 'elasticsearch':
+        raise click.ClickException(
+            'The {} search backend is always in sync'.format(
+                current_app.config['SEARCH_BACKEND']))
+    models = [searchable_models[index]
+              for index in indices or searchable_models]
+
+    def progress(index, report, last):
+        click.echo('{}: {} of {} ids compared, {} of {} chunks differ'.format(
+            index, last if report['done'] else report['position'], last,
+            report['differing'], report['chunks']))
+
+    reports = Reconciler(
+        chunk_size=chunk_size, window=window, rate=rate, state=state,
+        progress=progress).run(models)
+    for index, report in reports.items():
+        click.echo('{}: {missing} missing, {stale} stale and {extra} extra '
+                   'documents queued for repair'.format(index, **report))
+    if metrics:
+        with open(metrics, 'w') as output:
+            output.write(search_chunks_compared.render() + '\n' +
+                         search_drift.render() + '\n')
+
+
+@click.command('partition-tables')
+@click.option('--partitions', default=16, show_default=True,
+              help='Hash partitions per table.')
+@click.option('--batch-size', default=10000, show_default=True,
+              help='Rows copied per transaction.')
+@click.option('--pause', default=0.0, show_default=True,
+              help='Seconds to wait between copied batches.')
+@click.option('--lock-timeout', default=5.0, show_default=True,
+              help='Seconds to wait for the lock that swaps the tables.')
+@click.option('--drop-old', is_flag=True,
+              help='Drop the unpartitioned tables afterwards.')
+@with_appcontext
+def partition_command(partitions, batch_size, pause, lock_timeout, drop_old):
+    """Partition notebooks and notes by user, without stopping the app."""
+    def progress(table, done, total):
+        click.echo('{}: {}/{} ids copied'.format(table, done, total))
+
+    if is_partitioned():
+        click.echo('The tables are already partitioned')
+    else:
+        try:
+            partition_tables(
+                partitions, batch_size, pause, lock_timeout, progress)
+        except ValueError as error:
+            raise click.ClickException(str(error))
+        click.echo('notebook and note are now partitioned by user')
+    if drop_old:
+        drop_unpartitioned()
+        click.echo('Unpartitioned tables dropped')
+
+
+def find_user(email):
+    user = Users.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException('No user with email {}'.format(email))
+    return user
+
+
+def file_format(format, path):
+    if format:
+        return format
+    extension = path.rsplit('.', 1)[-1].lower()
+    return extension if extension in FORMATS else 'ndjson'
+
+
+@click.command('export-notes')
+@click.argument('email')
+@click.argument('output', type=click.Path(allow_dash=True), default='-')
+@click.option('--format', type=click.Choice(list(FORMATS)),
+              help='Defaults to the file extension, or ndjson.')
+@with_appcontext
+def export_command(email, output, format):
+    """Write all notebooks and notes of a user to OUTPUT."""
+    user = find_user(email)
+    with click.open_file(output, 'w', encoding='utf-8') as out:
+        for chunk in export_notes(user.id, file_format(format, output)):
+            out.write(chunk)
+
+
+@click.command('import-notes')
+@click.argument('email')
+@click.argument('input', type=click.Path(allow_dash=True, exists=True))
+@click.option('--format', type=click.Choice(list(FORMATS)),
+              help='Defaults to the file extension, or ndjson.')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Records written per transaction.')
+@with_appcontext
+def import_command(email, input, format, batch_size):
+    """Add the notebooks and notes in INPUT to a user's account."""
+    user = find_user(email)
+    with click.open_file(input, encoding='utf-8') as lines:
+        try:
+            counts = import_notes(
+                user.id, lines, file_format(format, input), batch_size)
+        except ImportFailed as error:
+            raise click.ClickException(
+                '{}; {notebooks} notebooks and {notes} notes were imported '
+                'before it'.format(error, **error.created))
+    click.echo('{notebooks} notebooks and {notes} notes imported, '
+               '{skipped} records skipped'.format(**counts))
+
+
+@click.command('prune-tombstones')
+@click.option('--days', type=int,
+              help='Defaults to SYNC_TOMBSTONE_DAYS.')
+@with_appcontext
+def prune_tombstones_command(days):
+    """Forget deletes older than clients are allowed to sync from."""
+    count = prune_tombstones(
+        days or current_app.config['SYNC_TOMBSTONE_DAYS'])
+    click.echo('{} tombstones deleted'.format(count))
+
+
+@click.command('generate-data')
+@click.option('--users', default=1000, show_default=True)
+@click.option('--seed', default=0, show_default=True,
+              help='The same seed always produces the same data.')
+@click.option('--start', default=0, show_default=True,
+              help='Number of the first user, to add to an earlier run.')
+@click.option('--prefix', default='load', show_default=True,
+              help='Users are <prefix><number>@example.com.')
+@click.option('--password', default='password', show_default=True)
+@click.option('--notes-alpha', default=1.5, show_default=True,
+              help='Power-law exponent of notes per notebook; lower is '
+              'more skewed.')
+@click.option('--max-notes', default=5000, show_default=True,
+              help='Most notes in one notebook.')
+@click.option('--chunk-size', default=100, show_default=True,
+              help='Users written per transaction.')
+@click.option('--workers', default=4, show_default=True,
+              help='Processes loading chunks in parallel.')
+@click.option('--index', is_flag=True,
+              help='Bulk index everything into the search cluster after.')
+@with_appcontext
+def generate_data_command(users, seed, start, prefix, password, notes_alpha,
+                          max_notes, chunk_size, workers, index):
+    """Fill the database with generated users, notebooks and notes."""
+    config = {
+        key: current_app.config[key]
+        for key in ('SQLALCHEMY_DATABASE_URI', 'SQLALCHEMY_BINDS',
+                    'SEARCH_BACKEND', 'ELASTICSEARCH_URL')}
+    config['SEARCH_INDEXER_INLINE'] = False
+
+    def progress(totals):
+        click.echo('{users} users, {notebooks} notebooks, {notes} notes'
+                   .format(**totals))
+
+    generate(
+        users, seed=seed, start=start, prefix=prefix, password=password,
+        shape=Shape(notes_alpha=notes_alpha, notes_max=max_notes),
+        chunk_size=chunk_size, workers=workers, config=config,
+        progress=progress)
+    if index:
+        if current_app.config['SEARCH_BACKEND'] != 'elasticsearch':
+            click.echo('The {} search backend needs no indexing'.format(
+                current_app.config['SEARCH_BACKEND']))
+            return
+        for model in searchable_models.values():
+            done, failed = reindex(model, workers=workers)
+            click.echo('{}: {} documents indexed, {} failed'.format(
+                model.__tablename__, done, failed))
+
+
+def init_app(app):
+    for command in (create_db, search_indexer, search_init, reindex_command,
+                    reconcile_command, export_command, import_command,
+                    prune_tombstones_command, generate_data_command,
+                    partition_command):
+        app.cli.add_command(command)
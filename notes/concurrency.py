@@ -0,0 +1,53 @@
+import sys
+
+from flask import _app_ctx_stack, _request_ctx_stack
+
+from notes import db
+
+# Session flags that route reads, carried over to every greenlet.
+ROUTING_FLAGS = ('replica_reads', 'pinned')
+
+
+def cooperative():
+    """Whether the process runs on gevent with patched sockets."""
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('socket')
+
+
+def fan_out(*calls):
+    """Run independent calls concurrently and return their results in order.
+
+    On gevent (see ``serve_async.py``) each call runs in its own greenlet
+    with the current app and request context, so a view waiting on several
+    searches or queries waits for the slowest one only. Each greenlet gets
+    its own database session, which reads from the replica or the primary
+    like the view's session does. Anywhere else the calls simply run one
+    after the other. The first exception raised by a call is re-raised.
+    """
+    request_ctx = _request_ctx_stack.top
+    if not cooperative() or request_ctx is None or len(calls) < 2:
+        return [call() for call in calls]
+    import gevent
+
+    app_ctx = _app_ctx_stack.top
+    flags = {name: db.session.info[name] for name in ROUTING_FLAGS
+             if name in db.session.info}
+
+    def in_context(call):
+        # A fresh app context, whose teardown releases this greenlet's
+        # database session; it shares ``g`` so request metrics add up.
+        context = app_ctx.app.app_context()
+        context.g = app_ctx.g
+        copy = request_ctx.copy()
+        if hasattr(request_ctx, 'user'):
+            copy.user = request_ctx.user
+
+        def run():
+            with context, copy:
+                db.session.info.update(flags)
+                return call()
+        return run
+
+    greenlets = [gevent.spawn(in_context(call)) for call in calls]
+    gevent.joinall(greenlets, raise_error=True)
+    return [greenlet.value for greenlet in greenlets]
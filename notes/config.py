@@ -0,0 +1,69 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class Config(object):
+    SECRET_KEY = os.getenv(
+        'SECRET_KEY', '84025a69a81786a5da5ab95f190e1ca7b9f3570c83')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_DATABASE_URI = os.getenv(
+        'DATABASE_URL',
+        'postgresql://{}:{}@localhost/flasknotes'.format(
+            os.getenv('username'), os.getenv('password')))
+    DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL')
+    DATABASE_REPLICA_STICKY_SECONDS = 5
+    DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', 10))
+    DATABASE_MAX_OVERFLOW = int(os.getenv('DATABASE_MAX_OVERFLOW', 10))
+    DATABASE_POOL_TIMEOUT = 10
+    DATABASE_POOL_RECYCLE = 1800
+    DATABASE_POOL_PRE_PING = True
+    # milliseconds, 0 disables the limit
+    DATABASE_STATEMENT_TIMEOUT = int(
+        os.getenv('DATABASE_STATEMENT_TIMEOUT', 10000))
+    DEBUG = True
+
+    # EMAIL SETTINGS
+    MAIL_SERVER = 'smtp.gmail.com'
+    MAIL_PORT = 465
+    MAIL_USE_SSL = True
+    # gmail authentication
+    MAIL_USERNAME = os.getenv('email')
+    MAIL_PASSWORD = os.getenv('MAIL_PASSWORD', 'aeaptxavqjgyyhng')
+    MAIL_QUEUE_WORKERS = 2
+    MAIL_QUEUE_BATCH_SIZE = 20
+    MAIL_QUEUE_MAX_RETRIES = 3
+
+    API_BATCH_LIMIT = 500
+    API_TOKEN_TTL = 86400
+    SYNC_SETTLE_SECONDS = 2
+    SYNC_TOMBSTONE_DAYS = 30
+
+    SLOW_REQUEST_SECONDS = 1.0
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_SAMPLE_INTERVAL = 0.005
+    PROFILE_DIR = os.getenv('PROFILE_DIR')
+    PROFILE_KEEP = 200
+
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 30
+
+    ELASTICSEARCH_URL = os.getenv('ELASTICSEARCH_URL')
+    # connections kept open per process
+    ELASTICSEARCH_CONNECTIONS = int(os.getenv('ELASTICSEARCH_CONNECTIONS', 10))
+    SEARCH_BACKEND = os.getenv(
+        'SEARCH_BACKEND',
+        'elasticsearch' if ELASTICSEARCH_URL else 'database')
+    SEARCH_CACHE_SIZE = 1024
+    SEARCH_CACHE_TTL = 60
+    SEARCH_CACHE_URL = os.getenv('SEARCH_CACHE_URL')
+    SEARCH_FACET_SIZE = 20
+    SEARCH_INDEXER_INLINE = os.getenv('SEARCH_INDEXER_INLINE', '1') == '1'
+    SEARCH_INDEXER_POLL_INTERVAL = 1.0
+    # seconds until indexed changes are searchable, the refresh_interval
+    # of the indices
+    SEARCH_REFRESH_INTERVAL = 1.0
@@ -0,0 +1,111 @@
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.expression import UpdateBase
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends plain reads to the replica when asked to.
+
+    Reads go to the replica only inside ``RoutingSQLAlchemy.replica_reads``
+    and only until the session writes something, by a flush or a bulk
+    statement; from then on, and for everything that is not a SELECT, the
+    primary is used.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if isinstance(clause, UpdateBase):
+            self.info['pinned'] = True
+        if (self.info.get('replica_reads') and not self.info.get('pinned')
+                and not self._flushing and isinstance(clause, Select)):
+            return get_state(self.app).db.get_engine(self.app, bind='replica')
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """``SQLAlchemy`` with pool settings, statement timeouts and a replica.
+
+    ``DATABASE_REPLICA_URL`` becomes the ``replica`` bind. After a request
+    commits a write, its browser session reads from the primary for
+    ``DATABASE_REPLICA_STICKY_SECONDS`` so users see their own changes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        event.listen(self.session, 'after_flush', pin_to_primary)
+        event.listen(self.session, 'after_commit', stick_to_primary)
+
+    def init_app(self, app):
+        replica = app.config.get('DATABASE_REPLICA_URL')
+        if replica:
+            binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+            binds.setdefault('replica', replica)
+            app.config['SQLALCHEMY_BINDS'] = binds
+        super().init_app(app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        super().apply_driver_hacks(app, sa_url, options)
+        if not sa_url.drivername.startswith('postgresql'):
+            return
+        config = app.config
+        options.setdefault('pool_size', config['DATABASE_POOL_SIZE'])
+        options.setdefault('max_overflow', config['DATABASE_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', config['DATABASE_POOL_TIMEOUT'])
+        options.setdefault('pool_recycle', config['DATABASE_POOL_RECYCLE'])
+        options.setdefault('pool_pre_ping', config['DATABASE_POOL_PRE_PING'])
+        timeout = config['DATABASE_STATEMENT_TIMEOUT']
+        if timeout:
+            connect_args = options.setdefault('connect_args', {})
+            connect_args['options'] = '-c statement_timeout={:d}'.format(
+                timeout)
+
+    @contextmanager
+    def replica_reads(self):
+        info = self.session.info
+        if info.get('pinned') or not replica_available(current_app):
+            yield
+            return
+        depth = info.get('replica_reads', 0)
+        info['replica_reads'] = depth + 1
+        try:
+            yield
+        finally:
+            info['replica_reads'] = depth
+
+    def read_only(self, view):
+        """Serve GET and HEAD requests of ``view`` from the replica."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+            with self.replica_reads():
+                return view(*args, **kwargs)
+        return wrapper
+
+
+def replica_available(app):
+    if 'replica' not in (app.config['SQLALCHEMY_BINDS'] or {}):
+        return False
+    if has_request_context():
+        return session.get('primary_until', 0) <= time.time()
+    return True
+
+
+def pin_to_primary(db_session, flush_context):
+    db_session.info['pinned'] = True
+
+
+def stick_to_primary(db_session):
+    app = current_app
+    if (db_session.info.get('pinned') and has_request_context()
+            and 'replica' in (app.config['SQLALCHEMY_BINDS'] or {})):
+        session['primary_until'] = \
+            time.time() + app.config['DATABASE_REPLICA_STICKY_SECONDS']
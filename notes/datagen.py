@@ -0,0 +1,199 @@
+"""Synthetic users, notebooks and notes for load and capacity tests.
+
+Sizes follow power laws, so a few users own most of the notebooks and a
+few notebooks hold most of the notes. Content lengths are log-normal and
+words are Zipf-distributed. Each user is generated from its own random
+stream derived from the seed, so a dataset is the same whatever the
+number of workers or the chunk size.
+"""
+import itertools
+import random
+import string
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+
+from notes import bcrypt, db
+from notes.bulk import insert_returning_ids
+from notes.models import Note, Notebook, Users
+
+EPOCH = datetime(2024, 1, 1)
+SPAN_SECONDS = 2 * 365 * 86400
+VOCABULARY_SIZE = 20000
+TITLE_LENGTH = Note.__table__.c.title.type.length
+CONTENT_LENGTH = Note.__table__.c.content.type.length
+NAME_LENGTH = Notebook.__table__.c.name.type.length
+
+
+class Shape(object):
+    """The distributions a dataset is drawn from.
+
+    ``paretovariate`` has a minimum of 1 and a mean of
+    ``alpha / (alpha - 1)``, so with the defaults users average about two
+    notebooks and notebooks about twelve notes, with long tails up to the
+    caps.
+    """
+
+    def __init__(self, notebooks_min=1, notebooks_alpha=1.8,
+                 notebooks_max=200, notes_min=4, notes_alpha=1.5,
+                 notes_max=5000, content_median=90, content_sigma=1.0):
+        self.notebooks_min = notebooks_min
+        self.notebooks_alpha = notebooks_alpha
+        self.notebooks_max = notebooks_max
+        self.notes_min = notes_min
+        self.notes_alpha = notes_alpha
+        self.notes_max = notes_max
+        self.content_median = content_median
+        self.content_sigma = content_sigma
+
+
+class Generator(object):
+    def __init__(self, seed, shape=None, prefix='load'):
+        self.seed = seed
+        self.shape = shape or Shape()
+        self.prefix = prefix
+        rng = random.Random('{}:vocabulary'.format(seed))
+        self.vocabulary = [
+            ''.join(rng.choice(string.ascii_lowercase)
+                    for _ in range(rng.randint(2, 10)))
+            for _ in range(VOCABULARY_SIZE)]
+        self.weights = list(itertools.accumulate(
+            1 / rank for rank in range(1, VOCABULARY_SIZE + 1)))
+
+    def words(self, rng, count):
+        return ' '.join(rng.choices(
+            self.vocabulary, cum_weights=self.weights, k=count))
+
+    def text(self, rng, length):
+        """Roughly ``length`` characters of words, cut to fit."""
+        return self.words(rng, max(1, length // 6 + 1))[:length].strip() \
+            or self.vocabulary[0]
+
+    def count(self, rng, minimum, alpha, cap):
+        return min(cap, int(minimum * rng.paretovariate(alpha)))
+
+    def moment(self, rng):
+        return EPOCH + timedelta(seconds=rng.randrange(SPAN_SECONDS))
+
+    def user(self, number, password):
+        """The user row, its notebook rows and, per notebook, note rows."""
+        shape = self.shape
+        rng = random.Random('{}:user:{}'.format(self.seed, number))
+        user = {
+            'username': '{}{}'.format(self.prefix, number),
+            'email': '{}{}@example.com'.format(self.prefix, number),
+            'password': password,
+            'confirmed': True}
+        notebooks = []
+        notes = []
+        for _ in range(self.count(rng, shape.notebooks_min,
+                                  shape.notebooks_alpha,
+                                  shape.notebooks_max)):
+            created = self.moment(rng)
+            notebooks.append({
+                'name': self.text(rng, rng.randint(4, NAME_LENGTH)),
+                'date_created': created,
+                'updated_at': created})
+            rows = []
+            for _ in range(self.count(rng, shape.notes_min,
+                                      shape.notes_alpha, shape.notes_max)):
+                created = self.moment(rng)
+                length = min(CONTENT_LENGTH, int(rng.lognormvariate(
+                    0, shape.content_sigma) * shape.content_median))
+                rows.append({
+                    'title': self.text(rng, rng.randint(4, TITLE_LENGTH)),
+                    'content': self.text(rng, length),
+                    'date_created': created,
+                    'updated_at': created})
+            notes.append(rows)
+        return user, notebooks, notes
+
+
+def load_users(generator, numbers, password):
+    """Generate and insert the users ``numbers`` in one transaction.
+
+    Returns ``(users, notebooks, notes)`` counts.
+    """
+    users, notebooks, notes = [], [], []
+    for number in numbers:
+        user, user_notebooks, user_notes = generator.user(number, password)
+        users.append(user)
+        notebooks.append(user_notebooks)
+        notes.append(user_notes)
+    user_ids = insert_returning_ids(Users.__table__, users)
+    notebook_rows = []
+    for user_id, user_notebooks in zip(user_ids, notebooks):
+        for row in user_notebooks:
+            row['user'] = user_id
+            notebook_rows.append(row)
+    notebook_ids = insert_returning_ids(Notebook.__table__, notebook_rows)
+    note_rows = []
+    notebook_notes = itertools.chain.from_iterable(notes)
+    for notebook_id, notebook, rows in zip(
+            notebook_ids, notebook_rows, notebook_notes):
+        for row in rows:
+            row['notebook'] = notebook_id
+            row['user'] = notebook['user']
+            note_rows.append(row)
+    insert_returning_ids(Note.__table__, note_rows)
+    db.session.commit()
+    return len(user_ids), len(notebook_ids), len(note_rows)
+
+
+def chunks(start, count, size):
+    for first in range(start, start + count, size):
+        yield range(first, min(first + size, start + count))
+
+
+def generate(users, seed=0, start=0, prefix='load', password='password',
+             shape=None, chunk_size=100, workers=1, config=None,
+             progress=None):
+    """Create ``users`` users numbered from ``start``, with their data.
+
+    Each chunk of ``chunk_size`` users is one transaction. With more than
+    one worker the chunks are loaded by separate processes, each building
+    its own app from ``config``. Returns the totals as a dict.
+    """
+    generator = Generator(seed, shape, prefix)
+    hashed = bcrypt.generate_password_hash(password).decode('utf-8')
+    totals = dict.fromkeys(('users', 'notebooks', 'notes'), 0)
+    work = chunks(start, users, chunk_size)
+    if workers > 1:
+        context = get_context('spawn')
+        with ProcessPoolExecutor(
+                workers, mp_context=context, initializer=_start_worker,
+                initargs=(config, generator, hashed)) as pool:
+            results = pool.map(_load_chunk, work)
+            _add_totals(totals, results, progress)
+    else:
+        results = (load_users(generator, numbers, hashed)
+                   for numbers in work)
+        _add_totals(totals, results, progress)
+    if db.engine.dialect.name == 'postgresql':
+        for table in ('users', 'notebook', 'note'):
+            db.session.execute('ANALYZE {}'.format(table))
+        db.session.commit()
+    return totals
+
+
+def _add_totals(totals, results, progress):
+    for result in results:
+        for key, count in zip(('users', 'notebooks', 'notes'), result):
+            totals[key] += count
+        if progress:
+            progress(totals)
+
+
+_worker = {}
+
+
+def _start_worker(config, generator, password):
+    from notes import create_app
+
+    app = create_app(config)
+    app.app_context().push()
+    _worker.update(generator=generator, password=password)
+
+
+def _load_chunk(numbers):
+    return load_users(_worker['generator'], numbers, _worker['password'])
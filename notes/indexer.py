@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from notes import db
+from notes.cache import get_search_cache
+from notes.models import SearchableMixin, SearchOutbox
+from notes.search import bulk_update, get_backend, payload_for, purge_index
+
+logger = logging.getLogger(__name__)
+
+
+class SearchIndexer(object):
+    """Drains the search outbox into the search cluster in bulk requests.
+
+    Rows are written by ``SearchableMixin.record_changes`` in the same
+    transaction as the change itself. Repeated changes to one document are
+    merged so only its latest state is sent, and failed documents are put
+    back with exponential backoff. ``purge`` rows, written when notebooks
+    are deleted, become one delete-by-query request per index. The cached
+    searches of the users whose documents changed are dropped again
+    ``refresh_interval`` seconds later, once searches see the changes, so
+    a search run in between does not keep the old results. ``client`` may
+    be any object with Elasticsearch-compatible ``bulk(body=...)`` and
+    ``delete_by_query`` methods.
+    """
+
+    def __init__(self, client=None, batch_size=500, base_backoff=1,
+                 max_backoff=300, refresh_interval=None):
+        self.client = client
+        self.batch_size = batch_size
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.refresh_interval = refresh_interval
+        # (monotonic time the changes are visible, their users)
+        self._visible = []
+
+    def drain(self):
+        self._invalidate_visible()
+        rows = SearchOutbox.query \
+            .filter(SearchOutbox.available_at <= datetime.utcnow()) \
+            .order_by(SearchOutbox.id) \
+            .limit(self.batch_size) \
+            .with_for_update(skip_locked=True) \
+            .all()
+        if not rows:
+            db.session.commit()
+            return 0
+
+        latest = {}
+        purges = {}
+        for row in rows:
+            if row.op == 'purge':
+                purges.setdefault(row.index, set()).add(row.doc_id)
+            else:
+                latest[(row.index, row.doc_id)] = row.op
+        keys = list(latest)
+        actions = self._actions(latest, keys)
+        try:
+            failed = bulk_update(actions, self.client)
+        except Exception:
+            logger.exception('Bulk index request failed')
+            failed = set(range(len(keys)))
+
+        failed_keys = {keys[position] for position in failed}
+        failed_purges = self._purge(purges)
+        # Rows queued without a user, by reconcile or reindex, still have
+        # one in the document they index.
+        users = {
+            payload['user']
+            for position, (op, index, doc_id, payload) in enumerate(actions)
+            if op == 'index' and position not in failed}
+        now = datetime.utcnow()
+        for row in rows:
+            if row.op == 'purge':
+                retry = row.index in failed_purges
+            else:
+                retry = (row.index, row.doc_id) in failed_keys
+            if retry:
+                row.attempts += 1
+                row.available_at = now + self._backoff(row.attempts)
+            else:
+                users.add(row.user)
+                db.session.delete(row)
+        db.session.commit()
+        users.discard(None)
+        refresh_interval = self.refresh_interval
+        if refresh_interval is None:
+            refresh_interval = current_app.config['SEARCH_REFRESH_INTERVAL']
+        self._visible.append((time.monotonic() + refresh_interval, users))
+        self._invalidate_visible()
+        return len(rows)
+
+    def run(self, poll_interval=1.0, stop=None):
+        stop = stop or threading.Event()
+        try:
+            get_backend().setup()
+        except Exception:
+            logger.exception('Could not create the search indices')
+        while not stop.is_set():
+            try:
+                handled = self.drain()
+            except Exception:
+                logger.exception('Search indexer failed to drain the outbox')
+                db.session.rollback()
+                handled = 0
+            if handled < self.batch_size:
+                stop.wait(poll_interval)
+
+    def _actions(self, latest, keys):
+        wanted = {}
+        for index, doc_id in keys:
+            if latest[(index, doc_id)] == 'index':
+                wanted.setdefault(index, []).append(doc_id)
+        found = {}
+        for index, ids in wanted.items():
+            model = SearchableMixin.model_for(index)
+            for obj in model.query.filter(model.id.in_(ids)):
+                found[(index, obj.id)] = payload_for(obj)
+
+        actions = []
+        for key in keys:
+            index, doc_id = key
+            if key in found:
+                actions.append(('index', index, doc_id, found[key]))
+            else:
+                actions.append(('delete', index, doc_id, None))
+        return actions
+
+    def _purge(self, purges):
+        """Delete by query, one request per index; returns the failures."""
+        failed = set()
+        for index, values in purges.items():
+            field = SearchableMixin.model_for(index).__search_parent__
+            try:
+                purge_index(index, field, values, self.client)
+            except Exception:
+                logger.exception('Delete by query on %s failed', index)
+                failed.add(index)
+        return failed
+
+    def _invalidate_visible(self):
+        """Drop the cached searches of changes searchable by now."""
+        now = time.monotonic()
+        while self._visible and self._visible[0][0] <= now:
+            visible, users = self._visible.pop(0)
+            get_search_cache().invalidate(users)
+
+    def _backoff(self, attempts):
+        seconds = min(self.max_backoff, self.base_backoff * 2 ** attempts)
+        return timedelta(seconds=seconds)
+
+
+def start_indexer(app, **kwargs):
+    def target():
+        with app.app_context():
+            SearchIndexer(**kwargs).run(
+                app.config['SEARCH_INDEXER_POLL_INTERVAL'])
+
+    thread = threading.Thread(target=target, name='search-indexer')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def init_app(app):
+    @app.before_first_request
+    def start_inline_indexer():
+        if app.config['SEARCH_INDEXER_INLINE']:
+            start_indexer(app)
@@ -0,0 +1,163 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+from notes import db, mail
+from notes.metrics import mail_seconds
+from notes.models import MailDeadLetter
+
+logger = logging.getLogger(__name__)
+
+
+class MailQueue(object):
+    """Sends mail from a pool of worker threads.
+
+    Each worker keeps its own SMTP connection open between messages, sends
+    whatever is queued in batches, reconnects and retries with backoff on
+    failure, and records messages that still fail in ``mail_dead_letter``.
+    Workers start with the first message, so nothing runs at import time.
+    """
+
+    def __init__(self, app, workers=2, batch_size=20, max_retries=3,
+                 idle_timeout=30):
+        self.app = app
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.idle_timeout = idle_timeout
+        self.queue = queue.Queue()
+        self.sent = 0
+        self.failed = 0
+        self.dead = 0
+        self.latencies = deque(maxlen=1000)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def enqueue(self, message):
+        self._start()
+        self.queue.put((message, 0, time.monotonic()))
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        latencies = list(self.latencies)
+        return {
+            'depth': self.depth(),
+            'sent': self.sent,
+            'failed': self.failed,
+            'dead': self.dead,
+            'latency_avg': sum(latencies) / len(latencies)
+            if latencies else 0.0,
+            'latency_max': max(latencies, default=0.0)}
+
+    def stop(self, timeout=10):
+        for _ in self._threads:
+            self.queue.put(None)
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work, name='mail-{}'.format(number))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            atexit.register(self.stop)
+
+    def _work(self):
+        with self.app.app_context():
+            connection = None
+            while True:
+                try:
+                    item = self.queue.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    connection = self._close(connection)
+                    continue
+                if item is None:
+                    self._close(connection)
+                    return
+                batch = [item]
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        self.queue.put(None)
+                        break
+                    batch.append(item)
+                for item in batch:
+                    connection = self._send(connection, *item)
+
+    def _send(self, connection, message, attempts, queued_at):
+        started = time.perf_counter()
+        try:
+            if connection is None:
+                connection = mail.connect()
+                connection.__enter__()
+            connection.send(message)
+            mail_seconds.observe(time.perf_counter() - started)
+        except Exception as error:
+            logger.warning('Sending mail to %s failed: %s',
+                           message.recipients, error)
+            self._retry(message, attempts + 1, queued_at, error)
+            return self._close(connection)
+        self.sent += 1
+        self.latencies.append(time.monotonic() - queued_at)
+        return connection
+
+    def _retry(self, message, attempts, queued_at, error):
+        self.failed += 1
+        if attempts > self.max_retries:
+            self.dead += 1
+            self._bury(message, error)
+            return
+        timer = threading.Timer(
+            2 ** attempts, self.queue.put, [(message, attempts, queued_at)])
+        timer.daemon = True
+        timer.start()
+
+    def _bury(self, message, error):
+        try:
+            db.session.add(MailDeadLetter(
+                recipients=', '.join(message.recipients),
+                subject=message.subject,
+                body=message.body,
+                error=str(error)[:500]))
+            db.session.commit()
+        except Exception:
+            logger.exception('Could not record undeliverable mail')
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+    def _close(self, connection):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except Exception:
+                pass
+        return None
+
+
+def get_mail_queue():
+    extensions = current_app.extensions
+    if 'mail_queue' not in extensions:
+        config = current_app.config
+        extensions['mail_queue'] = MailQueue(
+            current_app._get_current_object(),
+            workers=config['MAIL_QUEUE_WORKERS'],
+            batch_size=config['MAIL_QUEUE_BATCH_SIZE'],
+            max_retries=config['MAIL_QUEUE_MAX_RETRIES'])
+    return extensions['mail_queue']
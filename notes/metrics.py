@@ -0,0 +1,291 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from flask import (
+    Blueprint, Response, abort, before_render_template, current_app, g,
+    has_request_context, request, template_rendered)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+registry = []
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, escape(value))
+                          for name, value in labels) + '}'
+
+
+class Metric(object):
+    """A named family of values, one per combination of label values."""
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            for suffix, extra, sample in self._samples(value):
+                labels = list(zip(self.labels, key)) + extra
+                lines.append('{}{}{} {}'.format(
+                    self.name, suffix, format_labels(labels), sample))
+        return '\n'.join(lines)
+
+    def _samples(self, value):
+        yield '', [], value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            if position < len(self.buckets):
+                counts[position] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def _samples(self, counts):
+        total = 0
+        for bound, count in zip(self.buckets, counts):
+            total += count
+            yield '_bucket', [('le', bound)], total
+        yield '_bucket', [('le', '+Inf')], counts[-1]
+        yield '_sum', [], counts[-2]
+        yield '_count', [], counts[-1]
+
+
+request_seconds = Histogram(
+    'notes_request_duration_seconds', 'Time spent handling requests.',
+    ('endpoint', 'method'))
+requests_total = Counter(
+    'notes_requests_total', 'Requests handled.', ('endpoint', 'status'))
+request_statements = Histogram(
+    'notes_request_sql_statements', 'SQL statements run per request.',
+    ('endpoint',), COUNT_BUCKETS)
+sql_statements = Counter(
+    'notes_sql_statements_total', 'SQL statements run.', ('endpoint',))
+sql_seconds = Counter(
+    'notes_sql_seconds_total', 'Time spent in SQL statements.',
+    ('endpoint',))
+search_requests = Counter(
+    'notes_search_requests_total', 'Requests sent to Elasticsearch.',
+    ('endpoint',))
+search_seconds = Counter(
+    'notes_search_seconds_total', 'Time spent in Elasticsearch requests.',
+    ('endpoint',))
+render_seconds = Histogram(
+    'notes_template_render_seconds', 'Time spent rendering templates.',
+    ('template',))
+mail_seconds = Histogram(
+    'notes_mail_send_seconds', 'Time spent handing a message to SMTP.')
+mail_queue_depth = Gauge(
+    'notes_mail_queue_depth', 'Messages waiting to be sent.')
+search_cache_lookups = Gauge(
+    'notes_search_cache_lookups', 'Search cache lookups since start-up.',
+    ('result',))
+search_chunks_compared = Counter(
+    'notes_search_reconcile_chunks_total',
+    'Id ranges compared between the database and the search index.',
+    ('index', 'result'))
+search_drift = Counter(
+    'notes_search_drift_documents_total',
+    'Documents found out of sync with the database and queued for repair.',
+    ('index', 'kind'))
+
+
+class RequestStats(object):
+    __slots__ = ('started', 'sql_count', 'sql_time', 'queries',
+                 'search_count', 'search_time', 'render_time')
+
+    max_queries = 200
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.queries = []
+        self.search_count = 0
+        self.search_time = 0.0
+        self.render_time = 0.0
+
+
+def request_stats():
+    return g.get('request_stats') if has_request_context() else None
+
+
+def record_sql(elapsed, statement):
+    stats = request_stats()
+    if stats is None:
+        sql_statements.inc(endpoint='background')
+        sql_seconds.inc(elapsed, endpoint='background')
+        return
+    stats.sql_count += 1
+    stats.sql_time += elapsed
+    if len(stats.queries) < stats.max_queries:
+        stats.queries.append((elapsed, statement))
+
+
+def record_search(elapsed):
+    stats = request_stats()
+    if stats is None:
+        search_requests.inc(endpoint='background')
+        search_seconds.inc(elapsed, endpoint='background')
+        return
+    stats.search_count += 1
+    stats.search_time += elapsed
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is not None:
+        record_sql(time.perf_counter() - started, statement)
+
+
+def before_render(app, template, context):
+    if has_request_context():
+        g.render_started = time.perf_counter()
+
+
+def after_render(app, template, context):
+    started = g.pop('render_started', None) if has_request_context() \
+        else None
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    render_seconds.observe(elapsed, template=template.name or 'string')
+    stats = request_stats()
+    if stats is not None:
+        stats.render_time += elapsed
+
+
+def start_request():
+    g.request_stats = RequestStats()
+
+
+def finish_request(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    elapsed = time.perf_counter() - stats.started
+    endpoint = request.endpoint or 'unmatched'
+    request_seconds.observe(elapsed, endpoint=endpoint, method=request.method)
+    requests_total.inc(endpoint=endpoint, status=response.status_code)
+    request_statements.observe(stats.sql_count, endpoint=endpoint)
+    sql_statements.inc(stats.sql_count, endpoint=endpoint)
+    sql_seconds.inc(stats.sql_time, endpoint=endpoint)
+    if stats.search_count:
+        search_requests.inc(stats.search_count, endpoint=endpoint)
+        search_seconds.inc(stats.search_time, endpoint=endpoint)
+    if elapsed >= current_app.config['SLOW_REQUEST_SECONDS']:
+        log_slow_request(stats, elapsed)
+    return response
+
+
+def log_slow_request(stats, elapsed):
+    slowest = sorted(stats.queries, key=lambda query: -query[0])[:5]
+    logger.warning(
+        'Slow request %s %s took %.3fs: %d SQL statements in %.3fs, '
+        '%d search requests in %.3fs, templates %.3fs%s',
+        request.method, request.full_path, elapsed, stats.sql_count,
+        stats.sql_time, stats.search_count, stats.search_time,
+        stats.render_time,
+        ''.join('\n  %.3fs %s' % (seconds, ' '.join(statement.split()))
+                for seconds, statement in slowest))
+
+
+def render():
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+bp = Blueprint('metrics', __name__)
+
+
+@bp.route('/metrics')
+def metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != 'Bearer ' + token:
+        abort(401)
+    extensions = current_app.extensions
+    if 'mail_queue' in extensions:
+        mail_queue_depth.set(extensions['mail_queue'].depth())
+    if 'search_cache' in extensions:
+        cache = extensions['search_cache']
+        search_cache_lookups.set(cache.hits, result='hit')
+        search_cache_lookups.set(cache.misses, result='miss')
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Time requests, SQL, templates and search calls for ``/metrics``.
+
+    Values are kept in this process; every worker process reports its own.
+    """
+    if not event.contains(Engine, 'before_cursor_execute',
+                          before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    before_render_template.connect(before_render, app)
+    template_rendered.connect(after_render, app)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.register_blueprint(bp)
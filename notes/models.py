@@ -1,61 +1,206 @@
-from notes import db, login_manager, app
+from flask import current_app
+from notes import db, login_manager
 from flask_login import UserMixin
-from flask_seeder import Seeder, Faker, generator
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from notes.search import add_to_index, remove_from_index, query_index
+from notes.search import (
+    facet_index, get_backend, query_index, register_searchable,
+    search_index_ddl, searchable_models)
+from notes.reindex import reindex
+from notes.bulk import delete_ids
+from notes.cache import LocalStore, get_search_cache, normalize_query
+from notes.rows import NoteRow, NotebookRow, preview, to_rows
 from datetime import datetime
 
 
 class SearchableMixin(object):
+    __search_filters__ = []
+    __search_boosts__ = {}
+    # filter field whose value a 'purge' outbox row holds
+    __search_parent__ = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        register_searchable(cls)
+
+    @classmethod
+    def search(cls, expression, page=1, per_page=20, **filters):
+        def load():
+            return query_index(
+                cls.__tablename__, expression, filters, page, per_page)
+
+        user = filters.get('user')
+        with db.replica_reads():
+            if user is None:
+                ids, total = load()
+            else:
+                key = (cls.__tablename__, tuple(sorted(filters.items())),
+                       normalize_query(expression), page, per_page)
+                ids, total = get_search_cache().fetch(user, key, load)
+            if not ids:
+                return [], total
+            found = {row.id: row for row in cls.list_rows(
+                cls.id.in_(ids), *[getattr(cls, field) == value
+                                   for field, value in filters.items()])}
+        return [found[id] for id in ids if id in found], total
+
     @classmethod
-    def search(cls, expression):
-        ids, total = query_index(cls.__tablename__, expression)
-        if total == 0:
-            return cls.query.filter_by(id=0), 0
-        when = []
-        for i in range(len(ids)):
-            when.append((ids[i], i))
-        return cls.query.filter(cls.id.in_(ids)).order_by(
-            db.case(when, value=cls.id)), total
+    def list_rows(cls, *criteria):
+        """Slotted rows of the list columns, for pages that only show them."""
+        return to_rows(cls.__row__, cls.list_query().filter(*criteria))
 
     @classmethod
-    def before_commit(cls, session):
-        session._changes = {
-            'add': list(session.new),
-            'update': list(session.dirty),
-            'delete': list(session.deleted)
-        }
+    def facet_search(cls, expression, page=1, per_page=20, **filters):
+        """Hits with highlighted snippets and hit counts per parent.
+
+        One search request returns everything, and nothing is loaded from
+        the database; see ``notes.search.facet_index`` for the result.
+        """
+        def load():
+            return facet_index(
+                cls.__tablename__, expression, filters, page, per_page,
+                current_app.config['SEARCH_FACET_SIZE'])
+
+        user = filters.get('user')
+        with db.replica_reads():
+            if user is None:
+                return load()
+            key = ('facets', cls.__tablename__,
+                   tuple(sorted(filters.items())),
+                   normalize_query(expression), page, per_page)
+            return get_search_cache().fetch(user, key, load)
+
+    @classmethod
+    def model_for(cls, index):
+        return searchable_models[index]
+
+    @classmethod
+    def after_flush(cls, session, flush_context):
+        changed = [obj for obj in session.new | session.dirty
+                   if isinstance(obj, SearchableMixin)
+                   and session.is_modified(obj)]
+        deleted = [obj for obj in session.deleted
+                   if isinstance(obj, SearchableMixin)]
+        cls.record_changes(session, [
+            (obj.__tablename__, obj.id, 'index', obj.user)
+            for obj in changed] + [
+            (obj.__tablename__, obj.id, 'delete', obj.user)
+            for obj in deleted])
+
+    @staticmethod
+    def record_changes(session, changes):
+        """Record ``(index, id, op, user)`` changes made in ``session``.
+
+        Queues the search updates, writes a tombstone for every delete and
+        drops the cached searches of the users when the session commits.
+        Runs on every flush; code that writes with bulk statements, which
+        the flush never sees, calls it directly.
+        """
+        session.info.setdefault('search_users', set()).update(
+            user for index, id, op, user in changes)
+        tombstones = [{'kind': index, 'object_id': id, 'user': user}
+                      for index, id, op, user in changes if op == 'delete']
+        if tombstones:
+            session.execute(Tombstone.__table__.insert(), tombstones)
+        if not changes or not get_backend().external:
+            return
+        session.execute(SearchOutbox.__table__.insert(), [
+            {'index': index, 'doc_id': id, 'op': op, 'user': user}
+            for index, id, op, user in changes])
 
     @classmethod
     def after_commit(cls, session):
-        for obj in session._changes['add']:
-            if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
-        for obj in session._changes['update']:
-            if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
-        for obj in session._changes['delete']:
-            if isinstance(obj, SearchableMixin):
-                remove_from_index(obj.__tablename__, obj)
-        session._changes = None
+        users = session.info.pop('search_users', None)
+        if users:
+            get_search_cache().invalidate(users)
+
+    @classmethod
+    def after_rollback(cls, session):
+        session.info.pop('search_users', None)
+
+    @classmethod
+    def bulk_delete(cls, ids, user):
+        """Delete rows of ``user`` by id with one set-based statement."""
+        delete_ids(cls.__table__, ids, user)
+        cls.record_changes(db.session, [
+            (cls.__tablename__, id, 'delete', user) for id in ids])
 
     @classmethod
-    def reindex(cls):
-        for obj in cls.query:
-            add_to_index(cls.__tablename__, obj)
+    def reindex(cls, **kwargs):
+        return reindex(cls, **kwargs)
 
 
-db.event.listen(db.session, 'before_commit', SearchableMixin.before_commit)
+db.event.listen(db.session, 'after_flush', SearchableMixin.after_flush)
 db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
+db.event.listen(db.session, 'after_rollback', SearchableMixin.after_rollback)
+
+
+def get_user_cache():
+    extensions = current_app.extensions
+    if 'user_cache' not in extensions:
+        extensions['user_cache'] = LocalStore(
+            maxsize=current_app.config['USER_CACHE_SIZE'],
+            ttl=current_app.config['USER_CACHE_TTL'])
+    return extensions['user_cache']
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return Users.query.get(int(user_id))
+    user_id = int(user_id)
+    user = get_user_cache().get(user_id, 'user')
+    if user is None:
+        found = Users.query.get(user_id)
+        if found is None:
+            return None
+        user = CachedUser(found)
+        get_user_cache().set(user_id, 'user', user)
+    return user
+
+
+def collect_changed_users(session, flush_context):
+    changed = session.info.setdefault('changed_users', set())
+    changed.update(obj.id for obj in session.dirty | session.deleted
+                   if isinstance(obj, Users))
 
 
-class Users(db.Model, UserMixin):
+def invalidate_changed_users(session):
+    for user_id in session.info.pop('changed_users', ()):
+        get_user_cache().invalidate(user_id)
+
+
+def forget_changed_users(session):
+    session.info.pop('changed_users', None)
+
+
+db.event.listen(db.session, 'after_flush', collect_changed_users)
+db.event.listen(db.session, 'after_commit', invalidate_changed_users)
+db.event.listen(db.session, 'after_rollback', forget_changed_users)
+
+
+class ResetTokenMixin(object):
+    def get_reset_token(self, expires_sec=1800):
+        s = Serializer(current_app.config['SECRET_KEY'], expires_sec)
+        return s.dumps({'user_id': self.id}).decode('utf-8')
+
+
+class CachedUser(ResetTokenMixin, UserMixin):
+    """Detached copy of a user row that is safe to share between requests.
+
+    This is what ``current_user`` is. Views that change the account load
+    the ``Users`` row and commit it, which evicts the copy from the cache.
+    """
+    __slots__ = ('id', 'username', 'email', 'confirmed', 'confirmed_on')
+
+    def __init__(self, user):
+        for field in self.__slots__:
+            setattr(self, field, getattr(user, field))
+
+
+class Users(db.Model, ResetTokenMixin, UserMixin):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ux_users_email', 'email', unique=True),
+        db.Index('ux_users_username', 'username', unique=True),
+    )
     id = id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(30), nullable=False)
     email = db.Column(db.String(150), nullable=False)
@@ -64,13 +209,9 @@ class Users(db.Model, UserMixin):
     confirmed_on = db.Column(db.DateTime, nullable=True)
     notebooks = db.relationship('Notebook', backref='Users', lazy=True)
 
-    def get_reset_token(self, expires_sec=1800):
-        s = Serializer(app.config['SECRET_KEY'], expires_sec)
-        return s.dumps({'user_id': self.id}).decode('utf-8')
-
     @staticmethod
     def verify_reset_token(token):
-        s = Serializer(app.config['SECRET_KEY'])
+        s = Serializer(current_app.config['SECRET_KEY'])
         try:
             user_id = s.loads(token)['user_id']
         except Exception:
@@ -81,14 +222,90 @@ class Users(db.Model, UserMixin):
         return self.name
 
 
+class SearchOutbox(db.Model):
+    __tablename__ = 'search_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    index = db.Column(db.String(30), nullable=False)
+    doc_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    user = db.Column(db.Integer)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    available_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class Tombstone(db.Model):
+    """Marks a deleted notebook or note for clients syncing changes."""
+    __tablename__ = 'tombstone'
+    __table_args__ = (
+        db.Index('ix_tombstone_user_deleted_at', 'user', 'deleted_at', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)
+    object_id = db.Column(db.Integer, nullable=False)
+    user = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    deleted_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class MailDeadLetter(db.Model):
+    __tablename__ = 'mail_dead_letter'
+    id = db.Column(db.Integer, primary_key=True)
+    recipients = db.Column(db.String(500), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=True)
+    error = db.Column(db.String(500), nullable=True)
+    failed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
 class Notebook(SearchableMixin, db.Model):
     __tablename__ = 'notebook'
+    __table_args__ = (
+        db.Index('ix_notebook_user_date_created', 'user', 'date_created'),
+        db.Index('ix_notebook_user_updated_at', 'user', 'updated_at', 'id'),
+    )
     __searchable__ = ['name']
+    __search_filters__ = ['user']
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(20), nullable=False)
     user = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    date_created = db.Column(db.DateTime, default=datetime.utcnow)
-    notes = db.relationship('Note', backref='Notebook', lazy=True)
+    date_created = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow,
+        onupdate=datetime.utcnow)
+    notes = db.relationship(
+        'Note', backref='Notebook', lazy=True, passive_deletes=True)
+    __row__ = NotebookRow
+
+    @classmethod
+    def list_query(cls):
+        return db.session.query(cls.id, cls.name)
+
+    @classmethod
+    def bulk_delete(cls, ids, user):
+        """Delete notebooks together with all of their notes.
+
+        The notes go through ``ON DELETE CASCADE``. Their tombstones are
+        written with one ``INSERT ... SELECT``, and a single ``purge``
+        outbox row per notebook removes them from the search index, so the
+        number of statements does not depend on the number of notes.
+        """
+        if not ids:
+            return
+        note = Note.__table__
+        db.session.execute(Tombstone.__table__.insert().from_select(
+            ['kind', 'object_id', 'user', 'deleted_at'],
+            db.select([
+                db.literal(Note.__tablename__), note.c.id,
+                db.literal(user), db.literal(datetime.utcnow())])
+            .where(note.c.notebook.in_(ids) & (note.c.user == user))))
+        if get_backend().external:
+            db.session.execute(SearchOutbox.__table__.insert(), [
+                {'index': Note.__tablename__, 'doc_id': id, 'op': 'purge',
+                 'user': user}
+                for id in ids])
+        super().bulk_delete(ids, user)
 
     def __repr__(self):
         return self.name
@@ -96,43 +313,43 @@ class Notebook(SearchableMixin, db.Model):
 
 class Note(SearchableMixin, db.Model):
     __tablename__ = 'note'
+    __table_args__ = (
+        db.Index(
+            'ix_note_notebook_date_created_id',
+            'notebook', 'date_created', 'id'),
+        db.Index('ix_note_user_updated_at_id', 'user', 'updated_at', 'id'),
+    )
     __searchable__ = ['title', 'content']
+    __search_filters__ = ['notebook', 'user']
+    __search_boosts__ = {'title': 2}
+    __search_parent__ = 'notebook'
     id = db.Column(db.Integer, primary_key=True)
     notebook = db.Column(
         db.Integer,
-        db.ForeignKey('notebook.id'),
+        db.ForeignKey('notebook.id', ondelete='CASCADE'),
         nullable=False)
+    # Copied from the notebook, so a user's notes are found (and
+    # partitioned, see notes/partition.py) without a join.
+    user = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     title = db.Column(db.String(30), nullable=False)
     content = db.Column(db.String(500), nullable=False)
-    date_created = db.Column(db.DateTime, default=datetime.utcnow)
+    date_created = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow,
+        onupdate=datetime.utcnow)
+
+    __row__ = NoteRow
+
+    @classmethod
+    def list_query(cls):
+        return db.session.query(
+            cls.id, cls.notebook, cls.title, *preview(cls.content),
+            cls.date_created)
 
     def __repr__(self):
         return self.title
 
 
-class DemoSeeder(Seeder):
-
-    def run():
-        faker = Faker(
-            cls=Note,
-            init={
-                "notebook": 1,
-                "title": generator.Name(),
-                "content": generator.String('hello how are you')
-            }
-        )
-        
-        notebook = Faker(
-            cls=Notebook,
-            init={
-                "name": generator.Name(),
-                "user": 1
-            }
-        )
-        for ntbk in notebook.create(5):
-            db.session.add(ntbk)
-
-        for note in faker.create(15):
-            db.session.add(note)
-
-    run()
+for model in searchable_models.values():
+    db.event.listen(model.__table__, 'after_create', search_index_ddl(model))
@@ -0,0 +1,101 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from notes import db
+from notes.cache import LocalStore
+
+_counts = LocalStore(maxsize=4096, ttl=60)
+
+
+class KeysetPage(object):
+    def __init__(self, items, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(row, columns):
+    values = []
+    for column in columns:
+        value = getattr(row, column.key)
+        values.append(
+            value.isoformat() if isinstance(value, datetime) else value)
+    return base64.urlsafe_b64encode(
+        json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, columns):
+    """Turn a cursor from the URL back into column values.
+
+    Returns None for a missing or malformed cursor, which callers treat as
+    the first page. That includes values of the wrong type for their
+    column, which the database would reject.
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if len(values) != len(columns):
+            return None
+        decoded = []
+        for value, column in zip(values, columns):
+            kind = column.type.python_type
+            if kind is datetime:
+                value = datetime.fromisoformat(value)
+            if not isinstance(value, kind) or isinstance(value, bool):
+                return None
+            decoded.append(value)
+        return tuple(decoded)
+    except (ValueError, TypeError, binascii.Error):
+        return None
+
+
+def keyset_paginate(query, columns, per_page, after=None, before=None):
+    """Page through ``query`` ordered by ``columns`` without OFFSET.
+
+    ``columns`` must identify a row uniquely (end with the primary key).
+    Each page is one indexed range scan of ``per_page + 1`` rows, whatever
+    its position in the list.
+    """
+    key = db.tuple_(*columns)
+    if before is not None:
+        rows = query.filter(key < before) \
+            .order_by(*[column.desc() for column in columns]) \
+            .limit(per_page + 1).all()
+        more = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        return KeysetPage(
+            rows,
+            next_cursor=encode_cursor(rows[-1], columns) if rows else None,
+            prev_cursor=encode_cursor(rows[0], columns) if more else None)
+
+    if after is not None:
+        query = query.filter(key > after)
+    rows = query.order_by(*columns).limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1], columns) if more else None,
+        prev_cursor=encode_cursor(rows[0], columns)
+        if after is not None and rows else None)
+
+
+def cached_count(query, key):
+    """Row count of ``query``, cached for a minute under ``key``."""
+    count = _counts.get(None, key)
+    if count is None:
+        count = query.order_by(None).count()
+        _counts.set(None, key, count)
+    return count
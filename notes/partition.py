@@ -0,0 +1,235 @@
+"""Hash partitioning of the notebook and note tables by owner.
+
+This is optional and needs PostgreSQL 12 or later. Every row is placed by
+its ``user`` column, so the pages of one user only ever read and write one
+partition of each table, as long as their queries filter on ``user``,
+which every query in the app does. Each partition has its own indexes
+and is vacuumed on its own.
+
+The tables are converted while the app keeps running:
+
+1. empty partitioned copies are created next to the tables, with the same
+   columns, defaults and indexes, and a primary key of ``(id, user)``;
+2. a trigger on each table mirrors every write into its copy, and the
+   existing rows are copied over in batches of ids;
+3. in one short transaction the tables are locked, the triggers dropped
+   and the copies renamed into place. The old tables are kept as
+   ``<table>_unpartitioned`` until dropped.
+
+An interrupted run can simply be started again: every step picks up what
+an earlier one left behind.
+"""
+import re
+import time
+
+from notes import db
+
+# Parents first: note rows reference notebook rows.
+TABLES = ('notebook', 'note')
+SHADOW = '{}_partitioned'
+OLD = '{}_unpartitioned'
+
+# Updates are mirrored as updates: deleting and inserting again would
+# cascade from a notebook copy to the copies of its notes.
+MIRROR_FUNCTION = """
+CREATE OR REPLACE FUNCTION {table}_mirror() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM {shadow} WHERE id = OLD.id AND "user" = OLD."user";
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        UPDATE {shadow} SET ({columns}) = ({values})
+        WHERE id = OLD.id AND "user" = OLD."user";
+        IF FOUND THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    INSERT INTO {shadow} SELECT (NEW).* ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END
+$$"""
+
+# FOR SHARE makes a concurrent update or delete of a row wait until its
+# batch is committed, so the mirror trigger always acts after the copy.
+COPY_BATCH = """
+INSERT INTO {shadow}
+SELECT * FROM {table} WHERE id > :start AND id <= :stop FOR SHARE
+ON CONFLICT DO NOTHING"""
+
+
+def relkind(name):
+    return db.session.execute(
+        'SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)',
+        {'name': name}).scalar()
+
+
+def is_partitioned(table='note'):
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return False
+    return relkind(table) == 'p'
+
+
+def secondary_indexes(table):
+    """``(name, definition)`` of the indexes on ``table`` but its key."""
+    return db.session.execute(
+        'SELECT c.relname, pg_get_indexdef(i.indexrelid) '
+        'FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+        'WHERE i.indrelid = to_regclass(:table) AND NOT i.indisprimary '
+        'ORDER BY c.relname', {'table': table}).fetchall()
+
+
+def columns(table):
+    return [name for name, in db.session.execute(
+        'SELECT attname FROM pg_attribute '
+        'WHERE attrelid = to_regclass(:table) AND attnum > 0 '
+        'AND NOT attisdropped ORDER BY attnum', {'table': table})]
+
+
+def create_shadow(table, partitions):
+    shadow = SHADOW.format(table)
+    if relkind(shadow):
+        return
+    db.session.execute(
+        'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        'PARTITION BY HASH ("user")'.format(shadow, table))
+    db.session.execute(
+        'ALTER TABLE {} ADD PRIMARY KEY (id, "user"), '
+        'ADD CONSTRAINT {}_user_fkey FOREIGN KEY ("user") '
+        'REFERENCES users (id)'.format(shadow, table))
+    if table == 'note':
+        db.session.execute(
+            'ALTER TABLE {} ADD CONSTRAINT note_notebook_fkey '
+            'FOREIGN KEY (notebook, "user") REFERENCES {} (id, "user") '
+            'ON DELETE CASCADE'.format(shadow, SHADOW.format('notebook')))
+    for remainder in range(partitions):
+        db.session.execute(
+            'CREATE TABLE {0}_p{1} PARTITION OF {2} '
+            'FOR VALUES WITH (MODULUS {3}, REMAINDER {1})'.format(
+                table, remainder, shadow, partitions))
+    for name, definition in secondary_indexes(table):
+        match = re.match(r'CREATE (UNIQUE )?INDEX \S+ ON \S+ ', definition)
+        if match.group(1):
+            raise ValueError(
+                'Unique index {} cannot be partitioned by user'.format(name))
+        db.session.execute('CREATE INDEX {}_new ON {} {}'.format(
+            name, shadow, definition[match.end():]))
+    db.session.commit()
+
+
+def mirror(table):
+    """Start copying every write to ``table`` into its partitioned copy."""
+    names = columns(table)
+    db.session.execute(MIRROR_FUNCTION.format(
+        table=table, shadow=SHADOW.format(table),
+        columns=', '.join('"{}"'.format(name) for name in names),
+        values=', '.join('NEW."{}"'.format(name) for name in names)))
+    db.session.execute(
+        'DROP TRIGGER IF EXISTS {0}_mirror ON {0}'.format(table))
+    db.session.execute(
+        'CREATE TRIGGER {0}_mirror AFTER INSERT OR UPDATE OR DELETE ON {0} '
+        'FOR EACH ROW EXECUTE FUNCTION {0}_mirror()'.format(table))
+    db.session.commit()
+
+
+def copy_rows(table, batch_size, pause=0, progress=None):
+    """Copy the rows that existed before the mirror trigger, by id range."""
+    last = db.session.execute(
+        'SELECT max(id) FROM {}'.format(table)).scalar() or 0
+    statement = db.text(COPY_BATCH.format(
+        table=table, shadow=SHADOW.format(table)))
+    for start in range(0, last, batch_size):
+        db.session.execute(
+            statement, {'start': start, 'stop': start + batch_size})
+        db.session.commit()
+        if progress:
+            progress(table, min(start + batch_size, last), last)
+        if pause:
+            time.sleep(pause)
+
+
+def compare_counts():
+    for table in TABLES:
+        counts = db.session.execute(
+            'SELECT (SELECT count(*) FROM {}), (SELECT count(*) FROM {})'
+            .format(table, SHADOW.format(table))).fetchone()
+        if counts[0] != counts[1]:
+            raise RuntimeError('{} has {} rows but its copy has {}'.format(
+                table, *counts))
+
+
+def check_copies():
+    """Raise if a copy does not hold exactly the rows of its table.
+
+    The mirror trigger writes in the same transaction as the change, so
+    one snapshot sees both tables alike.
+    """
+    db.session.execute('SET LOCAL statement_timeout = 0')
+    compare_counts()
+    db.session.commit()
+
+
+def swap(lock_timeout):
+    """Rename the copies into place in one transaction.
+
+    The copies are counted again under the lock, and nothing is renamed
+    if a write since ``check_copies`` left them apart.
+    """
+    db.session.execute("SET LOCAL lock_timeout = '{}s'".format(lock_timeout))
+    db.session.execute('LOCK TABLE {} IN ACCESS EXCLUSIVE MODE'.format(
+        ', '.join(reversed(TABLES))))
+    db.session.execute('SET LOCAL statement_timeout = 0')
+    try:
+        compare_counts()
+    except RuntimeError:
+        db.session.rollback()
+        raise
+    for table in TABLES:
+        shadow = SHADOW.format(table)
+        old = OLD.format(table)
+        indexes = secondary_indexes(table)
+        db.session.execute('DROP TRIGGER {0}_mirror ON {0}'.format(table))
+        db.session.execute('DROP FUNCTION {}_mirror()'.format(table))
+        db.session.execute('ALTER TABLE {} RENAME TO {}'.format(table, old))
+        db.session.execute('ALTER TABLE {} RENAME TO {}'.format(shadow, table))
+        db.session.execute('ALTER INDEX {0}_pkey RENAME TO {1}_pkey'.format(
+            table, old))
+        db.session.execute('ALTER INDEX {}_pkey RENAME TO {}_pkey'.format(
+            shadow, table))
+        for name, definition in indexes:
+            db.session.execute('ALTER INDEX {0} RENAME TO {0}_old'.format(
+                name))
+            db.session.execute('ALTER INDEX {0}_new RENAME TO {0}'.format(
+                name))
+        db.session.execute('ALTER SEQUENCE {0}_id_seq OWNED BY {0}.id'.format(
+            table))
+    db.session.commit()
+
+
+def partition_tables(partitions=16, batch_size=10000, pause=0,
+                     lock_timeout=5, progress=None):
+    """Convert the notebook and note tables to ``partitions`` partitions.
+
+    ``pause`` seconds are waited between copied batches, and the final
+    swap gives up after waiting ``lock_timeout`` seconds for its lock, in
+    which case the run can be repeated.
+    """
+    if db.session.get_bind().dialect.name != 'postgresql':
+        raise ValueError('Partitioning needs PostgreSQL')
+    if is_partitioned():
+        raise ValueError('The tables are already partitioned')
+    for table in TABLES:
+        create_shadow(table, partitions)
+    for table in TABLES:
+        mirror(table)
+        copy_rows(table, batch_size, pause, progress)
+    check_copies()
+    swap(lock_timeout)
+
+
+def drop_unpartitioned():
+    """Drop the tables left behind by ``partition_tables``."""
+    db.session.execute('DROP TABLE IF EXISTS {}'.format(
+        ', '.join(OLD.format(table) for table in reversed(TABLES))))
+    db.session.commit()
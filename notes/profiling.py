@@ -0,0 +1,198 @@
+import cProfile
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import (
+    Blueprint, abort, current_app, g, jsonify, request, send_from_directory)
+
+MODES = ('cprofile', 'stacks')
+
+
+class StackSampler(object):
+    """Samples the stack of one thread into flamegraph-ready counts.
+
+    Output lines are ``frame;frame;frame count``, outermost frame first,
+    the collapsed format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='stack-sampler')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return ''.join('{} {}\n'.format(stack, count)
+                       for stack, count in self.counts.most_common())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append('{}:{}'.format(
+                    frame.f_globals.get('__name__', '?'),
+                    frame.f_code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+
+def profile_dir(app):
+    return app.config['PROFILE_DIR'] or os.path.join(
+        app.instance_path, 'profiles')
+
+
+def authorized(token):
+    expected = current_app.config['PROFILE_TOKEN']
+    return bool(expected and token) and hmac.compare_digest(
+        token.encode('utf-8'), expected.encode('utf-8'))
+
+
+def requested_mode():
+    """The profiling mode for this request, or None to run it normally."""
+    token = request.headers.get('X-Profile') or request.args.get('_profile')
+    if token is not None and authorized(token):
+        mode = request.headers.get('X-Profile-Mode') \
+            or request.args.get('_profile_mode')
+        return mode if mode in MODES else 'cprofile'
+    rate = current_app.config['PROFILE_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        return 'stacks'
+    return None
+
+
+def run_profiled(dispatch, mode):
+    started = time.perf_counter()
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        response = profiler.runcall(dispatch)
+    else:
+        profiler = StackSampler(
+            threading.get_ident(),
+            current_app.config['PROFILE_SAMPLE_INTERVAL'])
+        profiler.start()
+        try:
+            response = dispatch()
+        finally:
+            profiler.stop()
+    elapsed = time.perf_counter() - started
+    return response, save(profiler, mode, elapsed)
+
+
+def save(profiler, mode, elapsed):
+    """Write the profile and the SQL it ran; returns the profile id."""
+    directory = profile_dir(current_app)
+    os.makedirs(directory, exist_ok=True)
+    id = '{}-{}-{}'.format(
+        time.strftime('%Y%m%dT%H%M%S'),
+        re.sub(r'[^\w.]', '_', request.endpoint or 'unmatched'),
+        uuid.uuid4().hex[:8])
+    if mode == 'cprofile':
+        profiler.dump_stats(os.path.join(directory, id + '.prof'))
+    else:
+        with open(os.path.join(directory, id + '.stacks'), 'w') as out:
+            out.write(profiler.collapsed())
+    stats = g.get('request_stats')
+    queries = stats.queries if stats is not None else []
+    with open(os.path.join(directory, id + '.json'), 'w') as out:
+        json.dump({
+            'id': id,
+            'mode': mode,
+            'method': request.method,
+            'path': request.full_path,
+            'endpoint': request.endpoint,
+            'seconds': elapsed,
+            'sql': [{'seconds': seconds, 'statement': statement}
+                    for seconds, statement in queries]}, out, indent=1)
+    prune(directory, current_app.config['PROFILE_KEEP'])
+    return id
+
+
+def prune(directory, keep):
+    ids = sorted(name[:-len('.json')] for name in os.listdir(directory)
+                 if name.endswith('.json'))
+    for id in ids[:-keep] if keep else ():
+        for extension in ('.json', '.prof', '.stacks'):
+            try:
+                os.remove(os.path.join(directory, id + extension))
+            except FileNotFoundError:
+                pass
+
+
+bp = Blueprint('profiling', __name__, url_prefix='/profiles')
+
+
+@bp.before_request
+def require_token():
+    header = request.headers.get('Authorization', '')
+    token = header[len('Bearer '):] if header.startswith('Bearer ') \
+        else request.args.get('token')
+    if not authorized(token):
+        abort(404)
+
+
+@bp.route('/')
+def profiles():
+    directory = profile_dir(current_app)
+    if not os.path.isdir(directory):
+        return jsonify(profiles=[])
+    found = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if name.endswith('.json'):
+            with open(os.path.join(directory, name)) as summary:
+                info = json.load(summary)
+            info['queries'] = len(info.pop('sql'))
+            found.append(info)
+    return jsonify(profiles=found)
+
+
+@bp.route('/<name>')
+def download(name):
+    return send_from_directory(
+        profile_dir(current_app), name, as_attachment=True)
+
+
+def init_app(app):
+    """Profile requests on demand, when configured.
+
+    A request is profiled when it carries ``PROFILE_TOKEN`` in an
+    ``X-Profile`` header or a ``_profile`` query argument, or at random for
+    a ``PROFILE_SAMPLE_RATE`` fraction of requests. With neither set up the
+    app is left untouched, so there is no cost at all.
+    """
+    if not app.config['PROFILE_TOKEN'] and not app.config[
+            'PROFILE_SAMPLE_RATE']:
+        return
+    dispatch = app.dispatch_request
+
+    def dispatch_request():
+        mode = requested_mode()
+        if mode is None:
+            return dispatch()
+        response, id = run_profiled(dispatch, mode)
+        response = app.make_response(response)
+        response.headers['X-Profile-Id'] = id
+        return response
+
+    app.dispatch_request = dispatch_request
+    if app.config['PROFILE_TOKEN']:
+        app.register_blueprint(bp)
@@ -0,0 +1,164 @@
+import json
+import os
+import time
+
+from notes import db
+from notes.metrics import search_chunks_compared, search_drift
+from notes.models import SearchOutbox
+from notes.search import (
+    checksum, checksum_expression, document_fields, get_backend)
+
+
+def database_checksums(model, start, stop):
+    """``{id: checksum}`` of the rows with ``start <= id < stop``."""
+    query = db.session.query(model.id).filter(
+        model.id >= start, model.id < stop)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return dict(query.add_columns(checksum_expression(model)))
+    columns = [getattr(model, field) for field in document_fields(model)]
+    return {row[0]: checksum(row[1:])
+            for row in query.add_columns(*columns)}
+
+
+def database_digests(model, start, stop, chunk_size):
+    """``{chunk start: (rows, checksum sum)}`` for ids from ``start``.
+
+    On PostgreSQL the checksums are computed and summed by the database,
+    so only one row per chunk is returned. ``stop=None`` has no upper
+    bound.
+    """
+    stop = stop if stop is not None else max_id(model) + 1
+    if db.session.get_bind().dialect.name != 'postgresql':
+        digests = {}
+        for id, value in database_checksums(model, start, stop).items():
+            chunk = id // chunk_size * chunk_size
+            count, total = digests.get(chunk, (0, 0))
+            digests[chunk] = (count + 1, total + value)
+        return digests
+    chunk = (model.id / chunk_size * chunk_size).label('chunk')
+    rows = db.session.query(
+        chunk, db.func.count(), db.func.sum(checksum_expression(model))) \
+        .filter(model.id >= start, model.id < stop) \
+        .group_by(chunk)
+    return {chunk: (count, int(total)) for chunk, count, total in rows}
+
+
+def max_id(model):
+    return db.session.query(db.func.max(model.id)).scalar() or 0
+
+
+class Reconciler(object):
+    """Finds documents the search index has wrong and queues their repair.
+
+    Ids are compared in chunks of ``chunk_size``: both sides report the
+    number of documents and the sum of their checksums per chunk, one
+    request for ``window`` chunks at a time, and only the chunks that
+    differ are compared document by document. Missing, stale and extra
+    documents get ``index`` or ``delete`` rows in the search outbox, so the
+    indexer repairs them from the current rows, and ids that already have
+    outbox rows waiting are left alone. The cost of a run is a scan of
+    the checksums plus work proportional to the drift.
+
+    ``rate`` caps the ids compared per second. With ``state``, the path of
+    a JSON file, the position is saved after every window so an
+    interrupted run carries on where it stopped; the file is removed when
+    a run completes.
+    """
+
+    def __init__(self, chunk_size=1000, window=100, rate=None, state=None,
+                 progress=None):
+        self.chunk_size = chunk_size
+        self.window = window
+        self.rate = rate
+        self.state = state
+        self.progress = progress
+        self.backend = get_backend()
+
+    def run(self, models):
+        """Reconcile every model in turn; returns the report per index."""
+        saved = self._load()
+        for model in models:
+            index = model.__tablename__
+            report = saved.setdefault(index, {
+                'position': 0, 'chunks': 0, 'differing': 0,
+                'missing': 0, 'stale': 0, 'extra': 0, 'done': False})
+            if not report['done']:
+                self._reconcile(model, report, saved)
+        if self.state and os.path.exists(self.state):
+            os.remove(self.state)
+        return saved
+
+    def _reconcile(self, model, report, saved):
+        index = model.__tablename__
+        span = self.chunk_size * self.window
+        last = max_id(model)
+        while not report['done']:
+            started = time.monotonic()
+            start = report['position']
+            # The last window is open-ended, to find documents whose rows
+            # are gone beyond the highest id left in the table.
+            stop = start + span if start + span <= last else None
+            ours = database_digests(model, start, stop, self.chunk_size)
+            theirs = self.backend.digests(
+                index, start, stop, self.chunk_size)
+            chunks = sorted(set(ours) | set(theirs))
+            for chunk in chunks:
+                if ours.get(chunk) == theirs.get(chunk):
+                    search_chunks_compared.inc(index=index, result='match')
+                    continue
+                search_chunks_compared.inc(index=index, result='differ')
+                report['differing'] += 1
+                self._repair(model, chunk, report)
+            db.session.commit()
+            report['chunks'] += len(chunks)
+            if stop is None:
+                report['done'] = True
+            else:
+                report['position'] = stop
+            self._save(saved)
+            if self.progress:
+                self.progress(index, report, last)
+            if self.rate and stop is not None:
+                time.sleep(max(
+                    0, span / self.rate - (time.monotonic() - started)))
+
+    def _repair(self, model, chunk, report):
+        index = model.__tablename__
+        stop = chunk + self.chunk_size
+        ours = database_checksums(model, chunk, stop)
+        theirs = self.backend.checksums(index, chunk, stop)
+        changes = [(id, 'index') for id in sorted(ours)
+                   if theirs.get(id) != ours[id]]
+        changes += [(id, 'delete') for id in sorted(theirs)
+                    if id not in ours]
+        if not changes:
+            return
+        queued = {id for id, in db.session.query(SearchOutbox.doc_id).filter(
+            SearchOutbox.index == index,
+            SearchOutbox.doc_id.in_([id for id, op in changes]))}
+        changes = [(id, op) for id, op in changes if id not in queued]
+        for id, op in changes:
+            if op == 'delete':
+                kind = 'extra'
+            else:
+                kind = 'stale' if id in theirs else 'missing'
+            report[kind] += 1
+            search_drift.inc(index=index, kind=kind)
+        if changes:
+            db.session.execute(SearchOutbox.__table__.insert(), [
+                {'index': index, 'doc_id': id, 'op': op}
+                for id, op in changes])
+
+    def _load(self):
+        if self.state and os.path.exists(self.state):
+            with open(self.state) as state:
+                return json.load(state)
+        return {}
+
+    def _save(self, saved):
+        if not self.state:
+            return
+        # Written aside and renamed, so a crash never leaves half a file.
+        with open(self.state + '.tmp', 'w') as state:
+            json.dump(saved, state)
+        os.replace(self.state + '.tmp', self.state)
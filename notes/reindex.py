@@ -0,0 +1,111 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from notes import db
+from notes.search import (
+    bulk_update, create_index, get_elasticsearch, index_body, payload_for,
+    swap_alias)
+
+# Rows whose transaction began this long before a rebuild but committed
+# after its scan passed them are queued again too.
+REPLAY_MARGIN = timedelta(minutes=5)
+
+
+def iter_payloads(model, chunk_size):
+    """Yield ``(id, payload)`` chunks, walking the table by primary key.
+
+    Every chunk is a fresh keyset query and the session is emptied between
+    chunks, so memory stays flat however large the table is.
+    """
+    last_id = 0
+    while True:
+        chunk = model.query.filter(model.id > last_id) \
+            .order_by(model.id).limit(chunk_size).all()
+        if not chunk:
+            return
+        last_id = chunk[-1].id
+        yield [(obj.id, payload_for(obj)) for obj in chunk]
+        db.session.expunge_all()
+
+
+def reindex(model, index=None, batch_size=1000, workers=4, progress=None,
+            client=None):
+    client = client or get_elasticsearch()
+    index = index or model.__tablename__
+    total = model.query.count()
+    done = failed = 0
+    started = time.monotonic()
+
+    def collect(futures):
+        nonlocal done, failed
+        for future in futures:
+            sent, errors = future.result()
+            done += sent
+            failed += len(errors)
+        if progress:
+            progress(done, total, time.monotonic() - started)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for chunk in iter_payloads(model, batch_size):
+            actions = [('index', index, id, payload) for id, payload in chunk]
+            pending.add(pool.submit(_send, actions, client))
+            if len(pending) >= workers * 2:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+        collect(pending)
+    return done, failed
+
+
+def rebuild(model, batch_size=1000, workers=4, progress=None, client=None,
+            delete_old=False):
+    """Reindex into a fresh index and atomically point the alias at it.
+
+    Searches keep hitting the previous index until the alias is swapped.
+    The indexer keeps writing to that index meanwhile, so the rows changed
+    and deleted since the build started are queued again after the swap.
+    """
+    client = client or get_elasticsearch()
+    alias = model.__tablename__
+    started = datetime.utcnow()
+    index = '{}-{:%Y%m%d%H%M%S}'.format(alias, started)
+    body = index_body(model)
+    body['settings'] = dict(
+        body['settings'], refresh_interval='-1', number_of_replicas=0)
+    create_index(index, body, client=client)
+    done, failed = reindex(
+        model, index, batch_size, workers, progress, client)
+    client.indices.put_settings(index=index, body={
+        'index': {'refresh_interval': None, 'number_of_replicas': None}})
+    client.indices.refresh(index=index)
+    old = swap_alias(alias, index, client=client)
+    replay_changes(model, started - REPLAY_MARGIN)
+    if delete_old and old:
+        client.indices.delete(index=','.join(old))
+    return index, done, failed
+
+
+def replay_changes(model, since):
+    """Queue the rows of ``model`` written since ``since``; returns how
+    many changes were queued.
+    """
+    # notes.models imports this module.
+    from notes.models import SearchOutbox, Tombstone
+    index = model.__tablename__
+    changes = [
+        {'index': index, 'doc_id': id, 'op': 'index'}
+        for id, in db.session.query(model.id).filter(
+            model.updated_at >= since)]
+    changes += [
+        {'index': index, 'doc_id': id, 'op': 'delete'}
+        for id, in db.session.query(Tombstone.object_id).filter(
+            Tombstone.kind == index, Tombstone.deleted_at >= since)]
+    if changes:
+        db.session.execute(SearchOutbox.__table__.insert(), changes)
+    db.session.commit()
+    return len(changes)
+
+
+def _send(actions, client):
+    return len(actions), bulk_update(actions, client)
@@ -1,5 +1,4 @@
-from notes import (
-    app, db, bcrypt, mail)
+from notes import db, bcrypt
 from notes.forms import (
     NotebookForm,
     NoteForm,
@@ -10,10 +9,20 @@ from notes.forms import (
     UpdateAccountForm,
     SearchForm)
 from notes.models import Notebook, Note, Users
-from flask import render_template, redirect, url_for, request, flash
+from notes.concurrency import fan_out
+from notes.mailer import get_mail_queue
+from notes.pagination import cached_count, decode_cursor, keyset_paginate
+from notes.rows import to_rows
+from notes.search import highlight_markup, last_page
+from flask import (
+    Blueprint, render_template, redirect, url_for, request, flash)
 from flask_login import login_user, current_user, logout_user, login_required
 from flask_mail import Message
 import datetime
+import math
+
+bp = Blueprint('main', __name__)
+bp.app_template_filter('highlight')(highlight_markup)
 
 
 def send_reset_email(subject, user, body, url):
@@ -23,13 +32,13 @@ def send_reset_email(subject, user, body, url):
                   recipients=[user.email])
     msg.body = f'''{body}
     {url_for(url, token=token, _external=True)}'''
-    mail.send(msg)
+    get_mail_queue().enqueue(msg)
 
 
-@app.route('/', methods=['GET', 'POST'])
+@bp.route('/', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('notebooks'))
+        return redirect(url_for('main.notebooks'))
 
     form = RegisterForm()
     if form.validate_on_submit():
@@ -45,16 +54,16 @@ def register():
         subject = 'Email Confirmation'
         body = '''Welcome! Thanks for signing up.
         Please follow this link to activate your account:'''
-        url = 'confirm_email'
+        url = 'main.confirm_email'
         send_reset_email(subject, user, body, url)
         login_user(user)
         flash('A confirmation email has been sent via email.', 'success')
-        return redirect(url_for('unconfirmed'))
+        return redirect(url_for('main.unconfirmed'))
 
     return render_template('register.html', form=form)
 
 
-@app.route('/confirm/<token>')
+@bp.route('/confirm/<token>')
 @login_required
 def confirm_email(token):
     user = Users.verify_reset_token(token)
@@ -71,38 +80,38 @@ def confirm_email(token):
         db.session.commit()
         flash('You have confirmed your account. Thanks!', 'success')
 
-    return redirect(url_for('unconfirmed'))
+    return redirect(url_for('main.unconfirmed'))
 
 
-@app.route('/unconfirmed')
+@bp.route('/unconfirmed')
 @login_required
 def unconfirmed():
     if current_user.confirmed:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     flash('Please confirm your account!', 'warning')
     return render_template('unconfirmed.html')
 
 
-@app.route('/resend')
+@bp.route('/resend')
 @login_required
 def resend_confirmation():
     subject = 'Email Confirmation'
     body = "Welcome! Thanks for signing up. Please follow this link to activate your account:"
-    url = 'confirm_email'
+    url = 'main.confirm_email'
     send_reset_email(subject, current_user, body, url)
     # token = generate_confirmation_token(current_user.email)
-    # confirm_url = url_for('confirm_email', token=token, _external=True)
+    # confirm_url = url_for('main.confirm_email', token=token, _external=True)
     # html = render_template('activate.html', confirm_url=confirm_url)
     # subject = "Please confirm your email"
     # send_email(current_user.email, subject, html)
     flash('A new confirmation email has been sent.', 'success')
-    return redirect(url_for('unconfirmed'))
+    return redirect(url_for('main.unconfirmed'))
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('notebooks'))
+        return redirect(url_for('main.notebooks'))
 
     form = LoginForm()
     if form.validate_on_submit():
@@ -113,7 +122,7 @@ def login():
             login_user(user,  remember=form.remember.data)
             next_page = request.args.get('next')
             flash('You have been Logged In', 'success')
-            return redirect(next_page or url_for('notebooks'))
+            return redirect(next_page or url_for('main.notebooks'))
         else:
             flash(
                 'Login Unsuccessful, Please check email and password',
@@ -121,14 +130,15 @@ def login():
     return render_template('login.html', form=form)
 
 
-@app.route('/logout', methods=['GET', 'POST'])
+@bp.route('/logout', methods=['GET', 'POST'])
 def logout():
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 
-@app.route('/home', methods=['GET', 'POST'])
+@bp.route('/home', methods=['GET', 'POST'])
 @login_required
+@db.read_only
 def notebooks():
     form = NotebookForm()
     user_id = current_user.get_id()
@@ -136,26 +146,36 @@ def notebooks():
         notebook_name = Notebook(name=form.name.data, user=user_id)
         db.session.add(notebook_name)
         db.session.commit()
-        return redirect(url_for('notebooks'))
-    notebooks = Notebook.query.filter_by(user=user_id)
+        return redirect(url_for('main.notebooks'))
+    notebooks = Notebook.list_rows(Notebook.user == user_id)
     return render_template('notebook.html', form=form, notebooks=notebooks)
 
 
-@app.route('/notes/<int:id>', methods=['GET', 'POST'])
+@bp.route('/notes/<int:id>', methods=['GET', 'POST'])
 @login_required
+@db.read_only
 def notes(id):
-    notebook = Notebook.query.get_or_404(id)
+    user = current_user.id
+    notebook = Notebook.query.filter_by(id=id, user=user).first_or_404()
     form = NoteForm()
     if form.validate_on_submit():
         note = Note(
             title=form.title.data,
             content=form.content.data,
-            notebook=id)
+            notebook=id,
+            user=user)
         db.session.add(note)
         db.session.commit()
-        return redirect(url_for('notes', id=id))
-    page = request.args.get('page', 1, type=int)
-    notes = Note.query.filter_by(notebook=id).order_by('date_created').paginate(page=page, per_page=8)
+        return redirect(url_for('main.notes', id=id))
+    columns = (Note.date_created, Note.id)
+    notes = keyset_paginate(
+        Note.list_query().filter(Note.notebook == id, Note.user == user),
+        columns, 8,
+        after=decode_cursor(request.args.get('after'), columns),
+        before=decode_cursor(request.args.get('before'), columns))
+    notes.items = to_rows(Note.__row__, notes.items)
+    notes.total = cached_count(
+        Note.query.filter_by(notebook=id, user=user), ('notes', id))
     return render_template(
         'note.html',
         form=form,
@@ -163,85 +183,88 @@ def notes(id):
         notebook=notebook)
 
 
-@app.route('/delete/<int:pk>/<int:id>')
+@bp.route('/delete/<int:pk>/<int:id>')
 @login_required
 def note_delete(pk, id):
-    note_to_delete = Note.query.get_or_404(pk)
+    note_to_delete = Note.query.filter_by(
+        id=pk, user=current_user.id).first_or_404()
 
     try:
         db.session.delete(note_to_delete)
         db.session.commit()
-        return redirect(url_for('notes', id=id))
+        return redirect(url_for('main.notes', id=id))
     except Exception:
         return 'There was a problem deleting that Note'
 
 
-@app.route('/update/<int:pk>/<int:id>', methods=['GET', 'POST'])
+@bp.route('/update/<int:pk>/<int:id>', methods=['GET', 'POST'])
 @login_required
 def note_update(pk, id):
-    note_to_update = Note.query.get_or_404(pk)
+    note_to_update = Note.query.filter_by(
+        id=pk, user=current_user.id).first_or_404()
 
     if request.method == 'POST':
         note_to_update.title = request.form['title']
         note_to_update.content = request.form['content']
         try:
             db.session.commit()
-            return redirect(url_for('notes', id=id))
+            return redirect(url_for('main.notes', id=id))
         except Exception:
             return 'There was a problem editing that Note'
 
     return render_template('update.html', note=note_to_update)
 
 
-@app.route('/delete/<int:id>')
+@bp.route('/delete/<int:id>')
 @login_required
 def notebook_delete(id):
-    notebook_to_delete = Notebook.query.get_or_404(id)
+    Notebook.query.filter_by(id=id, user=current_user.id).first_or_404()
 
     try:
-        db.session.delete(notebook_to_delete)
+        Notebook.bulk_delete([id], current_user.id)
         db.session.commit()
-        return redirect(url_for('notebooks'))
+        return redirect(url_for('main.notebooks'))
     except Exception:
         return 'There was a problem deleting that Note'
 
 
-@app.route('/update/<int:id>', methods=['GET', 'POST'])
+@bp.route('/update/<int:id>', methods=['GET', 'POST'])
 @login_required
 def notebook_update(id):
-    notebook_to_update = Notebook.query.get_or_404(id)
+    notebook_to_update = Notebook.query.filter_by(
+        id=id, user=current_user.id).first_or_404()
 
     if request.method == 'POST':
         notebook_to_update.name = request.form['name']
         try:
             db.session.commit()
-            return redirect(url_for('notes', id=id))
+            return redirect(url_for('main.notes', id=id))
         except Exception:
             return 'There was a problem editing that Note'
 
     return render_template('notebook_update.html', notebook=notebook_to_update)
 
 
-@app.route('/reset', methods=['GET', 'POST'])
+@bp.route('/reset', methods=['GET', 'POST'])
 def reset_request():
     form = ResetRequestForm()
     if form.validate_on_submit():
         user = Users.query.filter_by(email=form.email.data).first()
         subject = 'Password Reset Request'
         body = "To reset your password, visit the following link:"
-        url = 'reset_token'
+        url = 'main.reset_token'
         send_reset_email(subject, user, body, url)
         flash('An email has been sent to reset your password.', 'info')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('request_reset.html', form=form)
 
 
-@app.route('/reset_password/<token>', methods=['GET', 'POST'])
+@bp.route('/reset_password/<token>', methods=['GET', 'POST'])
 def reset_token(token):
     user = Users.verify_reset_token(token)
     if user is None:
         flash('That is an invalid  or expired token', 'warning')
-        return redirect(url_for('reset_request'))
+        return redirect(url_for('main.reset_request'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
         hashed_password = bcrypt.generate_password_hash(form.password.data)\
@@ -251,61 +274,97 @@ def reset_token(token):
         flash(
             'Your password has been updated! You are now able to log in',
             'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('request_password.html', form=form)
 
 
-@app.route("/account", methods=['GET', 'POST'])
+@bp.route("/account", methods=['GET', 'POST'])
 @login_required
 def account():
     form = UpdateAccountForm()
     if form.validate_on_submit():
-        current_user.email = form.email.data
-        current_user.confirmed = False
+        user = Users.query.get(current_user.id)
+        user.email = form.email.data
+        user.confirmed = False
         db.session.commit()
         subject = 'Email Confirmation'
         body = '''Welcome! Thanks for signing up.
         Please follow this link to activate your account:'''
-        url = 'confirm_email'
-        send_reset_email(subject, current_user, body, url)
+        url = 'main.confirm_email'
+        send_reset_email(subject, user, body, url)
         flash('A confirmation email has been sent via email.', 'success')
         flash('Your account has been updated!', 'success')
-        return redirect(url_for('account'))
+        return redirect(url_for('main.account'))
     elif request.method == 'GET':
         form.email.data = current_user.email
     return render_template('profile.html', form=form)
 
 
-@app.route('/search')
+@bp.route('/search')
 @login_required
+@db.read_only
 def search():
     form = SearchForm()
-    if request.args.get('search') == '':
-        return redirect(url_for('notebooks'))
-    notebooks, total = Notebook.search(request.args.get('search'))
-    if total == 0:
+    q = request.args.get('search', '')
+    if q == '':
+        return redirect(url_for('main.notebooks'))
+    per_page = 12
+    page = min(max(request.args.get('page', 1, type=int), 1),
+               last_page(per_page))
+    user = current_user.id
+
+    def notebook_matches():
+        if page > 1:
+            return []
+        return Notebook.search(q, 1, per_page, user=user)[0]
+
+    notebooks, results = fan_out(
+        notebook_matches,
+        lambda: Note.facet_search(q, page, per_page, user=user))
+    if not notebooks and results['total'] == 0:
         flash('No search result found', 'danger')
-        return redirect(url_for('notebooks'))
+        return redirect(url_for('main.notebooks'))
+    ids = {hit['notebook'] for hit in results['hits']} \
+        | {notebook for notebook, count in results['facets']}
+    names = {}
+    if ids:
+        names = dict(db.session.query(Notebook.id, Notebook.name).filter(
+            Notebook.id.in_(ids), Notebook.user == user))
     return render_template(
         'notebook_search.html',
         notebooks=notebooks,
+        notes=results['hits'],
+        facets=results['facets'],
+        names=names,
+        q=q,
+        page=page,
+        pages=min(math.ceil(results['total'] / per_page),
+                  last_page(per_page)),
         form=form)
 
 
-@app.route('/<int:id>/search-note')
+@bp.route('/<int:id>/search-note')
 @login_required
 def note_search(id):
-    notebook = Notebook.query.get_or_404(id)
+    notebook = Notebook.query.filter_by(
+        id=id, user=current_user.id).first_or_404()
     form = SearchForm()
-    if request.args.get('search') == '':
-        return redirect(url_for('notes', id=id))
-    notes, total = Note.search(request.args.get('search'))
-    print('total is', total)
+    q = request.args.get('search', '')
+    if q == '':
+        return redirect(url_for('main.notes', id=id))
+    per_page = 8
+    page = min(max(request.args.get('page', 1, type=int), 1),
+               last_page(per_page))
+    notes, total = Note.search(
+        q, page, per_page, notebook=id, user=current_user.id)
     if total == 0:
         flash('No search result found', 'danger')
-        return redirect(url_for('notes', id=id))
+        return redirect(url_for('main.notes', id=id))
     return render_template(
         'note_search.html',
         notes=notes,
         notebook=notebook,
+        q=q,
+        page=page,
+        pages=min(math.ceil(total / per_page), last_page(per_page)),
         form=form)
@@ -0,0 +1,43 @@
+from notes import db
+
+PREVIEW_LENGTH = 160
+
+
+class Row(object):
+    """Read-only result row holding only the columns a list page shows.
+
+    Built straight from a column query, so nothing enters the session's
+    identity map and no attribute instrumentation is involved.
+    """
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return '<{} {}>'.format(type(self).__name__, ' '.join(
+            '{}={!r}'.format(name, getattr(self, name))
+            for name in self.__slots__))
+
+
+class NotebookRow(Row):
+    __slots__ = ('id', 'name')
+
+
+class NoteRow(Row):
+    __slots__ = (
+        'id', 'notebook', 'title', 'preview', 'truncated', 'date_created')
+
+
+def preview(column, length=PREVIEW_LENGTH):
+    """Columns with the start of ``column`` and whether it was cut short.
+
+    The text is truncated by the database, so long values never leave it.
+    """
+    return (db.func.substr(column, 1, length).label('preview'),
+            (db.func.length(column) > length).label('truncated'))
+
+
+def to_rows(row_class, results):
+    return [row_class(*values) for values in results]
@@ -1,26 +1,647 @@
-from notes import app
+import hashlib
+import re
+import threading
+import time
 
+from elasticsearch import Elasticsearch, Transport
+from flask import current_app
+from markupsafe import Markup, escape
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import BIT
 
-def add_to_index(index, model):
-    if not app.elasticsearch:
-        return
-    payload = {}
+from notes import db
+from notes.metrics import record_search
+
+INDEX_SETTINGS = {
+    'analysis': {
+        'analyzer': {
+            'folded': {
+                'type': 'custom',
+                'tokenizer': 'standard',
+                'filter': ['lowercase', 'asciifolding']},
+            'prefix': {
+                'type': 'custom',
+                'tokenizer': 'standard',
+                'filter': ['lowercase', 'asciifolding', 'prefix']},
+            'trigram': {
+                'type': 'custom',
+                'tokenizer': 'trigram',
+                'filter': ['lowercase', 'asciifolding']}},
+        'filter': {
+            'prefix': {'type': 'edge_ngram', 'min_gram': 2, 'max_gram': 20}},
+        'tokenizer': {
+            'trigram': {
+                'type': 'ngram',
+                'min_gram': 3,
+                'max_gram': 3,
+                'token_chars': ['letter', 'digit']}}}}
+
+TEXT_MAPPING = {
+    'type': 'text',
+    'analyzer': 'folded',
+    'fields': {
+        'prefix': {
+            'type': 'text',
+            'analyzer': 'prefix',
+            'search_analyzer': 'folded'},
+        'ngram': {'type': 'text', 'analyzer': 'trigram'}}}
+
+# Highlighted terms are wrapped in these private-use characters by every
+# backend; highlight_markup turns them into <mark> after escaping the rest.
+MARK_START = '\ue000'
+MARK_END = '\ue001'
+SNIPPET_WORDS = 25
+SNIPPET_CHARS = 150
+# Elasticsearch's default index.max_result_window.
+MAX_RESULT_WINDOW = 10000
+
+
+searchable_models = {}
+
+
+def register_searchable(model):
+    searchable_models[model.__tablename__] = model
+
+
+def index_body(model):
+    """Settings and mappings for the index backing ``model``.
+
+    Every searchable field is indexed three ways: whole words, word
+    prefixes (edge n-grams) and trigrams for matches inside words, so
+    substring search never needs a wildcard query.
+    """
+    properties = {}
+    for field in model.__searchable__:
+        properties[field] = TEXT_MAPPING
+    for field in model.__search_filters__:
+        properties[field] = {'type': 'integer'}
+    properties['id'] = {'type': 'integer'}
+    properties['checksum'] = {'type': 'long'}
+    return {
+        'settings': INDEX_SETTINGS,
+        'mappings': {'dynamic': False, 'properties': properties}}
+
+
+def build_query(model, query, filters):
+    fields = []
     for field in model.__searchable__:
+        boost = model.__search_boosts__.get(field, 1)
+        fields += [
+            '{}^{}'.format(field, 3 * boost),
+            '{}.prefix^{}'.format(field, 2 * boost),
+            '{}.ngram^{}'.format(field, boost)]
+    return {'bool': {
+        'must': {'multi_match': {
+            'query': query,
+            'type': 'most_fields',
+            'fields': fields,
+            'operator': 'and'}},
+        'filter': [
+            {'term': {field: value}} for field, value in filters.items()]}}
+
+
+def document_fields(model):
+    return model.__searchable__ + model.__search_filters__
+
+
+def payload_for(model):
+    payload = {}
+    for field in document_fields(model):
         payload[field] = getattr(model, field)
-    app.elasticsearch.index(index=index, id=model.id, body=payload)
+    payload['id'] = model.id
+    payload['checksum'] = checksum(
+        payload[field] for field in document_fields(model))
+    return payload
+
+
+def checksum(values):
+    """32-bit digest of a document's field values, stored with it.
+
+    ``checksum_expression`` computes the same number in PostgreSQL, which
+    is how ``notes.reconcile`` compares the two sides without moving the
+    documents.
+    """
+    text = '\x1f'.join(str(value) for value in values)
+    return int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def checksum_expression(model):
+    text = db.func.concat_ws(db.func.chr(31), *[
+        db.cast(getattr(model, field), db.Text)
+        for field in document_fields(model)])
+    digest = db.literal('x') + db.func.substr(db.func.md5(text), 1, 8)
+    return db.cast(db.cast(digest, BIT(32)), db.BigInteger)
+
+
+class TimedTransport(Transport):
+    def perform_request(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().perform_request(*args, **kwargs)
+        finally:
+            record_search(time.perf_counter() - started)
+
+
+class ElasticsearchBackend(object):
+    external = True
+
+    def __init__(self, client):
+        self.client = client
+
+    def add(self, index, model):
+        self.client.index(index=index, id=model.id, body=payload_for(model))
+
+    def remove(self, index, model):
+        self.client.delete(index=index, id=model.id)
+
+    def bulk(self, actions):
+        body = []
+        for op, index, id, payload in actions:
+            body.append({op: {'_index': index, '_id': id}})
+            if op == 'index':
+                body.append(payload)
+        response = self.client.bulk(body=body)
+        failed = set()
+        if not response.get('errors'):
+            return failed
+        for position, item in enumerate(response['items']):
+            op, result = next(iter(item.items()))
+            status = result.get('status', 200)
+            if status >= 300 and not (op == 'delete' and status == 404):
+                failed.add(position)
+        return failed
+
+    def purge(self, index, field, values):
+        self.client.delete_by_query(
+            index=index,
+            body={'query': {'terms': {field: sorted(values)}}},
+            conflicts='proceed')
+
+    def setup(self):
+        for index, model in searchable_models.items():
+            if not self.client.indices.exists(index=index):
+                self.client.indices.create(
+                    index=index, body=index_body(model))
+            else:
+                # Adds fields introduced since the index was created.
+                self.client.indices.put_mapping(
+                    index=index, body=index_body(model)['mappings'])
+
+    def digests(self, index, start, stop, chunk_size):
+        search = self.client.search(index=index, body={
+            'size': 0,
+            'query': {'range': {'id': id_range(start, stop)}},
+            'aggs': {'chunks': {
+                'histogram': {
+                    'field': 'id',
+                    'interval': chunk_size,
+                    'min_doc_count': 1},
+                'aggs': {'checksum': {'sum': {'field': 'checksum'}}}}}})
+        return {
+            int(bucket['key']):
+            (bucket['doc_count'], int(bucket['checksum']['value']))
+            for bucket in search['aggregations']['chunks']['buckets']}
+
+    def checksums(self, index, start, stop):
+        # One response holds at most index.max_result_window hits, so
+        # larger ranges are paged through in id order.
+        body = {
+            'size': min(stop - start, MAX_RESULT_WINDOW),
+            'query': {'range': {'id': id_range(start, stop)}},
+            'sort': [{'id': 'asc'}],
+            '_source': ['checksum']}
+        checksums = {}
+        while True:
+            hits = self.client.search(index=index, body=body)['hits']['hits']
+            checksums.update((int(hit['_id']), hit['_source'].get('checksum'))
+                             for hit in hits)
+            if len(hits) < body['size']:
+                return checksums
+            body['search_after'] = hits[-1]['sort']
+
+    def query(self, index, query, filters, page, per_page):
+        body = {
+            'query': build_query(searchable_models[index], query, filters),
+            'track_total_hits': True,
+            '_source': False}
+        body.update(page_window(page, per_page))
+        search = self.client.search(index=index, body=body)
+        ids = [int(hit['_id']) for hit in search['hits']['hits']]
+        return ids, search['hits']['total']['value']
+
+    def facet_query(self, index, query, filters, page, per_page, size):
+        model = searchable_models[index]
+        parent = model.__search_parent__
+        fields = {}
+        for field in model.__searchable__:
+            for name in (field, field + '.prefix', field + '.ngram'):
+                fields[name] = {}
+        body = {
+            'query': build_query(model, query, filters),
+            'track_total_hits': True,
+            '_source': [parent],
+            'highlight': {
+                'pre_tags': [MARK_START],
+                'post_tags': [MARK_END],
+                'fragment_size': SNIPPET_CHARS,
+                'number_of_fragments': 1,
+                'no_match_size': SNIPPET_CHARS,
+                'fields': fields},
+            'aggs': {'facets': {'terms': {'field': parent, 'size': size}}}}
+        body.update(page_window(page, per_page))
+        search = self.client.search(index=index, body=body)
+        hits = []
+        for hit in search['hits']['hits']:
+            found = hit.get('highlight', {})
+            highlights = {}
+            for field in model.__searchable__:
+                fragments = [found[name][0] for name in (
+                    field, field + '.prefix', field + '.ngram')
+                    if found.get(name)]
+                marked = [fragment for fragment in fragments
+                          if MARK_START in fragment]
+                highlights[field] = (marked or fragments or [''])[0]
+            hits.append({
+                'id': int(hit['_id']),
+                parent: hit['_source'][parent],
+                'highlights': highlights})
+        buckets = search['aggregations']['facets']['buckets']
+        return {
+            'hits': hits,
+            'total': search['hits']['total']['value'],
+            'facets': [[bucket['key'], bucket['doc_count']]
+                       for bucket in buckets]}
+
+
+class DatabaseBackend(object):
+    """Full-text search served by PostgreSQL itself.
+
+    The rows are the index: each searchable table has a GIN index over
+    ``search_vector(model)``, so there is nothing to push on writes. Terms
+    are matched as prefixes and ranked with ``ts_rank``.
+    """
+    external = False
+
+    def setup(self):
+        pass
+
+    def add(self, index, model):
+        pass
+
+    def remove(self, index, model):
+        pass
+
+    def bulk(self, actions):
+        return set()
+
+    def purge(self, index, field, values):
+        pass
+
+    def query(self, index, query, filters, page, per_page):
+        terms = re.findall(r'\w+', query.lower())
+        if not terms:
+            return [], 0
+        model = searchable_models[index]
+        vector = search_vector(model)
+        tsquery = db.func.to_tsquery(
+            db.literal_column("'simple'"),
+            ' & '.join(term + ':*' for term in terms))
+        matches = db.session.query(model.id) \
+            .filter(vector.op('@@')(tsquery)) \
+            .filter_by(**filters)
+        rows = matches.add_columns(db.func.count().over()) \
+            .order_by(db.func.ts_rank(vector, tsquery).desc(), model.id) \
+            .offset((page - 1) * per_page).limit(per_page).all()
+        if rows:
+            return [row[0] for row in rows], rows[0][1]
+        return [], matches.count() if page > 1 else 0
+
+    def facet_query(self, index, query, filters, page, per_page, size):
+        terms = re.findall(r'\w+', query.lower())
+        if not terms:
+            return {'hits': [], 'total': 0, 'facets': []}
+        model = searchable_models[index]
+        parent = getattr(model, model.__search_parent__)
+        vector = search_vector(model)
+        tsquery = db.func.to_tsquery(
+            db.literal_column("'simple'"),
+            ' & '.join(term + ':*' for term in terms))
+        options = 'StartSel={}, StopSel={}, MaxFragments=1, ' \
+            'MaxWords={}, MinWords={}'.format(
+                MARK_START, MARK_END, SNIPPET_WORDS, SNIPPET_WORDS // 2)
+        headlines = [
+            db.func.ts_headline(
+                db.literal_column("'simple'"), getattr(model, field),
+                tsquery, options)
+            for field in model.__searchable__]
+        matches = db.session.query(model.id) \
+            .filter(vector.op('@@')(tsquery)) \
+            .filter_by(**filters)
+        rows = matches.add_columns(
+            parent, db.func.count().over(), *headlines) \
+            .order_by(db.func.ts_rank(vector, tsquery).desc(), model.id) \
+            .offset((page - 1) * per_page).limit(per_page).all()
+        hits = [{
+            'id': row[0],
+            parent.key: row[1],
+            'highlights': dict(zip(model.__searchable__, row[3:]))}
+            for row in rows]
+        if rows:
+            total = rows[0][2]
+        else:
+            total = matches.count() if page > 1 else 0
+        facets = []
+        if total:
+            count = db.func.count()
+            facets = [list(row) for row in matches
+                      .with_entities(parent, count).group_by(parent)
+                      .order_by(count.desc(), parent).limit(size)]
+        return {'hits': hits, 'total': total, 'facets': facets}
+
+
+class MemoryBackend(object):
+    """Search index held in a dict, for benchmarks and local runs.
+
+    Documents arrive through the outbox and the indexer exactly as they
+    would with Elasticsearch. A document matches when every term is the
+    prefix of a word in one of its fields, and is scored by the boosts of
+    the fields that matched. Each process has its own index.
+    """
+    external = True
+
+    def __init__(self):
+        self.indices = {}
+        self._lock = threading.Lock()
+
+    def setup(self):
+        pass
+
+    def add(self, index, model):
+        self.bulk([('index', index, model.id, payload_for(model))])
+
+    def remove(self, index, model):
+        self.bulk([('delete', index, model.id, None)])
+
+    def bulk(self, actions):
+        with self._lock:
+            for op, index, id, payload in actions:
+                documents = self.indices.setdefault(index, {})
+                if op == 'index':
+                    model = searchable_models[index]
+                    words = {field: re.findall(r'\w+', payload[field].lower())
+                             for field in model.__searchable__}
+                    documents[id] = (payload, words)
+                else:
+                    documents.pop(id, None)
+        return set()
+
+    def purge(self, index, field, values):
+        with self._lock:
+            documents = self.indices.get(index, {})
+            for id in [id for id, (payload, words) in documents.items()
+                       if payload[field] in values]:
+                del documents[id]
+
+    def digests(self, index, start, stop, chunk_size):
+        digests = {}
+        for id, checksum in self.checksums(index, start, stop).items():
+            chunk = id // chunk_size * chunk_size
+            count, total = digests.get(chunk, (0, 0))
+            digests[chunk] = (count + 1, total + (checksum or 0))
+        return digests
+
+    def checksums(self, index, start, stop):
+        with self._lock:
+            return {
+                id: payload.get('checksum')
+                for id, (payload, words) in self.indices.get(index, {}).items()
+                if id >= start and (stop is None or id < stop)}
+
+    def query(self, index, query, filters, page, per_page):
+        hits = self._matches(index, query, filters)
+        start = (page - 1) * per_page
+        return [id for score, id, payload, words in
+                hits[start:start + per_page]], len(hits)
+
+    def facet_query(self, index, query, filters, page, per_page, size):
+        model = searchable_models[index]
+        parent = model.__search_parent__
+        terms = re.findall(r'\w+', query.lower())
+        hits = self._matches(index, query, filters)
+        counts = {}
+        for score, id, payload, words in hits:
+            counts[payload[parent]] = counts.get(payload[parent], 0) + 1
+        start = (page - 1) * per_page
+        return {
+            'hits': [{
+                'id': id,
+                parent: payload[parent],
+                'highlights': {
+                    field: snippet(payload[field], terms)
+                    for field in model.__searchable__}}
+                for score, id, payload, words in
+                hits[start:start + per_page]],
+            'total': len(hits),
+            'facets': sorted(
+                ([value, count] for value, count in counts.items()),
+                key=lambda facet: (-facet[1], facet[0]))[:size]}
+
+    def _matches(self, index, query, filters):
+        """``(-score, id, payload, words)`` of every match, best first."""
+        terms = re.findall(r'\w+', query.lower())
+        if not terms:
+            return []
+        boosts = searchable_models[index].__search_boosts__
+        with self._lock:
+            documents = list(self.indices.get(index, {}).items())
+        hits = []
+        for id, (payload, words) in documents:
+            if any(payload[field] != value
+                   for field, value in filters.items()):
+                continue
+            score = 0
+            for term in terms:
+                matched = sum(
+                    boosts.get(field, 1) for field, found in words.items()
+                    if any(word.startswith(term) for word in found))
+                if not matched:
+                    break
+                score += matched
+            else:
+                hits.append((-score, id, payload, words))
+        hits.sort(key=lambda hit: hit[:2])
+        return hits
+
+
+def id_range(start, stop):
+    """Range query bounds for ``start <= id < stop``, open if no ``stop``."""
+    bounds = {'gte': start}
+    if stop is not None:
+        bounds['lt'] = stop
+    return bounds
+
+
+def snippet(text, terms):
+    """About ``SNIPPET_WORDS`` words of ``text`` around the first match.
+
+    Words starting with one of ``terms`` are wrapped in the highlight
+    marks, the way ``ts_headline`` and the Elasticsearch highlighter do.
+    """
+    words = list(re.finditer(r'\w+', text))
+    if not words:
+        return text[:SNIPPET_CHARS]
+    matched = [word.group().lower().startswith(tuple(terms))
+               for word in words]
+    first = matched.index(True) if any(matched) else 0
+    first = max(0, min(first - 3, len(words) - SNIPPET_WORDS))
+    window = range(first, min(first + SNIPPET_WORDS, len(words)))
+    parts = []
+    position = words[window[0]].start()
+    for number in window:
+        word = words[number]
+        parts.append(text[position:word.start()])
+        if matched[number]:
+            parts.append(MARK_START + word.group() + MARK_END)
+        else:
+            parts.append(word.group())
+        position = word.end()
+    return ''.join(parts)
+
+
+def highlight_markup(fragment):
+    """Escape a highlighted fragment and turn its marks into ``<mark>``."""
+    return Markup(str(escape(fragment))
+                  .replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+def search_vector(model):
+    table = model.__table__
+    document = table.c[model.__searchable__[0]]
+    for field in model.__searchable__[1:]:
+        document = document + db.literal_column("' '") + table.c[field]
+    return db.func.to_tsvector(db.literal_column("'simple'"), document)
+
+
+def search_index_ddl(model):
+    expression = search_vector(model).compile(
+        dialect=postgresql.dialect(),
+        compile_kwargs={'literal_binds': True, 'include_table': False})
+    return db.DDL(
+        'CREATE INDEX ix_{0}_search ON {0} USING gin ({1})'.format(
+            model.__tablename__, expression)
+    ).execute_if(dialect='postgresql')
+
+
+def create_backend(app):
+    name = app.config['SEARCH_BACKEND']
+    if name == 'elasticsearch':
+        return ElasticsearchBackend(get_elasticsearch())
+    if name == 'database':
+        return DatabaseBackend()
+    if name == 'memory':
+        return MemoryBackend()
+    raise ValueError('Unknown SEARCH_BACKEND {!r}'.format(name))
+
+
+def get_elasticsearch():
+    extensions = current_app.extensions
+    if 'elasticsearch' not in extensions:
+        url = current_app.config['ELASTICSEARCH_URL']
+        extensions['elasticsearch'] = Elasticsearch(
+            [url], transport_class=TimedTransport,
+            maxsize=current_app.config['ELASTICSEARCH_CONNECTIONS'],
+        ) if url else None
+    return extensions['elasticsearch']
+
+
+def get_backend():
+    extensions = current_app.extensions
+    if 'search_backend' not in extensions:
+        extensions['search_backend'] = create_backend(current_app)
+    return extensions['search_backend']
+
+
+def add_to_index(index, model):
+    get_backend().add(index, model)
 
 
 def remove_from_index(index, model):
-    if not app.elasticsearch:
-        return
-    app.elasticsearch.delete(index=index, id=model.id)
-
-
-def query_index(index, query):
-    if not app.elasticsearch:
-        return [], 0
-    search = app.elasticsearch.search(
-        index=index,
-        body={'query': {'query_string': {'query': '*'+query+'*', 'fields': ['*']}}})
-    ids = [int(hit['_id']) for hit in search['hits']['hits']]
-    return ids, search['hits']['total']['value']
+    get_backend().remove(index, model)
+
+
+def bulk_update(actions, client=None):
+    """Apply (op, index, id, payload) actions in one request.
+
+    Returns the positions of the actions that failed and should be retried.
+    A delete of a document that is already gone counts as a success.
+    ``client`` overrides the configured backend with an Elasticsearch
+    client, or any stand-in with a compatible ``bulk(body=...)``.
+    """
+    if not actions:
+        return set()
+    backend = ElasticsearchBackend(client) if client else get_backend()
+    return backend.bulk(actions)
+
+
+def purge_index(index, field, values, client=None):
+    """Remove every document of ``index`` whose ``field`` is in ``values``."""
+    backend = ElasticsearchBackend(client) if client else get_backend()
+    backend.purge(index, field, values)
+
+
+def create_index(index, body=None, client=None):
+    client = client or get_elasticsearch()
+    client.indices.create(index=index, body=body or {})
+
+
+def swap_alias(alias, index, client=None):
+    """Point ``alias`` at ``index`` in one atomic request.
+
+    A concrete index that still carries the alias name (from before aliases
+    were used) is dropped in the same request. Returns the indices the
+    alias was moved away from.
+    """
+    client = client or get_elasticsearch()
+    actions = []
+    old = []
+    if client.indices.exists_alias(name=alias):
+        old = list(client.indices.get_alias(name=alias))
+        for name in old:
+            actions.append({'remove': {'index': name, 'alias': alias}})
+    elif client.indices.exists(index=alias):
+        actions.append({'remove_index': {'index': alias}})
+    actions.append({'add': {'index': index, 'alias': alias}})
+    client.indices.update_aliases(body={'actions': actions})
+    return [name for name in old if name != index]
+
+
+def last_page(per_page):
+    """The last page of ``per_page`` hits any search can return."""
+    return MAX_RESULT_WINDOW // per_page
+
+
+def page_window(page, per_page):
+    """``from`` and ``size`` of a page; none beyond the result window.
+
+    Elasticsearch refuses requests that reach past max_result_window, so
+    those get no hits but still their total and facets.
+    """
+    if page > last_page(per_page):
+        return {'from': 0, 'size': 0}
+    return {'from': (page - 1) * per_page, 'size': per_page}
+
+
+def query_index(index, query, filters=None, page=1, per_page=20):
+    return get_backend().query(
+        index, query, filters or {}, page, per_page)
+
+
+def facet_index(index, query, filters=None, page=1, per_page=20, size=20):
+    """One page of hits with snippets, and hit counts per parent.
+
+    Returns ``{'hits': [...], 'total': n, 'facets': [[parent, count]]}``.
+    Every hit has its ``id``, its parent id and a highlighted fragment of
+    each searchable field, so results can be shown without loading rows.
+    """
+    return get_backend().facet_query(
+        index, query, filters or {}, page, per_page, size)
@@ -0,0 +1,96 @@
+import base64
+import binascii
+import heapq
+import json
+from datetime import datetime, timedelta, timezone
+
+from notes import db
+from notes.models import Note, Notebook, Tombstone
+
+NOTEBOOK, NOTE, DELETED = range(3)
+
+
+def encode_sync_cursor(key):
+    stamp, source, id = key
+    return base64.urlsafe_b64encode(json.dumps(
+        [stamp.isoformat(), source, id]).encode('utf-8')).decode('ascii')
+
+
+def decode_sync_cursor(cursor):
+    """Return the ``(timestamp, source, id)`` key in ``cursor``.
+
+    A timestamp with a UTC offset is converted to naive UTC, the form the
+    database stores. Raises ValueError for a malformed cursor.
+    """
+    try:
+        stamp, source, id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')))
+        stamp = datetime.fromisoformat(stamp)
+        source, id = int(source), int(id)
+    except (TypeError, binascii.Error) as error:
+        raise ValueError(str(error))
+    if stamp.tzinfo is not None:
+        stamp = stamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return stamp, source, id
+
+
+def sources(user):
+    """Queries for every kind of change, with their ordering columns."""
+    return (
+        (NOTEBOOK, Notebook.query.filter(Notebook.user == user),
+         Notebook.updated_at, Notebook.id),
+        (NOTE, Note.query.filter(Note.user == user),
+         Note.updated_at, Note.id),
+        (DELETED, Tombstone.query.filter(Tombstone.user == user),
+         Tombstone.deleted_at, Tombstone.id))
+
+
+def after(query, source, stamp_column, id_column, cursor):
+    stamp, cursor_source, id = cursor
+    if source > cursor_source:
+        return query.filter(stamp_column >= stamp)
+    if source < cursor_source:
+        return query.filter(stamp_column > stamp)
+    return query.filter(db.tuple_(stamp_column, id_column) > (stamp, id))
+
+
+def changes_since(user, cursor=None, limit=500, settle=2):
+    """Notebooks and notes of ``user`` changed after ``cursor``, in order.
+
+    Returns ``(source, obj)`` pairs, the cursor to continue from and
+    whether more changes are waiting. Each source is one indexed range
+    scan and the results are merged by ``(timestamp, source, id)``.
+    Changes younger than ``settle`` seconds are held back, so a transaction
+    that commits slightly after a later one is not skipped. Once nothing
+    more is waiting the cursor moves up to that cutoff, so the cursor of
+    a user without changes keeps up with the clock and never expires.
+    """
+    until = datetime.utcnow() - timedelta(seconds=settle)
+    streams = []
+    for source, query, stamp_column, id_column in sources(user):
+        if cursor is not None:
+            query = after(query, source, stamp_column, id_column, cursor)
+        rows = query.filter(stamp_column <= until) \
+            .order_by(stamp_column, id_column).limit(limit + 1).all()
+        key = stamp_column.key
+        streams.append([((getattr(obj, key), source, obj.id), obj)
+                        for obj in rows])
+    merged = list(heapq.merge(*streams, key=lambda item: item[0]))
+    changes = merged[:limit]
+    more = len(merged) > limit
+    if more:
+        cursor = changes[-1][0]
+    else:
+        # Ranked after every source, so only later changes follow it.
+        cursor = (until, DELETED + 1, 0)
+    return ([(key[1], obj) for key, obj in changes],
+            encode_sync_cursor(cursor), more)
+
+
+def prune_tombstones(days):
+    """Delete tombstones older than ``days`` and return how many."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    count = Tombstone.query.filter(Tombstone.deleted_at < cutoff) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return count
@@ -0,0 +1,267 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from notes import db
+from notes.bulk import WRITE_ERRORS, fits, insert_returning_ids
+from notes.models import Note, Notebook, SearchableMixin
+
+CSV_COLUMNS = (
+    'notebook_id', 'notebook', 'notebook_created',
+    'note_id', 'title', 'content', 'date_created')
+
+
+def export_rows(user, chunk_size=1000):
+    """Yield every notebook of ``user`` joined with its notes.
+
+    Rows come from a server-side cursor ``chunk_size`` at a time, so memory
+    use does not depend on the size of the account. Notebooks without notes
+    appear once with empty note columns.
+    """
+    notebook = Notebook.__table__
+    note = Note.__table__
+    query = db.select([
+        notebook.c.id.label('notebook_id'),
+        notebook.c.name.label('notebook'),
+        notebook.c.date_created.label('notebook_created'),
+        note.c.id.label('note_id'),
+        note.c.title,
+        note.c.content,
+        note.c.date_created]) \
+        .select_from(notebook.outerjoin(
+            note, (note.c.notebook == notebook.c.id)
+            & (note.c.user == notebook.c.user))) \
+        .where(notebook.c.user == user) \
+        .order_by(notebook.c.id, note.c.date_created, note.c.id) \
+        .execution_options(stream_results=True)
+    result = db.session.execute(query)
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def to_ndjson(rows):
+    notebook = None
+    for row in rows:
+        if row.notebook_id != notebook:
+            notebook = row.notebook_id
+            yield json.dumps({
+                'type': 'notebook',
+                'id': row.notebook_id,
+                'name': row.notebook,
+                'date_created': isoformat(row.notebook_created)}) + '\n'
+        if row.note_id is not None:
+            yield json.dumps({
+                'type': 'note',
+                'id': row.note_id,
+                'notebook': row.notebook_id,
+                'title': row.title,
+                'content': row.content,
+                'date_created': isoformat(row.date_created)}) + '\n'
+
+
+def to_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        writer.writerow([
+            isoformat(value) if isinstance(value, datetime) else value
+            for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def from_ndjson(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def from_csv(lines):
+    for row in csv.DictReader(lines):
+        yield {'type': 'notebook', 'id': row.get('notebook_id'),
+               'name': row.get('notebook'),
+               'date_created': row.get('notebook_created')}
+        if row.get('note_id'):
+            yield {'type': 'note', 'id': row['note_id'],
+                   'notebook': row.get('notebook_id'),
+                   'title': row.get('title'),
+                   'content': row.get('content'),
+                   'date_created': row.get('date_created')}
+
+
+FORMATS = {
+    'ndjson': (to_ndjson, from_ndjson, 'application/x-ndjson'),
+    'csv': (to_csv, from_csv, 'text/csv'),
+}
+
+
+def chunked(parts, size=64 * 1024):
+    """Join small strings into pieces of about ``size`` characters."""
+    pending = []
+    length = 0
+    for part in parts:
+        pending.append(part)
+        length += len(part)
+        if length >= size:
+            yield ''.join(pending)
+            pending = []
+            length = 0
+    if pending:
+        yield ''.join(pending)
+
+
+def export_notes(user, format='ndjson', chunk_size=1000):
+    """Stream the account of ``user`` as text chunks in ``format``."""
+    write = FORMATS[format][0]
+    with db.replica_reads():
+        yield from chunked(write(export_rows(user, chunk_size)))
+
+
+class ImportFailed(Exception):
+    """A batch of records was rejected by the database.
+
+    The batches before it stay imported: ``created`` counts them, and
+    ``first`` and ``last`` number the records of the failed batch from 1.
+    """
+
+    def __init__(self, reason, first, last, created):
+        super().__init__('Records {} to {} could not be imported: {}'.format(
+            first, last, reason))
+        self.first = first
+        self.last = last
+        self.created = created
+
+
+class Importer(object):
+    """Adds exported notebooks and notes to an account in batches.
+
+    Records are buffered and written ``batch_size`` at a time with
+    ``insert_returning_ids`` (a ``COPY`` on PostgreSQL), each batch in its
+    own transaction together with its search outbox rows. A batch the
+    database rejects rolls back and raises ``ImportFailed``. Notebooks are
+    created under new ids; notes refer to the id their notebook had in the
+    file. The same notebook id can appear more than once (as in CSV) and
+    is only created the first time.
+    """
+
+    def __init__(self, user, batch_size=1000):
+        self.user = user
+        self.batch_size = batch_size
+        self.notebook_ids = {}
+        self.notebooks = []
+        self.notes = []
+        self.created = {'notebooks': 0, 'notes': 0}
+        self.skipped = 0
+        self.records = 0
+        self.batch_start = 1
+
+    def add(self, record):
+        self.records += 1
+        kind = record.get('type') if isinstance(record, dict) else None
+        if kind == 'notebook':
+            self._add_notebook(record)
+        elif kind == 'note':
+            self._add_note(record)
+        else:
+            self.skipped += 1
+        if len(self.notebooks) + len(self.notes) >= self.batch_size:
+            self.flush()
+
+    def run(self, records):
+        for record in records:
+            self.add(record)
+        self.flush()
+        return dict(self.created, skipped=self.skipped)
+
+    def flush(self):
+        try:
+            self._write()
+        except WRITE_ERRORS as error:
+            db.session.rollback()
+            reason = str(getattr(error, 'orig', error)).splitlines()[0]
+            raise ImportFailed(
+                reason, self.batch_start, self.records, dict(self.created))
+        self.created['notebooks'] += len(self.notebooks)
+        self.created['notes'] += len(self.notes)
+        self.notebooks = []
+        self.notes = []
+        self.batch_start = self.records + 1
+
+    def _write(self):
+        changes = []
+        if self.notebooks:
+            ids = insert_returning_ids(
+                Notebook.__table__, [row for source, row in self.notebooks])
+            for (source, row), id in zip(self.notebooks, ids):
+                self.notebook_ids[source] = id
+                changes.append(
+                    (Notebook.__tablename__, id, 'index', self.user))
+        if self.notes:
+            rows = []
+            for source, row in self.notes:
+                row['notebook'] = self.notebook_ids[source]
+                row['user'] = self.user
+                rows.append(row)
+            ids = insert_returning_ids(Note.__table__, rows)
+            changes += [(Note.__tablename__, id, 'index', self.user)
+                        for id in ids]
+        if changes:
+            SearchableMixin.record_changes(db.session, changes)
+            db.session.commit()
+
+    def _add_notebook(self, record):
+        source = str(record.get('id'))
+        if source in self.notebook_ids:
+            return
+        if not fits(Notebook, 'name', record.get('name')):
+            self.skipped += 1
+            return
+        self.notebook_ids[source] = None
+        self.notebooks.append((source, {
+            'name': record['name'],
+            'user': self.user,
+            'date_created': parse_date(record.get('date_created'))}))
+
+    def _add_note(self, record):
+        source = str(record.get('notebook'))
+        if (source not in self.notebook_ids
+                or not fits(Note, 'title', record.get('title'))
+                or not fits(Note, 'content', record.get('content'))):
+            self.skipped += 1
+            return
+        self.notes.append((source, {
+            'title': record['title'],
+            'content': record['content'],
+            'date_created': parse_date(record.get('date_created'))}))
+
+
+def parse_date(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return datetime.utcnow()
+
+
+def import_notes(user, lines, format='ndjson', batch_size=1000):
+    """Import text ``lines`` in ``format`` into the account of ``user``.
+
+    Returns the number of notebooks and notes created and of records
+    skipped because they were malformed. Raises ``ImportFailed`` when the
+    database rejects a batch.
+    """
+    read = FORMATS[format][1]
+    return Importer(user, batch_size).run(read(lines))
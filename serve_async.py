@@ -0,0 +1,33 @@
+"""Serve the app on gevent, many requests per process.
+
+Sockets, threads and psycopg2 are patched to yield to other greenlets
+while they wait, so one worker keeps serving while requests wait on
+PostgreSQL, Elasticsearch or SMTP. This module must be imported before
+anything else. With gunicorn:
+
+    gunicorn -k gevent -w 4 --worker-connections 100 serve_async:app
+
+or on its own for development:
+
+    python serve_async.py
+"""
+from gevent import monkey
+
+monkey.patch_all()
+
+from psycogreen.gevent import patch_psycopg  # noqa: E402
+
+patch_psycopg()
+
+from notes import create_app  # noqa: E402
+
+app = create_app()
+
+if __name__ == '__main__':
+    import os
+
+    from gevent.pywsgi import WSGIServer
+
+    port = int(os.getenv('PORT', 5000))
+    print('Serving on http://127.0.0.1:{}'.format(port))
+    WSGIServer(('127.0.0.1', port), app).serve_forever()
@@ -0,0 +1,68 @@
+import pytest
+
+from notes import create_app, db
+from notes.models import Note, Notebook, SearchOutbox, Users
+
+
+def enable_foreign_keys(connection, record):
+    connection.execute('PRAGMA foreign_keys = ON')
+
+
+@pytest.fixture
+def app():
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'SEARCH_BACKEND': 'memory',
+        'SEARCH_INDEXER_INLINE': False,
+        'SEARCH_REFRESH_INTERVAL': 0,
+        'MAIL_SUPPRESS_SEND': True,
+        'WTF_CSRF_ENABLED': False})
+    with app.app_context():
+        # SQLite only cascades deletes with its foreign keys turned on.
+        db.event.listen(db.engine, 'connect', enable_foreign_keys)
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def user(app):
+    user = Users(username='bob', email='bob@example.com', password='x')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def notebook(user):
+    notebook = Notebook(name='groceries', user=user.id)
+    db.session.add(notebook)
+    db.session.commit()
+    return notebook
+
+
+def add_notes(notebook, count, **fields):
+    notes = [Note(title=fields.get('title', 'note {}'.format(number)),
+                  content=fields.get('content', 'buy milk'),
+                  notebook=notebook.id, user=notebook.user)
+             for number in range(count)]
+    db.session.add_all(notes)
+    db.session.commit()
+    return notes
+
+
+def outbox():
+    return sorted((row.index, row.doc_id, row.op)
+                  for row in SearchOutbox.query)
+
+
+@pytest.fixture
+def client(app):
+    """A test client signed in as a newly registered user, alice."""
+    client = app.test_client()
+    client.post('/', data={
+        'username': 'alice', 'email': 'alice@example.com',
+        'password': 'secret', 'confirm_password': 'secret'})
+    return client
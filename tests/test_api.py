@@ -0,0 +1,66 @@
+from sqlalchemy.exc import OperationalError
+
+from notes.models import Note, Notebook
+
+
+def batch(client, kind, **actions):
+    response = client.post('/api/v1/{}/batch'.format(kind), json=actions)
+    return response.status_code, response.get_json()
+
+
+def statuses(results):
+    return [result['status'] for result in results]
+
+
+def test_a_batch_reports_each_item(client, notebook):
+    status, body = batch(client, 'notebooks', create=[{'name': 'books'}])
+    books = body['create'][0]['id']
+    status, body = batch(
+        client, 'notes',
+        create=[{'title': 'milk', 'content': 'buy milk', 'notebook': books},
+                {'title': '', 'content': 'x', 'notebook': books},
+                {'title': 'y', 'content': 'x', 'notebook': notebook.id},
+                'not an object'],
+        update=[{'id': True, 'title': 'x'}],
+        delete=[12345])
+    assert status == 200
+    assert statuses(body['create']) == [201, 400, 404, 400]
+    assert statuses(body['update']) == [400]
+    assert statuses(body['delete']) == [404]
+    note = Note.query.get(body['create'][0]['id'])
+    assert (note.title, note.notebook) == ('milk', books)
+    assert Note.query.count() == 1
+
+
+def test_other_users_rows_are_not_found(client, notebook):
+    status, body = batch(
+        client, 'notebooks',
+        update=[{'id': notebook.id, 'name': 'mine now'}],
+        delete=[notebook.id])
+    assert statuses(body['update'] + body['delete']) == [404, 404]
+    assert Notebook.query.get(notebook.id).name == 'groceries'
+
+
+def test_a_batch_is_written_in_one_transaction(client, monkeypatch):
+    status, body = batch(
+        client, 'notebooks', create=[{'name': 'books'}, {'name': 'films'}])
+    books, films = [result['id'] for result in body['create']]
+
+    def fail(ids, user):
+        raise OperationalError('DELETE', {}, Exception('connection lost'))
+
+    monkeypatch.setattr(Notebook, 'bulk_delete', fail)
+    status, body = batch(
+        client, 'notebooks', create=[{'name': 'music'}],
+        update=[{'id': books, 'name': 'novels'}], delete=[films])
+    assert status == 409
+    assert sorted(notebook.name for notebook in Notebook.query) == \
+        ['books', 'films']
+
+
+def test_batches_are_limited_in_size(app, client):
+    app.config['API_BATCH_LIMIT'] = 2
+    status, body = batch(client, 'notebooks', delete=[1, 2, 3])
+    assert status == 413
+    status, body = batch(client, 'notebooks', delete={'id': 1})
+    assert status == 400
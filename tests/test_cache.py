@@ -0,0 +1,141 @@
+import time
+
+from notes import db
+from notes.cache import LocalStore, SearchCache, SharedStore, \
+    get_search_cache
+from notes.indexer import SearchIndexer
+from notes.models import Note, Notebook
+from tests.conftest import add_notes
+
+
+class FakeRedis(object):
+    def __init__(self):
+        self.values = {}
+
+    def get(self, name):
+        return self.values.get(name)
+
+    def set(self, name, value, ex=None):
+        self.values[name] = value
+
+    def incr(self, name):
+        self.values[name] = int(self.values.get(name) or 0) + 1
+        return self.values[name]
+
+
+def test_local_store_evicts_the_least_recently_used():
+    store = LocalStore(maxsize=2)
+    store.set(1, 'a', 'A')
+    store.set(1, 'b', 'B')
+    store.get(1, 'a')
+    store.set(2, 'c', 'C')
+    assert store.get(1, 'b') is None
+    assert (store.get(1, 'a'), store.get(2, 'c')) == ('A', 'C')
+
+
+def test_local_store_entries_expire():
+    store = LocalStore(ttl=-1)
+    store.set(1, 'a', 'A')
+    assert store.get(1, 'a') is None
+    assert len(store) == 0
+
+
+def test_local_store_invalidates_one_user():
+    store = LocalStore()
+    store.set(1, 'a', 'A')
+    store.set(2, 'a', 'B')
+    store.invalidate(1)
+    assert (store.get(1, 'a'), store.get(2, 'a')) == (None, 'B')
+
+
+def test_shared_store_invalidates_by_generation():
+    store = SharedStore(FakeRedis())
+    store.set(1, ['note', 'milk'], [[3], 1])
+    assert store.get(1, ['note', 'milk']) == [[3], 1]
+    store.invalidate(1)
+    assert store.get(1, ['note', 'milk']) is None
+
+
+def test_fetch_loads_only_on_a_miss():
+    cache = SearchCache(LocalStore())
+    loads = []
+    for _ in range(2):
+        cache.fetch(1, 'key', lambda: loads.append(1) or 'value')
+    assert (len(loads), cache.hits, cache.misses) == (1, 1, 1)
+
+
+def test_searches_are_cached_until_the_user_writes(notebook):
+    add_notes(notebook, 1, title='milk')
+    SearchIndexer().drain()
+    cache = get_search_cache()
+    Note.search('milk', user=notebook.user)
+    Note.search(' MILK ', user=notebook.user)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    add_notes(notebook, 1, title='more milk')
+    Note.search('milk', user=notebook.user)
+    assert cache.misses == 2
+
+
+def test_a_rolled_back_write_keeps_the_cache(notebook):
+    add_notes(notebook, 1, title='milk')
+    cache = get_search_cache()
+    Note.search('milk', user=notebook.user)
+    db.session.add(Note(title='x', content='y', notebook=notebook.id,
+                        user=notebook.user))
+    db.session.flush()
+    db.session.rollback()
+    Note.search('milk', user=notebook.user)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_indexed_changes_drop_the_cached_searches(notebook):
+    add_notes(notebook, 1, title='milk')
+    hits, total = Note.search('milk', user=notebook.user)
+    assert total == 0
+    SearchIndexer().drain()
+    hits, total = Note.search('milk', user=notebook.user)
+    assert total == 1
+
+
+def later(monkeypatch, seconds):
+    now = time.monotonic() + seconds
+    monkeypatch.setattr(time, 'monotonic', lambda: now)
+
+
+def test_deletes_drop_the_cached_searches_once_visible(notebook,
+                                                       monkeypatch):
+    note, = add_notes(notebook, 1, title='milk')
+    SearchIndexer().drain()
+    db.session.delete(note)
+    db.session.commit()
+    # Searched after the commit, before the indexer ran.
+    hits, total = Note.search('milk', user=notebook.user)
+    assert total == 1
+
+    indexer = SearchIndexer(refresh_interval=10)
+    indexer.drain()
+    hits, total = Note.search('milk', user=notebook.user)
+    assert total == 1
+    later(monkeypatch, 30)
+    indexer.drain()
+    hits, total = Note.search('milk', user=notebook.user)
+    assert total == 0
+
+
+def test_purges_drop_the_cached_searches_once_visible(notebook,
+                                                      monkeypatch):
+    user = notebook.user
+    add_notes(notebook, 2, title='milk')
+    SearchIndexer().drain()
+    Notebook.bulk_delete([notebook.id], user)
+    db.session.commit()
+    hits, total = Note.search('milk', user=user)
+    assert total == 2
+
+    indexer = SearchIndexer(refresh_interval=10)
+    indexer.drain()
+    later(monkeypatch, 30)
+    indexer.drain()
+    hits, total = Note.search('milk', user=user)
+    assert total == 0
@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.mark.parametrize('command', ['reindex', 'reconcile'])
+def test_needs_elasticsearch(app, command):
+    result = app.test_cli_runner().invoke(args=[command])
+    assert result.exit_code == 1
+    assert 'The memory search backend' in result.output
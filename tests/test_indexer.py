@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+
+from notes import db
+from notes.indexer import SearchIndexer
+from notes.models import Note, SearchOutbox
+from notes.search import get_backend
+from tests.conftest import add_notes, outbox
+
+
+class FakeElasticsearch(object):
+    """Answers bulk requests, failing the documents listed in ``failing``."""
+
+    def __init__(self, failing=(), status=503, broken=False):
+        self.failing = set(failing)
+        self.status = status
+        self.broken = broken
+        self.requests = []
+
+    def bulk(self, body, refresh=None):
+        if self.broken:
+            raise ConnectionError('cluster unreachable')
+        actions = [line for line in body if len(line) == 1
+                   and next(iter(line)) in ('index', 'delete')]
+        self.requests.append((actions, refresh))
+        items = []
+        for action in actions:
+            op, meta = next(iter(action.items()))
+            status = self.status if meta['_id'] in self.failing else 200
+            items.append({op: {'status': status}})
+        return {'errors': bool(self.failing), 'items': items}
+
+
+def test_changes_are_queued_with_the_write(notebook):
+    notes = add_notes(notebook, 2)
+    assert outbox() == [('note', notes[0].id, 'index'),
+                        ('note', notes[1].id, 'index'),
+                        ('notebook', notebook.id, 'index')]
+
+
+def test_drain_indexes_the_queued_documents(notebook):
+    add_notes(notebook, 3, title='milk')
+    assert SearchIndexer().drain() == 4
+    assert outbox() == []
+    hits, total = Note.search('milk', user=notebook.user)
+    assert total == 3
+    assert get_backend().indices['notebook'][notebook.id][0]['name'] == \
+        'groceries'
+
+
+def test_repeated_changes_are_sent_once(notebook):
+    note, = add_notes(notebook, 1)
+    note.title = 'renamed'
+    db.session.commit()
+    note.title = 'renamed again'
+    db.session.commit()
+    client = FakeElasticsearch()
+    SearchIndexer(client=client).drain()
+    actions, refresh = client.requests[0]
+    assert actions.count({'index': {'_index': 'note', '_id': note.id}}) == 1
+    assert refresh is None
+
+
+def test_deleted_rows_become_deletes(notebook):
+    note, = add_notes(notebook, 1)
+    SearchIndexer().drain()
+    db.session.delete(note)
+    db.session.commit()
+    client = FakeElasticsearch()
+    SearchIndexer(client=client).drain()
+    assert client.requests[0][0] == [
+        {'delete': {'_index': 'note', '_id': note.id}}]
+
+
+def test_failed_documents_are_retried_with_backoff(notebook):
+    ok, failing = add_notes(notebook, 2)
+    indexer = SearchIndexer(
+        client=FakeElasticsearch(failing={failing.id}), base_backoff=1)
+    before = datetime.utcnow()
+    indexer.drain()
+    row, = SearchOutbox.query.all()
+    assert (row.doc_id, row.attempts) == (failing.id, 1)
+    assert row.available_at >= before + timedelta(seconds=2)
+    # Not due yet, so nothing is sent again.
+    assert indexer.drain() == 0
+
+    row.available_at = datetime.utcnow()
+    db.session.commit()
+    indexer.drain()
+    row, = SearchOutbox.query.all()
+    assert row.attempts == 2
+    assert row.available_at >= datetime.utcnow() + timedelta(seconds=3)
+
+
+def test_backoff_is_capped():
+    indexer = SearchIndexer(base_backoff=1, max_backoff=300)
+    assert indexer._backoff(3) == timedelta(seconds=8)
+    assert indexer._backoff(20) == timedelta(seconds=300)
+
+
+def test_an_unreachable_cluster_retries_every_row(notebook):
+    add_notes(notebook, 2)
+    SearchIndexer(client=FakeElasticsearch(broken=True)).drain()
+    assert SearchOutbox.query.count() == 3
+    assert {row.attempts for row in SearchOutbox.query} == {1}
+
+
+def test_deleting_a_missing_document_succeeds(notebook):
+    note, = add_notes(notebook, 1)
+    db.session.delete(note)
+    db.session.commit()
+    SearchOutbox.query.filter_by(index='notebook').delete()
+    db.session.commit()
+    client = FakeElasticsearch(failing={note.id}, status=404)
+    SearchIndexer(client=client).drain()
+    assert outbox() == []
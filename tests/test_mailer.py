@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pytest
+from flask_mail import Message
+
+from notes import mail
+from notes.mailer import MailQueue
+from notes.models import MailDeadLetter
+
+
+class FakeSMTP(object):
+    """Stands in for ``mail.connect()``; the first ``failures`` sends fail."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.opened = 0
+        self.closed = 0
+        self.sent = []
+
+    def __call__(self):
+        self.opened += 1
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.closed += 1
+
+    def send(self, message):
+        if self.failures:
+            self.failures -= 1
+            raise OSError('connection reset')
+        self.sent.append(message.subject)
+
+
+class ImmediateTimer(object):
+    """Runs retries straight away, recording the delays asked for."""
+
+    delays = []
+
+    def __init__(self, interval, function, args):
+        self.delays.append(interval)
+        self.function = function
+        self.args = args
+
+    def start(self):
+        self.function(*self.args)
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    smtp = FakeSMTP()
+    monkeypatch.setattr(mail, 'connect', smtp)
+    ImmediateTimer.delays = []
+    monkeypatch.setattr(threading, 'Timer', ImmediateTimer)
+    return smtp
+
+
+@pytest.fixture
+def mail_queue(app):
+    mail_queue = MailQueue(app, workers=1, max_retries=2, idle_timeout=0.05)
+    yield mail_queue
+    mail_queue.stop()
+
+
+def message(subject):
+    return Message(subject, sender='app@example.com',
+                   recipients=['bob@example.com'], body='hello')
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_messages_share_one_connection(smtp, mail_queue):
+    for number in range(3):
+        mail_queue.enqueue(message('mail {}'.format(number)))
+    wait_for(lambda: mail_queue.sent == 3)
+    assert smtp.sent == ['mail 0', 'mail 1', 'mail 2']
+    assert smtp.opened == 1
+    assert mail_queue.stats()['depth'] == 0
+
+
+def test_a_failed_send_reconnects_and_retries(smtp, mail_queue):
+    smtp.failures = 1
+    mail_queue.enqueue(message('welcome'))
+    wait_for(lambda: mail_queue.sent == 1)
+    assert smtp.sent == ['welcome']
+    assert (mail_queue.failed, mail_queue.dead) == (1, 0)
+    assert smtp.opened == 2
+    assert ImmediateTimer.delays == [2]
+
+
+def test_undeliverable_mail_is_recorded(app, smtp, mail_queue):
+    smtp.failures = 10
+    mail_queue.enqueue(message('reset your password'))
+    wait_for(lambda: mail_queue.dead == 1)
+    mail_queue.stop()
+    assert mail_queue.failed == 3
+    assert ImmediateTimer.delays == [2, 4]
+    letter, = MailDeadLetter.query.all()
+    assert letter.subject == 'reset your password'
+    assert letter.recipients == 'bob@example.com'
+    assert 'connection reset' in letter.error
+
+
+def test_idle_connections_are_closed(smtp, mail_queue):
+    mail_queue.enqueue(message('hello'))
+    wait_for(lambda: smtp.closed == 1)
+    assert smtp.opened == 1
@@ -0,0 +1,50 @@
+from notes import db
+from notes.models import Note, Notebook, SearchOutbox, Tombstone
+from tests.conftest import add_notes, outbox
+
+
+def statements(callback):
+    """How many SQL statements ``callback`` runs."""
+    executed = []
+
+    def count(*args):
+        executed.append(args)
+
+    db.event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        callback()
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute', count)
+    return len(executed)
+
+
+def notebook_with_notes(user, count):
+    notebook = Notebook(name='notebook', user=user)
+    db.session.add(notebook)
+    db.session.commit()
+    ids = [note.id for note in add_notes(notebook, count)]
+    return notebook.id, ids
+
+
+def test_deleting_a_notebook_cascades_to_its_notes(user):
+    id, ids = notebook_with_notes(user.id, 3)
+    other, kept = notebook_with_notes(user.id, 1)
+    SearchOutbox.query.delete()
+    db.session.commit()
+
+    Notebook.bulk_delete([id], user.id)
+    db.session.commit()
+    assert [note.id for note in Note.query] == kept
+    assert sorted((row.kind, row.object_id) for row in Tombstone.query) == \
+        sorted([('note', note) for note in ids] + [('notebook', id)])
+    assert outbox() == [('note', id, 'purge'), ('notebook', id, 'delete')]
+
+
+def test_notebook_deletes_do_not_grow_with_the_notes(user):
+    small, ids = notebook_with_notes(user.id, 2)
+    large, ids = notebook_with_notes(user.id, 50)
+    user = user.id
+    assert statements(lambda: Notebook.bulk_delete([small], user)) == \
+        statements(lambda: Notebook.bulk_delete([large], user))
+    db.session.commit()
+    assert Note.query.count() == 0
@@ -0,0 +1,78 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from notes import db
+from notes.models import Note
+from notes.pagination import decode_cursor, encode_cursor, keyset_paginate
+from tests.conftest import add_notes
+
+COLUMNS = (Note.date_created, Note.id)
+
+
+def cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+@pytest.fixture
+def notes(notebook):
+    notes = add_notes(notebook, 10)
+    # Pairs of notes share a timestamp, so the id has to break the tie.
+    start = datetime(2026, 1, 1)
+    for number, note in enumerate(notes):
+        note.date_created = start + timedelta(minutes=number // 2)
+    db.session.commit()
+    return notes
+
+
+def query(notebook):
+    return Note.query.filter_by(notebook=notebook.id, user=notebook.user)
+
+
+def test_pages_forward_cover_every_row_once(notebook, notes):
+    seen = []
+    after = None
+    while True:
+        page = keyset_paginate(query(notebook), COLUMNS, 3, after=after)
+        seen += [note.id for note in page.items]
+        if not page.has_next:
+            break
+        after = decode_cursor(page.next_cursor, COLUMNS)
+    assert seen == [note.id for note in notes]
+
+
+def test_pages_backward_mirror_the_pages_forward(notebook, notes):
+    first = keyset_paginate(query(notebook), COLUMNS, 4)
+    second = keyset_paginate(
+        query(notebook), COLUMNS, 4,
+        after=decode_cursor(first.next_cursor, COLUMNS))
+    back = keyset_paginate(
+        query(notebook), COLUMNS, 4,
+        before=decode_cursor(second.prev_cursor, COLUMNS))
+    assert [note.id for note in back.items] == \
+        [note.id for note in first.items]
+    assert not back.has_prev
+    assert not first.has_prev
+
+
+def test_cursors_round_trip(notes):
+    values = decode_cursor(encode_cursor(notes[3], COLUMNS), COLUMNS)
+    assert values == (notes[3].date_created, notes[3].id)
+
+
+@pytest.mark.parametrize('value', [
+    None,
+    '',
+    'not base64!',
+    cursor(['2026-01-01T00:00:00']),
+    cursor(['yesterday', 5]),
+    cursor([None, 5]),
+    cursor(['2026-01-01T00:00:00', 'x']),
+    cursor(['2026-01-01T00:00:00', True]),
+    cursor(['2026-01-01T00:00:00', 1.5]),
+    cursor(7),
+])
+def test_malformed_cursors_start_from_the_first_page(value):
+    assert decode_cursor(value, COLUMNS) is None
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from notes import db
+from notes.indexer import SearchIndexer
+from notes.models import Note, Notebook, SearchOutbox
+from notes.reconcile import Reconciler, database_digests
+from notes.search import get_backend
+from tests.conftest import add_notes, outbox
+
+
+@pytest.fixture
+def notes(notebook):
+    notes = add_notes(notebook, 25)
+    SearchIndexer().drain()
+    return notes
+
+
+def reconcile(**kwargs):
+    kwargs.setdefault('chunk_size', 10)
+    kwargs.setdefault('window', 2)
+    return Reconciler(**kwargs).run([Notebook, Note])
+
+
+def test_digests_match_the_index(notes):
+    assert database_digests(Note, 0, None, 10) == \
+        get_backend().digests('note', 0, None, 10)
+
+
+def test_an_index_in_sync_needs_no_repairs(notes):
+    reports = reconcile()
+    assert outbox() == []
+    assert reports['note']['done']
+    assert reports['note']['chunks'] == 3
+    assert reports['note']['differing'] == 0
+
+
+def test_drift_is_found_and_queued(notes):
+    documents = get_backend().indices['note']
+    missing, stale = notes[3], notes[17]
+    del documents[missing.id]
+    Note.query.filter_by(id=stale.id).update({'title': 'changed behind'})
+    # Beyond the last row, which only the open-ended last window sees.
+    documents[500] = documents[notes[0].id]
+    db.session.commit()
+
+    reports = reconcile()
+    assert outbox() == [('note', missing.id, 'index'),
+                        ('note', stale.id, 'index'),
+                        ('note', 500, 'delete')]
+    report = reports['note']
+    assert (report['missing'], report['stale'], report['extra']) == (1, 1, 1)
+
+    SearchIndexer().drain()
+    assert reconcile()['note']['differing'] == 0
+
+
+def test_documents_already_queued_are_left_alone(notes):
+    del get_backend().indices['note'][notes[0].id]
+    db.session.add(SearchOutbox(index='note', doc_id=notes[0].id, op='index'))
+    db.session.commit()
+    assert reconcile()['note']['missing'] == 0
+    assert outbox() == [('note', notes[0].id, 'index')]
+
+
+def test_a_run_resumes_from_its_state_file(notes, tmp_path):
+    state = tmp_path / 'reconcile.json'
+    # The notes were finished by an earlier, interrupted run.
+    state.write_text(json.dumps({'note': {
+        'position': 0, 'chunks': 3, 'differing': 0, 'missing': 0,
+        'stale': 0, 'extra': 0, 'done': True}}))
+    del get_backend().indices['note'][notes[0].id]
+    reports = reconcile(state=str(state))
+    assert outbox() == []
+    assert reports['notebook']['done']
+    assert not state.exists()
@@ -0,0 +1,63 @@
+from notes.indexer import SearchIndexer
+from notes.models import Note, Notebook
+from notes.search import MAX_RESULT_WINDOW, last_page, page_window
+from tests.conftest import add_notes
+
+
+def test_pages_beyond_the_result_window_ask_for_no_hits():
+    assert page_window(2, 12) == {'from': 12, 'size': 12}
+    assert last_page(12) * 12 <= MAX_RESULT_WINDOW
+    assert page_window(last_page(12) + 1, 12) == {'from': 0, 'size': 0}
+
+
+def test_search_pages_out_of_range_are_clamped(client):
+    client.post('/home', data={'name': 'groceries'})
+    client.post('/notes/1', data={'title': 'milk', 'content': 'buy milk'})
+    SearchIndexer().drain()
+    for page in ('0', '-3', '2', '100000'):
+        response = client.get('/search?search=milk&page=' + page)
+        assert response.status_code == 200
+        response = client.get('/1/search-note?search=milk&page=' + page)
+        assert response.status_code == 200
+
+
+def test_search_results_escape_the_notes(client):
+    client.post('/home', data={'name': 'groceries'})
+    client.post('/notes/1', data={
+        'title': '<b>milk</b>',
+        'content': '<img src=x onerror=alert(1)> milk'})
+    SearchIndexer().drain()
+    page = client.get('/search?search=milk').get_data(as_text=True)
+    assert '<b>' not in page
+    assert '<img src=x' not in page
+    assert 'b&gt;<mark>milk</mark>&lt;/b' in page
+
+
+def test_other_users_notes_are_not_found(client, notebook):
+    note, = add_notes(notebook, 1)
+    pk, id = note.id, notebook.id
+    for url in ('/update/{}/{}', '/delete/{}/{}'):
+        assert client.get(url.format(pk, id)).status_code == 404
+    response = client.post('/update/{}/{}'.format(pk, id), data={
+        'title': 'mine now', 'content': 'x'})
+    assert response.status_code == 404
+    assert Note.query.get(pk).title == 'note 0'
+
+
+def test_other_users_notebooks_are_not_found(client, notebook):
+    add_notes(notebook, 1)
+    id = notebook.id
+    assert client.get('/update/{}'.format(id)).status_code == 404
+    response = client.post('/update/{}'.format(id), data={'name': 'mine'})
+    assert response.status_code == 404
+    assert client.get('/delete/{}'.format(id)).status_code == 404
+    assert Notebook.query.get(id).name == 'groceries'
+    assert Note.query.count() == 1
+
+
+def test_owners_can_delete_their_notes(client):
+    client.post('/home', data={'name': 'groceries'})
+    client.post('/notes/1', data={'title': 'milk', 'content': 'buy milk'})
+    assert client.get('/delete/1/1').status_code == 302
+    assert client.get('/delete/1').status_code == 302
+    assert (Note.query.count(), Notebook.query.count()) == (0, 0)
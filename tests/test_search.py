@@ -0,0 +1,78 @@
+from notes import db
+from notes.indexer import SearchIndexer
+from notes.models import Note, Notebook
+from notes.search import (
+    MARK_END, MARK_START, ElasticsearchBackend, highlight_markup)
+from tests.conftest import add_notes
+
+
+class FakeElasticsearch(object):
+    """Answers every search with ``response`` and keeps the requests."""
+
+    def __init__(self, response):
+        self.response = response
+        self.bodies = []
+
+    def search(self, index, body):
+        self.bodies.append(body)
+        return self.response
+
+
+def marked(text):
+    return MARK_START + text + MARK_END
+
+
+def test_highlights_are_escaped_around_the_marks():
+    fragment = '<script>alert(1)</script> ' + marked('milk') + ' & <b>eggs'
+    assert highlight_markup(fragment) == (
+        '&lt;script&gt;alert(1)&lt;/script&gt; <mark>milk</mark> '
+        '&amp; &lt;b&gt;eggs')
+
+
+def test_marks_in_the_text_cannot_open_tags():
+    assert highlight_markup(MARK_START + '<img src=x onerror=alert(1)>') \
+        == '<mark>&lt;img src=x onerror=alert(1)&gt;'
+
+
+def test_facets_count_the_hits_per_notebook(notebook):
+    other = Notebook(name='recipes', user=notebook.user)
+    db.session.add(other)
+    db.session.commit()
+    add_notes(notebook, 1, title='milk')
+    add_notes(other, 2, title='milk', content='warm the milk')
+    add_notes(other, 1, title='eggs', content='boil the eggs')
+    SearchIndexer().drain()
+    found = Note.facet_search('milk', per_page=2, user=notebook.user)
+    assert found['total'] == 3
+    assert found['facets'] == [[other.id, 2], [notebook.id, 1]]
+    hit = found['hits'][0]
+    assert set(hit) == {'id', 'notebook', 'highlights'}
+    assert hit['highlights']['title'] == marked('milk')
+    assert len(found['hits']) == 2
+
+
+def test_elasticsearch_facets_come_from_one_search():
+    client = FakeElasticsearch({
+        'hits': {'total': {'value': 2}, 'hits': [
+            {'_id': '7', '_source': {'notebook': 3}, 'highlight': {
+                'title': ['milk and eggs'],
+                'title.prefix': [marked('milk') + ' and eggs'],
+                'content': ['buy it']}},
+            {'_id': '9', '_source': {'notebook': 4}}]},
+        'aggregations': {'facets': {'buckets': [
+            {'key': 3, 'doc_count': 1}, {'key': 4, 'doc_count': 1}]}}})
+    found = ElasticsearchBackend(client).facet_query(
+        'note', 'mil', {'user': 1}, 2, 10, 5)
+    body, = client.bodies
+    assert (body['from'], body['size']) == (10, 10)
+    assert body['aggs'] == {
+        'facets': {'terms': {'field': 'notebook', 'size': 5}}}
+    assert body['highlight']['pre_tags'] == [MARK_START]
+    assert found == {
+        'hits': [
+            {'id': 7, 'notebook': 3, 'highlights': {
+                'title': marked('milk') + ' and eggs', 'content': 'buy it'}},
+            {'id': 9, 'notebook': 4, 'highlights': {
+                'title': '', 'content': ''}}],
+        'total': 2,
+        'facets': [[3, 1], [4, 1]]}
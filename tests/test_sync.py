@@ -0,0 +1,92 @@
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+
+from notes import db
+from notes.models import Notebook, Users
+from notes.sync import (
+    DELETED, NOTE, NOTEBOOK, changes_since, decode_sync_cursor)
+from tests.conftest import add_notes
+
+
+def sync(user, cursor=None, limit=500, settle=0):
+    found, cursor, more = changes_since(user, cursor, limit, settle)
+    return ([(source, obj.id) for source, obj in found],
+            decode_sync_cursor(cursor), more)
+
+
+def test_changes_are_paged_in_order(notebook):
+    notes = add_notes(notebook, 4)
+    expected = [(NOTEBOOK, notebook.id)] + [(NOTE, note.id) for note in notes]
+    seen = []
+    cursor = None
+    more = True
+    while more:
+        found, cursor, more = sync(notebook.user, cursor, limit=2)
+        seen += found
+    assert seen == expected
+
+
+def test_only_changes_after_the_cursor_are_returned(notebook):
+    first, second = add_notes(notebook, 2)
+    found, cursor, more = sync(notebook.user)
+    second.title = 'edited'
+    db.session.commit()
+    assert sync(notebook.user, cursor)[0] == [(NOTE, second.id)]
+
+
+def test_deletes_come_back_as_tombstones(notebook):
+    note, = add_notes(notebook, 1)
+    found, cursor, more = sync(notebook.user)
+    db.session.delete(note)
+    db.session.commit()
+    found, cursor, more = changes_since(notebook.user, cursor, settle=0)
+    (source, tombstone), = found
+    assert (source, tombstone.kind, tombstone.object_id) == \
+        (DELETED, 'note', note.id)
+
+
+def test_other_users_changes_are_left_out(notebook):
+    other = Users(username='eve', email='eve@example.com', password='x')
+    db.session.add(other)
+    db.session.commit()
+    db.session.add(Notebook(name='private', user=other.id))
+    db.session.commit()
+    assert sync(notebook.user)[0] == [(NOTEBOOK, notebook.id)]
+
+
+def test_recent_changes_wait_for_the_settle_time(notebook):
+    found, cursor, more = sync(notebook.user, settle=60)
+    assert found == []
+    # The held back change is not skipped once it has settled.
+    assert sync(notebook.user, cursor)[0] == [(NOTEBOOK, notebook.id)]
+
+
+def test_the_cursor_keeps_up_without_changes(notebook):
+    notebook.updated_at = datetime.utcnow() - timedelta(days=2)
+    db.session.commit()
+    # A cursor from a day ago, of a client whose account did not change.
+    old = (datetime.utcnow() - timedelta(days=1), NOTEBOOK, notebook.id)
+    found, cursor, more = sync(notebook.user, old, settle=2)
+    assert (found, more) == ([], False)
+    assert cursor[0] > datetime.utcnow() - timedelta(seconds=3)
+    # Its next poll starts from there and still sees new changes.
+    note, = add_notes(notebook, 1)
+    assert sync(notebook.user, cursor)[0] == [(NOTE, note.id)]
+
+
+def aware_cursor(stamp):
+    return base64.urlsafe_b64encode(json.dumps(
+        [stamp.isoformat(), NOTEBOOK, 1]).encode('utf-8')).decode('ascii')
+
+
+def test_cursors_with_an_offset_become_naive_utc():
+    stamp = datetime(2026, 10, 18, 14, 0, tzinfo=timezone(timedelta(hours=2)))
+    assert decode_sync_cursor(aware_cursor(stamp)) == \
+        (datetime(2026, 10, 18, 12, 0), NOTEBOOK, 1)
+
+
+def test_the_changes_api_accepts_cursors_with_an_offset(client):
+    since = aware_cursor(datetime.now(timezone.utc))
+    response = client.get('/api/v1/changes?since=' + since)
+    assert response.status_code == 200
@@ -0,0 +1,116 @@
+import io
+import json
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from notes import db, transfer
+from notes.bulk import insert_returning_ids
+from notes.models import Notebook, Users
+from notes.transfer import (
+    FORMATS, ImportFailed, export_notes, export_rows, import_notes)
+from tests.conftest import add_notes
+
+NDJSON = json.dumps({'type': 'notebook', 'id': 1, 'name': 'groceries'})
+
+
+def test_import_takes_the_format_content_type(client):
+    response = client.post(
+        '/api/v1/import?format=ndjson', data=NDJSON,
+        content_type='application/x-ndjson; charset=utf-8')
+    assert response.status_code == 201
+    assert response.get_json()['notebooks'] == 1
+
+
+@pytest.mark.parametrize('format, content_type', [
+    ('ndjson', 'text/plain'),
+    ('ndjson', 'application/x-www-form-urlencoded'),
+    ('csv', 'application/x-ndjson'),
+])
+def test_import_rejects_other_content_types(client, format, content_type):
+    response = client.post(
+        '/api/v1/import?format=' + format, data=NDJSON,
+        content_type=content_type)
+    assert response.status_code == 415
+
+
+def records(user):
+    """The account's notebooks and notes, without their ids."""
+    return sorted(
+        (row.notebook, row.notebook_created, row.title, row.content,
+         row.date_created)
+        for row in export_rows(user))
+
+
+@pytest.fixture
+def account(notebook):
+    add_notes(notebook, 2)
+    add_notes(notebook, 1, title='quoted, "and"\nsplit', content='a,b\n"c"')
+    db.session.add(Notebook(name='empty', user=notebook.user))
+    db.session.commit()
+    return notebook.user
+
+
+@pytest.mark.parametrize('format', ['ndjson', 'csv'])
+def test_exports_import_as_they_were(account, format):
+    copy = Users(username='copy', email='copy@example.com', password='x')
+    db.session.add(copy)
+    db.session.commit()
+    exported = ''.join(export_notes(account, format))
+    counts = import_notes(copy.id, io.StringIO(exported), format)
+    assert counts == {'notebooks': 2, 'notes': 3, 'skipped': 0}
+    assert records(copy.id) == records(account)
+
+
+@pytest.mark.parametrize('format', ['ndjson', 'csv'])
+def test_the_api_round_trips_an_account(client, format):
+    client.post('/api/v1/notebooks/batch', json={'create': [
+        {'name': 'groceries'}, {'name': 'empty'}]})
+    notebook = Notebook.query.filter_by(name='groceries').one()
+    client.post('/api/v1/notes/batch', json={'create': [
+        {'title': 'milk', 'content': 'buy milk', 'notebook': notebook.id}]})
+    before = records(notebook.user)
+    response = client.get('/api/v1/export?format=' + format)
+    assert response.mimetype == FORMATS[format][2]
+    response = client.post(
+        '/api/v1/import?format=' + format, data=response.get_data(),
+        content_type=FORMATS[format][2])
+    assert response.status_code == 201
+    assert response.get_json() == {'notebooks': 2, 'notes': 1, 'skipped': 0}
+    assert records(notebook.user) == sorted(before * 2)
+
+
+def fail_on_batch(monkeypatch, number):
+    calls = []
+
+    def insert(table, rows):
+        calls.append(table)
+        if len(calls) == number:
+            raise IntegrityError('INSERT', {}, Exception('duplicate key'))
+        return insert_returning_ids(table, rows)
+
+    monkeypatch.setattr(transfer, 'insert_returning_ids', insert)
+
+
+def test_a_rejected_batch_stops_the_import(user, monkeypatch):
+    fail_on_batch(monkeypatch, 2)
+    lines = [json.dumps({'type': 'notebook', 'id': id, 'name': str(id)})
+             for id in range(5)]
+    with pytest.raises(ImportFailed) as failed:
+        import_notes(user.id, lines, batch_size=2)
+    assert (failed.value.first, failed.value.last) == (3, 4)
+    assert failed.value.created == {'notebooks': 2, 'notes': 0}
+    assert sorted(notebook.name for notebook in Notebook.query) == ['0', '1']
+
+
+def test_the_api_answers_a_rejected_batch_with_422(client, monkeypatch):
+    fail_on_batch(monkeypatch, 1)
+    response = client.post(
+        '/api/v1/import?format=ndjson', data=NDJSON,
+        content_type='application/x-ndjson')
+    assert response.status_code == 422
+    assert response.get_json() == {
+        'error': 'Records 1 to 1 could not be imported: duplicate key',
+        'first': 1, 'last': 1,
+        'created': {'notebooks': 0, 'notes': 0}}
+    assert Notebook.query.count() == 0